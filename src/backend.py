@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncGenerator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.txstore import TxStore
+
+# https://blockstream.info/nojs/
+# https://github.com/Blockstream/esplora/blob/master/API.md
+MAINNET_URL = 'https://blockstream.info/api'
+TESTNET_URL = 'https://blockstream.info/testnet/api'
+
+
+class TxBackend(ABC):
+    '''source of raw transactions used by TxFetcher'''
+    @abstractmethod
+    def fetch_raw(self, tx_id: str, testnet: bool = False) -> bytes:
+        ...
+
+
+class HttpBackend(TxBackend):
+    '''
+    Esplora style REST API (GET <url>/tx/<tx_id>/hex).
+    Connections are kept alive in a pool shared by all lookups.
+    '''
+    def __init__(self,
+                 mainnet_url: str = MAINNET_URL,
+                 testnet_url: str = TESTNET_URL,
+                 pool_size: int = 16,
+                 timeout: float = 30) -> None:
+        self.mainnet_url = mainnet_url
+        self.testnet_url = testnet_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_url(self, testnet: bool = False) -> str:
+        return self.testnet_url if testnet else self.mainnet_url
+
+    def fetch_raw(self, tx_id: str, testnet: bool = False) -> bytes:
+        url = f'{self.get_url(testnet)}/tx/{tx_id}/hex'
+        response = self.session.get(url, timeout=self.timeout)
+        if response.status_code != 200:
+            raise ValueError(f'HTTP {response.status_code}: {response.text}')
+        try:
+            return bytes.fromhex(response.text.strip())
+        except ValueError:
+            raise ValueError(f'unexpected response: {response.text}')
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncHttpBackend:
+    '''
+    asyncio version of HttpBackend.
+    Each lookup is a plain HTTP/1.1 GET over asyncio streams, so no extra
+    dependency is needed. Up to pool_size idle connections per host are
+    kept alive for later lookups from the same event loop, and closed
+    when asyncio.run ends that loop (or by close()).
+    '''
+    def __init__(self,
+                 mainnet_url: str = MAINNET_URL,
+                 testnet_url: str = TESTNET_URL,
+                 pool_size: int = 16,
+                 timeout: float = 30) -> None:
+        self.mainnet_url = mainnet_url
+        self.testnet_url = testnet_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # (host, port, https) -> idle (loop, reader, writer)
+        self.idle: dict[tuple[str, int, bool], list[tuple[
+            asyncio.AbstractEventLoop, asyncio.StreamReader,
+            asyncio.StreamWriter]]] = {}
+        # event loop -> async generator closing its connections, see _connect
+        self._guards: dict[asyncio.AbstractEventLoop, AsyncGenerator] = {}
+
+    def get_url(self, testnet: bool = False) -> str:
+        return self.testnet_url if testnet else self.mainnet_url
+
+    async def fetch_raw(self, tx_id: str, testnet: bool = False) -> bytes:
+        url = f'{self.get_url(testnet)}/tx/{tx_id}/hex'
+        body = await asyncio.wait_for(self.get(url), self.timeout)
+        try:
+            return bytes.fromhex(body.strip())
+        except ValueError:
+            raise ValueError(f'unexpected response: {body}')
+
+    async def get(self, url: str) -> str:
+        '''body of the response to GET url, ValueError unless it is 200 OK'''
+        parts = urlsplit(url)
+        is_https = parts.scheme == 'https'
+        host = parts.hostname or ''
+        key = (host, parts.port or (443 if is_https else 80), is_https)
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        request = f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n\r\n'.encode()
+        fresh = False
+        while True:
+            reader, writer, reused = await self._connect(key, fresh)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                if not status_line and reused:
+                    raise ConnectionResetError('idle connection was closed')
+                status, body, keep_alive = await self._read_response(
+                    status_line, reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self._close(writer)
+                if not reused:
+                    raise
+                # the server closed the idle connection, try once more
+                # on a new one
+                fresh = True
+                continue
+            except BaseException:
+                # the connection is in an unknown state, e.g. on timeout
+                await self._close(writer)
+                raise
+            break
+        if keep_alive:
+            self._release(key, reader, writer)
+        else:
+            await self._close(writer)
+        if status != 200:
+            raise ValueError(f'HTTP {status}: {body}')
+        return body
+
+    async def _connect(self, key: tuple[str, int, bool],
+                       fresh: bool = False) -> tuple[
+            asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        '''(reader, writer, whether it is an idle connection reused)'''
+        loop = asyncio.get_running_loop()
+        if loop not in self._guards:
+            # asyncio.run closes the async generators started in its loop
+            # (shutdown_asyncgens) while the loop still runs, which closes
+            # the connections left idle in it
+            guard = self._close_at_loop_end(loop)
+            await guard.__anext__()
+            self._guards[loop] = guard
+        idle = self.idle.get(key, [])
+        others = []
+        found = None
+        while idle and not fresh:
+            idle_loop, reader, writer = idle.pop()
+            if idle_loop is not loop:
+                if idle_loop.is_closed():
+                    self._discard(idle_loop, writer)
+                else:
+                    others.append((idle_loop, reader, writer))
+            elif writer.is_closing() or reader.at_eof():
+                await self._close(writer)
+            else:
+                found = reader, writer
+                break
+        idle.extend(reversed(others))
+        if found is not None:
+            return found[0], found[1], True
+        host, port, is_https = key
+        reader, writer = await asyncio.open_connection(host, port,
+                                                       ssl=is_https)
+        return reader, writer, False
+
+    def _release(self, key: tuple[str, int, bool],
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        idle = self.idle.setdefault(key, [])
+        if len(idle) < self.pool_size:
+            idle.append((asyncio.get_running_loop(), reader, writer))
+        else:
+            writer.close()
+
+    async def _close_at_loop_end(
+            self, loop: asyncio.AbstractEventLoop) -> AsyncGenerator[None, None]:
+        try:
+            yield
+        finally:
+            self._guards.pop(loop, None)
+            await self._close_idle(loop)
+
+    async def _close_idle(self, loop: asyncio.AbstractEventLoop) -> None:
+        closing = []
+        for key, idle in list(self.idle.items()):
+            kept = [entry for entry in idle if entry[0] is not loop]
+            closing.extend(entry[2] for entry in idle if entry[0] is loop)
+            if kept:
+                self.idle[key] = kept
+            else:
+                del self.idle[key]
+        for writer in closing:
+            await self._close(writer)
+
+    @staticmethod
+    def _discard(loop: asyncio.AbstractEventLoop,
+                 writer: asyncio.StreamWriter) -> None:
+        # a connection of another event loop can only be closed by that loop
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(writer.close)
+            return
+        try:
+            writer.close()
+        except RuntimeError:
+            # the loop was closed without closing its async generators,
+            # the socket is closed when the transport is collected
+            pass
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter) -> None:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    @staticmethod
+    async def _read_response(status_line: bytes,
+                             reader: asyncio.StreamReader) -> tuple[int, str, bool]:
+        '''(status code, body, whether the connection can be reused)'''
+        fields = status_line.decode(errors='replace').split(None, 2)
+        if len(fields) < 2 or not fields[0].startswith('HTTP/') \
+                or not fields[1].isdigit():
+            raise ValueError(f'bad status line: {status_line!r}')
+        status = int(fields[1])
+        keep_alive = fields[0] == 'HTTP/1.1'
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode(errors='replace').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        if connection == 'close':
+            keep_alive = False
+        elif connection == 'keep-alive':
+            keep_alive = True
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # trailers up to the empty line
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            # the body ends when the server closes the connection
+            body = await reader.read()
+            keep_alive = False
+        return status, body.decode(errors='replace'), keep_alive
+
+    async def close(self) -> None:
+        '''closes the idle connections of the running event loop'''
+        await self._close_idle(asyncio.get_running_loop())
+
+
+class StoreBackend(TxBackend):
+    '''local TxStore file, e.g. for offline use'''
+    def __init__(self, store: TxStore) -> None:
+        self.store = store
+
+    def fetch_raw(self, tx_id: str, testnet: bool = False) -> bytes:
+        raw = self.store.get(tx_id)
+        if raw is None:
+            raise ValueError(f'not found in store: {tx_id}')
+        return raw
+
+
+class StubServer:
+    '''
+    In-process HTTP server answering GET .../tx/<tx_id>/hex
+    from a dict of raw transactions, as a stand-in for the REST API.
+    '''
+    def __init__(self, txs: Optional[dict[str, bytes]] = None) -> None:
+        self.txs: dict[str, bytes] = txs if txs is not None else {}
+        self.n_requests = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> StubServer:
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _handler_class(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self) -> None:
+                with stub._lock:
+                    stub.n_requests += 1
+                parts = self.path.rstrip('/').split('/')
+                raw = None
+                if len(parts) >= 3 and parts[-3] == 'tx' \
+                        and parts[-1] == 'hex':
+                    raw = stub.txs.get(parts[-2])
+                if raw is None:
+                    status, body = 404, b'Transaction not found'
+                else:
+                    status, body = 200, raw.hex().encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from src.block import Block
+from src.helper import read_varint
+from src.tx import Tx
+
+# network magic bytes at the start of each record
+MAINNET_MAGIC = bytes.fromhex('f9beb4d9')
+TESTNET_MAGIC = bytes.fromhex('0b110907')
+REGTEST_MAGIC = bytes.fromhex('fabfb5da')
+
+
+class RawBlock:
+    '''
+    Block read from a blk*.dat file: the header is parsed, transactions
+    are only parsed when iterated.
+    '''
+    def __init__(self, raw: bytes, offset: int, testnet: bool = False) -> None:
+        self.raw = raw
+        # position of the block (after magic and size) in the file
+        self.offset = offset
+        self.testnet = testnet
+        self.header = Block.parse(BytesIO(raw[:80]))
+
+    def __repr__(self) -> str:
+        return f'{self.header.hash().hex()} at {self.offset}'
+
+    def n_txs(self) -> int:
+        return read_varint(BytesIO(self.raw[80:89]))
+
+    def txs(self) -> Iterator[Tx]:
+        stream = BytesIO(self.raw)
+        stream.seek(80)
+        for _ in range(read_varint(stream)):
+            yield Tx.parse(stream, testnet=self.testnet)
+
+    def block(self) -> Block:
+        '''header and all transactions'''
+        return Block.parse_full(BytesIO(self.raw), testnet=self.testnet)
+
+
+def read_blocks(filename: str,
+                magic: bytes = MAINNET_MAGIC,
+                testnet: bool = False) -> Iterator[RawBlock]:
+    '''
+    Blocks of a blk*.dat file, i.e. records of <magic 4><size 4><block>,
+    in file order (not necessarily height order).
+    The file is memory-mapped and only one block is copied at a time.
+    Zero bytes at the end (preallocated space) end the file.
+    '''
+    with open(filename, 'rb') as reader:
+        try:
+            data = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        with data:
+            offset = 0
+            end = len(data)
+            while offset + 8 <= end:
+                record_magic = data[offset:offset + 4]
+                if record_magic != magic:
+                    if record_magic == b'\x00\x00\x00\x00':
+                        break
+                    raise ValueError(f'{filename}: bad magic at {offset}')
+                size = int.from_bytes(data[offset + 4:offset + 8], 'little')
+                start = offset + 8
+                if start + size > end:
+                    raise ValueError(f'{filename}: truncated block at {offset}')
+                yield RawBlock(data[start:start + size], start, testnet)
+                offset = start + size
+
+
+def _map_file(filename: str, fn: Callable[[RawBlock], Any], magic: bytes,
+              testnet: bool) -> list:
+    return [fn(raw_block) for raw_block in read_blocks(filename, magic, testnet)]
+
+
+def map_blocks(filenames: Iterable[str],
+               fn: Callable[[RawBlock], Any],
+               magic: bytes = MAINNET_MAGIC,
+               testnet: bool = False,
+               processes: Optional[int] = None) -> Iterator[tuple[str, list]]:
+    '''
+    Applies fn to every block of the files, one file per process, and
+    yields (filename, results) in the order of filenames.
+    fn has to be picklable, i.e. a module level function.
+    '''
+    filenames = list(filenames)
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(_map_file, filename, fn, magic, testnet)
+                   for filename in filenames]
+        for filename, future in zip(filenames, futures):
+            yield filename, future.result()
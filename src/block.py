@@ -1,42 +1,116 @@
 from __future__ import annotations
 
 from io import BytesIO
+from typing import Optional
 
-from src.helper import (MAX_TARGET, bits_to_target, hash256,
-                        int_to_little_endian, little_endian_to_int)
+from src.helper import (MAX_TARGET, bits_to_target, encode_varint, hash256,
+                        int_to_little_endian, little_endian_to_int,
+                        merkle_root, merkle_root_mutated, read_varint)
+from src.tx import Tx
+
+
+# fields whose change invalidates the cached serialization and hash
+HEADER_FIELDS = frozenset(
+    ['version', 'prev_block', 'merkle_root', 'timestamp', 'bits', 'nonce'])
 
 
 class Block:
+    __slots__ = ('version', 'prev_block', 'merkle_root', 'timestamp', 'bits',
+                 'nonce', 'txs', '_serialized', '_hash', '_target')
+
     def __init__(self, version: int, prev_block: bytes, merkle_root: bytes,
-                 timestamp: int, bits: bytes, nonce: bytes):
+                 timestamp: int, bits: bytes, nonce: bytes,
+                 txs: Optional[list[Tx]] = None):
+        self._serialized: Optional[bytes] = None
+        # hash256 of the header in internal (little endian) byte order
+        self._hash: Optional[bytes] = None
+        self._target: Optional[int] = None
         self.version = version
         self.prev_block = prev_block
         self.merkle_root = merkle_root
         self.timestamp = timestamp
         self.bits = bits
         self.nonce = nonce
+        # None if only the header was parsed
+        self.txs = txs
+
+    def __setattr__(self, name: str, value) -> None:
+        object.__setattr__(self, name, value)
+        if name in HEADER_FIELDS:
+            object.__setattr__(self, '_serialized', None)
+            object.__setattr__(self, '_hash', None)
+            if name == 'bits':
+                object.__setattr__(self, '_target', None)
 
     @classmethod
     def parse(cls, stream: BytesIO) -> Block:
-        version = little_endian_to_int(stream.read(4))
-        prev_block = stream.read(32)[::-1]
-        merkle_root = stream.read(32)[::-1]
-        timestamp = little_endian_to_int(stream.read(4))
-        bits = stream.read(4)
-        nonce = stream.read(4)
-        return cls(version, prev_block, merkle_root, timestamp, bits, nonce)
+        raw = stream.read(80)
+        if len(raw) != 80:
+            raise SyntaxError('parsing block header failed')
+        version = little_endian_to_int(raw[:4])
+        prev_block = raw[4:36][::-1]
+        merkle_root = raw[36:68][::-1]
+        timestamp = little_endian_to_int(raw[68:72])
+        bits = raw[72:76]
+        nonce = raw[76:80]
+        block = cls(version, prev_block, merkle_root, timestamp, bits, nonce)
+        block._serialized = raw
+        return block
 
-    def serialize(self) -> bytes:
-        result = int_to_little_endian(self.version, 4)
-        result += self.prev_block[::-1]
-        result += self.merkle_root[::-1]
-        result += int_to_little_endian(self.timestamp, 4)
-        result += self.bits
-        result += self.nonce
+    @classmethod
+    def parse_full(cls, stream: BytesIO, testnet: bool = False) -> Block:
+        '''header followed by the transactions'''
+        block = cls.parse(stream)
+        n_txs = read_varint(stream)
+        block.txs = [Tx.parse(stream, testnet=testnet) for _ in range(n_txs)]
+        return block
+
+    def serialize_full(self) -> bytes:
+        if self.txs is None:
+            raise ValueError('transactions are not available')
+        result = self.serialize()
+        result += encode_varint(len(self.txs))
+        for tx in self.txs:
+            result += tx.serialize_segwit()
         return result
 
+    def serialize(self) -> bytes:
+        if self._serialized is None:
+            result = int_to_little_endian(self.version, 4)
+            result += self.prev_block[::-1]
+            result += self.merkle_root[::-1]
+            result += int_to_little_endian(self.timestamp, 4)
+            result += self.bits
+            result += self.nonce
+            self._serialized = result
+        return self._serialized
+
+    def _digest(self) -> bytes:
+        if self._hash is None:
+            self._hash = hash256(self.serialize())
+        return self._hash
+
     def hash(self) -> bytes:
-        return hash256(self.serialize())[::-1]
+        return self._digest()[::-1]
+
+    def tx_hashes(self) -> list[bytes]:
+        '''tx ids in internal (little endian) byte order'''
+        if self.txs is None:
+            raise ValueError('transactions are not available')
+        return [hash256(tx.serialize()) for tx in self.txs]
+
+    def compute_merkle_root(self) -> bytes:
+        return merkle_root(self.tx_hashes())[::-1]
+
+    def validate_merkle_root(self) -> bool:
+        '''
+        the merkle root of the transactions matches the header,
+        and no paired hashes are equal (duplicated transactions)
+        '''
+        if not self.txs:
+            return False
+        root, mutated = merkle_root_mutated(self.tx_hashes())
+        return not mutated and root[::-1] == self.merkle_root
 
     def bip9(self) -> bool:
         return self.version >> 29 == 0b001
@@ -48,7 +122,9 @@ class Block:
         return (self.version >> 1) & 1 == 1
 
     def target(self) -> int:
-        return bits_to_target(self.bits)
+        if self._target is None:
+            self._target = bits_to_target(self.bits)
+        return self._target
 
     def difficulty(self) -> float:
         target = self.target()
@@ -56,7 +132,6 @@ class Block:
         return diff
 
     def check_pow(self) -> bool:
-        h = hash256(self.serialize())
-        proof = little_endian_to_int(h)
+        proof = little_endian_to_int(self._digest())
         target = self.target()
         return proof < target
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+from io import BytesIO
+from typing import Iterable, Iterator, Mapping
+
+from src.block import Block
+from src.helper import encode_varint, read_varint
+from src.tx import TxOut
+
+# BIP158 basic filter parameters
+BASIC_FILTER_P = 19
+BASIC_FILTER_M = 784931
+
+MASK64 = 0xffffffffffffffff
+
+
+def _rotl(x: int, b: int) -> int:
+    return ((x << b) | (x >> (64 - b))) & MASK64
+
+
+def siphash(k0: int, k1: int, data: bytes) -> int:
+    '''SipHash-2-4 of data with the 128 bit key k0, k1 (64 bit each)'''
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+
+    def rounds(n: int) -> None:
+        nonlocal v0, v1, v2, v3
+        for _ in range(n):
+            v0 = (v0 + v1) & MASK64
+            v1 = _rotl(v1, 13) ^ v0
+            v0 = _rotl(v0, 32)
+            v2 = (v2 + v3) & MASK64
+            v3 = _rotl(v3, 16) ^ v2
+            v0 = (v0 + v3) & MASK64
+            v3 = _rotl(v3, 21) ^ v0
+            v2 = (v2 + v1) & MASK64
+            v1 = _rotl(v1, 17) ^ v2
+            v2 = _rotl(v2, 32)
+
+    n_body = len(data) - len(data) % 8
+    for i in range(0, n_body, 8):
+        m = int.from_bytes(data[i:i + 8], 'little')
+        v3 ^= m
+        rounds(2)
+        v0 ^= m
+    m = ((len(data) & 0xff) << 56) | int.from_bytes(data[n_body:], 'little')
+    v3 ^= m
+    rounds(2)
+    v0 ^= m
+    v2 ^= 0xff
+    rounds(4)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+def hashed_set(items: Iterable[bytes], key: bytes, f: int) -> list[int]:
+    '''items mapped uniformly to [0, f) with siphash, sorted and deduplicated'''
+    k0 = int.from_bytes(key[:8], 'little')
+    k1 = int.from_bytes(key[8:16], 'little')
+    return sorted({(siphash(k0, k1, item) * f) >> 64 for item in items})
+
+
+def golomb_encode(values: list[int], p: int) -> bytes:
+    '''
+    Golomb-Rice coding of the differences of sorted values: quotient in
+    unary, then p bits of remainder, written MSB first into whole bytes.
+    '''
+    result = bytearray()
+    acc = 0
+    n_acc = 0
+    mask = (1 << p) - 1
+    last = 0
+    for value in values:
+        delta = value - last
+        last = value
+        q = delta >> p
+        # q ones, a zero, then the remainder
+        acc = (((acc << (q + 1)) | (((1 << q) - 1) << 1)) << p) | (delta & mask)
+        n_acc += q + 1 + p
+        while n_acc >= 8:
+            n_acc -= 8
+            result.append((acc >> n_acc) & 0xff)
+        acc &= (1 << n_acc) - 1
+    if n_acc:
+        result.append((acc << (8 - n_acc)) & 0xff)
+    return bytes(result)
+
+
+def golomb_decode(data: bytes, n: int, p: int) -> Iterator[int]:
+    '''yields the n sorted values written by golomb_encode'''
+    stream = iter(data)
+    acc = 0
+    n_acc = 0
+    last = 0
+    for _ in range(n):
+        q = 0
+        while True:
+            if n_acc == 0:
+                acc = next(stream)
+                n_acc = 8
+            n_acc -= 1
+            if not (acc >> n_acc) & 1:
+                break
+            q += 1
+        while n_acc < p:
+            acc = (acc << 8) | next(stream)
+            n_acc += 8
+        n_acc -= p
+        last += (q << p) | ((acc >> n_acc) & ((1 << p) - 1))
+        acc &= (1 << n_acc) - 1
+        yield last
+
+
+class GCSFilter:
+    '''
+    Golomb-coded set (BIP158) of n items, queried with the 16 byte key
+    the items were hashed with (the first bytes of the block hash).
+    '''
+    def __init__(self, n: int, data: bytes, key: bytes,
+                 p: int = BASIC_FILTER_P, m: int = BASIC_FILTER_M) -> None:
+        self.n = n
+        self.data = data
+        self.key = key
+        self.p = p
+        self.m = m
+
+    @classmethod
+    def build(cls, items: Iterable[bytes], key: bytes,
+              p: int = BASIC_FILTER_P, m: int = BASIC_FILTER_M) -> GCSFilter:
+        unique_items = set(items)
+        values = hashed_set(unique_items, key, len(unique_items) * m)
+        return cls(len(unique_items), golomb_encode(values, p), key, p, m)
+
+    @classmethod
+    def parse(cls, raw: bytes, key: bytes,
+              p: int = BASIC_FILTER_P, m: int = BASIC_FILTER_M) -> GCSFilter:
+        stream = BytesIO(raw)
+        n = read_varint(stream)
+        return cls(n, stream.read(), key, p, m)
+
+    def serialize(self) -> bytes:
+        return encode_varint(self.n) + self.data
+
+    def values(self) -> Iterator[int]:
+        return golomb_decode(self.data, self.n, self.p)
+
+    def match(self, item: bytes) -> bool:
+        return self.match_any([item])
+
+    def match_any(self, items: Iterable[bytes]) -> bool:
+        '''True if any of items is (probably) in the set'''
+        if self.n == 0:
+            return False
+        query = hashed_set(items, self.key, self.n * self.m)
+        if not query:
+            return False
+        # walk both sorted lists at once
+        i = 0
+        for value in self.values():
+            while query[i] < value:
+                i += 1
+                if i == len(query):
+                    return False
+            if query[i] == value:
+                return True
+        return False
+
+
+def basic_filter_elements(block: Block,
+                          utxos: Mapping[tuple[bytes, int], TxOut]) -> set[bytes]:
+    '''
+    ScriptPubKeys of the outputs of block (except empty and OP_RETURN ones)
+    and of the outputs spent by it, looked up in utxos.
+    '''
+    if block.txs is None:
+        raise ValueError('transactions are not available')
+    elements = set()
+    for tx in block.txs:
+        for tx_out in tx.tx_outs:
+            raw = tx_out.script_pub_key.raw_serialize()
+            if raw and raw[0] != 0x6a:
+                elements.add(raw)
+        if tx.is_coinbase():
+            continue
+        for tx_in in tx.tx_ins:
+            raw = utxos[tx_in.prev_tx, tx_in.prev_index].script_pub_key.raw_serialize()
+            if raw:
+                elements.add(raw)
+    return elements
+
+
+def basic_filter(block: Block,
+                 utxos: Mapping[tuple[bytes, int], TxOut]) -> GCSFilter:
+    key = block.hash()[::-1][:16]
+    return GCSFilter.build(basic_filter_elements(block, utxos), key)
+
+
+def match_filters(filters: Iterable[tuple[bytes, bytes]],
+                  scripts: Iterable[bytes]) -> list[bytes]:
+    '''
+    Hashes of the blocks, given as (block hash, serialized basic filter),
+    whose filter matches any of scripts.
+    '''
+    scripts = list(scripts)
+    result = []
+    for block_hash, raw in filters:
+        gcs = GCSFilter.parse(raw, block_hash[::-1][:16])
+        if gcs.match_any(scripts):
+            result.append(block_hash)
+    return result
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import math
+from typing import Iterable, Iterator
+
+from src.block import Block
+from src.helper import (encode_varint, int_to_little_endian,
+                        little_endian_to_int, murmur3)
+from src.merkleblock import MerkleBlock, MerkleTree
+from src.script import Script
+from src.tx import Tx
+
+BIP37_CONSTANT = 0xfba4c795
+MAX_FILTER_SIZE = 36000
+MAX_HASH_FUNCS = 50
+
+# nFlags of filterload
+BLOOM_UPDATE_NONE = 0
+BLOOM_UPDATE_ALL = 1
+
+
+def pushed_data(script: Script) -> Iterator[bytes]:
+    '''
+    Non-empty data pushed by script, up to the first malformed push, as
+    in bitcoind: scripts which do not decode still occur on chain (e.g.
+    in coinbase ScriptSigs), so they must not end a scan.
+    '''
+    raw = script.raw_serialize()
+    length = len(raw)
+    i = 0
+    while i < length:
+        op = raw[i]
+        i += 1
+        if 1 <= op <= 75:
+            data_length = op
+        elif 76 <= op <= 78:
+            # OP_PUSHDATA1, OP_PUSHDATA2, OP_PUSHDATA4
+            n = 1 << (op - 76)
+            if i + n > length:
+                return
+            data_length = little_endian_to_int(raw[i:i + n])
+            i += n
+        else:
+            continue
+        if i + data_length > length:
+            return
+        if data_length:
+            yield raw[i:i + data_length]
+        i += data_length
+
+
+class BloomFilter:
+    '''
+    BIP37 bloom filter of size bytes, kept as the bytearray sent in
+    filterload (bit i is bit i % 8 of byte i // 8).
+    '''
+    def __init__(self, size: int, function_count: int, tweak: int,
+                 flags: int = BLOOM_UPDATE_ALL) -> None:
+        self.size = size
+        self.function_count = function_count
+        self.tweak = tweak
+        self.flags = flags
+        self.bit_field = bytearray(size)
+        self.n_bits = size * 8
+        self.seeds = [(i * BIP37_CONSTANT + tweak) & 0xffffffff
+                      for i in range(function_count)]
+
+    @classmethod
+    def for_elements(cls, n_elements: int, false_positive_rate: float,
+                     tweak: int, flags: int = BLOOM_UPDATE_ALL) -> BloomFilter:
+        '''sized as in BIP37 for n_elements at false_positive_rate'''
+        ln2 = math.log(2)
+        size = -n_elements * math.log(false_positive_rate) / (ln2 * ln2) / 8
+        size = max(1, min(int(size), MAX_FILTER_SIZE))
+        function_count = int(size * 8 / max(n_elements, 1) * ln2)
+        function_count = max(1, min(function_count, MAX_HASH_FUNCS))
+        return cls(size, function_count, tweak, flags)
+
+    def _bits(self, item: bytes) -> list[int]:
+        n_bits = self.n_bits
+        return [murmur3(item, seed) % n_bits for seed in self.seeds]
+
+    def add(self, item: bytes) -> None:
+        bit_field = self.bit_field
+        for bit in self._bits(item):
+            bit_field[bit >> 3] |= 1 << (bit & 7)
+
+    def add_many(self, items: Iterable[bytes]) -> None:
+        bit_field = self.bit_field
+        n_bits = self.n_bits
+        seeds = self.seeds
+        for item in items:
+            for seed in seeds:
+                bit = murmur3(item, seed) % n_bits
+                bit_field[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, item: bytes) -> bool:
+        bit_field = self.bit_field
+        for bit in self._bits(item):
+            if not bit_field[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def filter_bytes(self) -> bytes:
+        return bytes(self.bit_field)
+
+    def filterload(self) -> bytes:
+        '''payload of the filterload message'''
+        result = encode_varint(self.size)
+        result += self.filter_bytes()
+        result += int_to_little_endian(self.function_count, 4)
+        result += int_to_little_endian(self.tweak, 4)
+        result += int_to_little_endian(self.flags, 1)
+        return result
+
+    def matches_tx(self, tx: Tx) -> bool:
+        '''
+        BIP37 matching: the tx hash, data pushed in a ScriptPubKey,
+        a spent outpoint or data pushed in a ScriptSig.
+        With BLOOM_UPDATE_ALL, outpoints of matched outputs are added,
+        so that transactions spending them match as well.
+        '''
+        tx_hash = tx.hash()[::-1]
+        matched = tx_hash in self
+        for i, tx_out in enumerate(tx.tx_outs):
+            for data in pushed_data(tx_out.script_pub_key):
+                if data in self:
+                    matched = True
+                    if self.flags == BLOOM_UPDATE_ALL:
+                        self.add(tx_hash + int_to_little_endian(i, 4))
+                    break
+        if matched:
+            return True
+        for tx_in in tx.tx_ins:
+            outpoint = tx_in.prev_tx[::-1] + int_to_little_endian(tx_in.prev_index, 4)
+            if outpoint in self:
+                return True
+            for data in pushed_data(tx_in.script_sig):
+                if data in self:
+                    return True
+        return False
+
+    def filter_txs(self, txs: Iterable[Tx]) -> list[Tx]:
+        '''matched transactions of a block, in order'''
+        return [tx for tx in txs if self.matches_tx(tx)]
+
+    def merkle_block(self, block: Block) -> MerkleBlock:
+        '''merkleblock proving the matched transactions of a full block'''
+        if not block.txs:
+            raise ValueError('transactions are not available')
+        tree = MerkleTree(block.tx_hashes())
+        matched = [i for i, tx in enumerate(block.txs) if self.matches_tx(tx)]
+        return MerkleBlock.from_tree(block, tree, matched)
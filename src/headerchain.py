@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Optional
+
+from src.helper import (MAX_TARGET, bits_to_target, bits_to_work,
+                        calculate_new_bits)
+
+
+def _bits_runs(headers: bytes) -> list[tuple[bytes, int]]:
+    # (bits, number of headers) of each run of headers with equal bits
+    view = memoryview(headers)
+    runs: list[tuple[bytes, int]] = []
+    last = b''
+    count = 0
+    for start in range(72, len(headers), 80):
+        bits = view[start:start + 4]
+        if bits != last:
+            if count:
+                runs.append((last, count))
+            last = bits.tobytes()
+            count = 0
+        count += 1
+    if count:
+        runs.append((last, count))
+    return runs
+
+
+def header_targets(headers: bytes) -> list[int]:
+    '''target of each header of a buffer of 80 byte headers'''
+    result: list[int] = []
+    for bits, count in _bits_runs(headers):
+        result.extend([bits_to_target(bits)] * count)
+    return result
+
+
+def chainwork(headers: bytes) -> int:
+    '''total work of a buffer of 80 byte headers'''
+    return sum(bits_to_work(bits) * count for bits, count in _bits_runs(headers))
+
+
+def cumulative_chainwork(headers: bytes, start: int = 0) -> list[int]:
+    '''chainwork after each header, on top of the work start'''
+    result: list[int] = []
+    total = start
+    for bits, count in _bits_runs(headers):
+        work = bits_to_work(bits)
+        for _ in range(count):
+            total += work
+            result.append(total)
+    return result
+
+
+def retarget_schedule(headers: bytes,
+                      height: int = 0,
+                      retarget_interval: int = 2016) -> list[tuple[int, bytes]]:
+    '''
+    (height, bits) of each retarget period covered by headers,
+    the first header being at height
+    '''
+    result = []
+    n_headers = len(headers) // 80
+    first = height + (-height) % retarget_interval
+    if height != first:
+        # period started before the range
+        result.append((height, bytes(headers[72:76])))
+    for period_height in range(first, height + n_headers, retarget_interval):
+        start = (period_height - height) * 80 + 72
+        result.append((period_height, bytes(headers[start:start + 4])))
+    return result
+
+
+class HeaderChain:
+    '''
+    Validates block headers given as a buffer of contiguous 80 byte records,
+    in one pass without creating Block objects:
+
+    - prev_block of each header is the hash of the one before
+    - the header hash is below its target
+    - bits only change every retarget_interval blocks,
+      where they follow calculate_new_bits
+
+    The chain starts from a trusted header at height, e.g. the genesis block.
+    period_start is the timestamp of the first block of the retarget period
+    containing height; if it is unknown, the first retarget is not checked.
+    chainwork is the total work up to and including header, by default the
+    work of header alone (right for the genesis block). The chain with the
+    most chainwork is the best one.
+    '''
+    header_size = 80
+    retarget_interval = 2016
+    max_target = MAX_TARGET
+
+    def __init__(self,
+                 header: bytes,
+                 height: int = 0,
+                 period_start: Optional[int] = None,
+                 chainwork: Optional[int] = None) -> None:
+        if len(header) != self.header_size:
+            raise ValueError(f'header must be {self.header_size} bytes')
+        # hash in internal (little endian) byte order, as in prev_block
+        self.tip = hashlib.sha256(hashlib.sha256(header).digest()).digest()
+        self.height = height
+        self.bits = bytes(header[72:76])
+        self.timestamp = int.from_bytes(header[68:72], 'little')
+        if height % self.retarget_interval == 0:
+            period_start = self.timestamp
+        self.period_start = period_start
+        self._target = bits_to_target(self.bits)
+        self._work = bits_to_work(self.bits)
+        if chainwork is None:
+            chainwork = self._work
+        self.chainwork = chainwork
+
+    def tip_hash(self) -> bytes:
+        '''hash of the last valid header, in the usual byte order'''
+        return self.tip[::-1]
+
+    def add_headers(self, headers: bytes) -> int:
+        '''
+        Validates headers on top of the tip and returns how many were added.
+        At the first invalid header ValueError is raised, the headers before
+        it stay added.
+        '''
+        size = self.header_size
+        if len(headers) % size != 0:
+            raise ValueError(f'buffer is not a multiple of {size} bytes')
+        view = memoryview(headers)
+        sha256 = hashlib.sha256
+        n_added = 0
+        for start in range(0, len(headers), size):
+            header = view[start:start + size]
+            height = self.height + 1
+            if header[4:36] != self.tip:
+                raise ValueError(f'header {height}: does not link to the tip')
+            bits = bytes(header[72:76])
+            timestamp = int.from_bytes(header[68:72], 'little')
+            target = self._target
+            work = self._work
+            period_start = self.period_start
+            if height % self.retarget_interval == 0:
+                if period_start is not None:
+                    time_diff = self.timestamp - period_start
+                    expected = calculate_new_bits(self.bits, time_diff,
+                                                  self.max_target)
+                    if bits != expected:
+                        raise ValueError(f'header {height}: bad retarget')
+                if bits != self.bits:
+                    target = bits_to_target(bits)
+                    work = bits_to_work(bits)
+                period_start = timestamp
+            elif bits != self.bits:
+                raise ValueError(f'header {height}: bits changed')
+            h = sha256(sha256(header).digest()).digest()
+            if int.from_bytes(h, 'little') >= target:
+                raise ValueError(f'header {height}: insufficient proof of work')
+            self.tip = h
+            self.height = height
+            self.bits = bits
+            self.timestamp = timestamp
+            self.period_start = period_start
+            self._target = target
+            self._work = work
+            self.chainwork += work
+            n_added += 1
+        return n_added
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import mmap
+import os
+from io import BytesIO
+from typing import Iterator, Optional
+
+from src.block import Block
+from src.helper import hash256, int_to_little_endian, little_endian_to_int
+
+
+class HeaderStore:
+    '''
+    Block headers of one chain kept as fixed-size records, record i being
+    the header at height i.
+
+    - <filename>        : 80 byte headers back to back
+    - <filename>.hashes : 32 byte header hashes (internal byte order)
+    - <filename>.idx    : <number of indexed heights 8> followed by records
+                          <hash 32><height 4> sorted by hash
+
+    All files are memory-mapped, so opening is cheap and the headers are
+    not held as Block objects; Block is created for a height on request.
+    height_of bisects the sorted records of the hash -> height index, and
+    only the heights appended since it was last merged (compact) are
+    kept in a dict. Records left behind by truncate are recognized by
+    comparing with the hashes file.
+    Headers are not validated here, see HeaderChain.
+    '''
+    header_size = 80
+    hash_size = 32
+    bytes_height = 4
+    record_size = hash_size + bytes_height
+    bytes_header = 8
+    merge_threshold = 1 << 12
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.hashes_filename = filename + '.hashes'
+        self.data_file = open(filename, 'ab+')
+        self.hashes_file = open(self.hashes_filename, 'ab+')
+        self.index_filename = filename + '.idx'
+        self.n_headers = 0
+        self._data_map: Optional[mmap.mmap] = None
+        self._hashes_map: Optional[mmap.mmap] = None
+        # hash -> height of the heights which are not indexed yet
+        self._pending: Optional[dict[bytes, int]] = None
+        self._recover()
+        self._open_index()
+
+    def __enter__(self) -> HeaderStore:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.n_headers
+
+    def __getitem__(self, height: int) -> Block:
+        return Block.parse(BytesIO(self.raw(height)))
+
+    def __iter__(self) -> Iterator[Block]:
+        for height in range(self.n_headers):
+            yield self[height]
+
+    def __contains__(self, block_hash: bytes) -> bool:
+        return self.height_of(block_hash) is not None
+
+    def _recover(self) -> None:
+        # drop a trailing partial record, and add hashes missing
+        # after an interrupted write
+        n_headers = os.path.getsize(self.filename) // self.header_size
+        n_hashes = os.path.getsize(self.hashes_filename) // self.hash_size
+        self.data_file.truncate(n_headers * self.header_size)
+        if n_hashes > n_headers:
+            n_hashes = n_headers
+        self.hashes_file.truncate(n_hashes * self.hash_size)
+        self.n_headers = n_headers
+        if n_hashes < n_headers:
+            self._write_hashes(self.headers(n_hashes, n_headers), n_hashes)
+
+    def _open_index(self) -> None:
+        if not os.path.exists(self.index_filename) \
+                or os.path.getsize(self.index_filename) < self.bytes_header:
+            with open(self.index_filename, 'wb') as writer:
+                writer.write(int_to_little_endian(0, self.bytes_header))
+        self.index_file = open(self.index_filename, 'r+b')
+        self.n_records = (os.path.getsize(self.index_filename)
+                          - self.bytes_header) // self.record_size
+        self._records: Optional[mmap.mmap] = None
+        if self.n_records:
+            self._records = mmap.mmap(self.index_file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        self.index_file.seek(0)
+        n_indexed = little_endian_to_int(self.index_file.read(self.bytes_header))
+        # heights from n_indexed on are looked up in _pending
+        self.n_indexed = min(n_indexed, self.n_headers)
+
+    def _set_n_indexed(self, n_indexed: int) -> None:
+        self.n_indexed = n_indexed
+        self.index_file.seek(0)
+        self.index_file.write(int_to_little_endian(n_indexed, self.bytes_header))
+        self.index_file.flush()
+
+    def _record_key(self, i: int) -> bytes:
+        start = self.bytes_header + i * self.record_size
+        return self._records[start:start + self.hash_size]  # type: ignore
+
+    def _record_height(self, i: int) -> int:
+        start = self.bytes_header + i * self.record_size + self.hash_size
+        return little_endian_to_int(
+            self._records[start:start + self.bytes_height])  # type: ignore
+
+    def _bisect(self, key: bytes) -> int:
+        '''position of the first record whose hash is not below key'''
+        lo, hi = 0, self.n_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record_key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _tail_hashes(self) -> list[tuple[bytes, int]]:
+        # (hash, height) of the heights which are not indexed yet
+        if self.n_indexed >= self.n_headers:
+            return []
+        hashes = self._hashes(self.n_headers * self.hash_size)
+        size = self.hash_size
+        return [(hashes[height * size:(height + 1) * size], height)
+                for height in range(self.n_indexed, self.n_headers)]
+
+    def compact(self) -> None:
+        '''
+        Merges the heights appended since the last compaction into the
+        sorted records. The new index is written next to the old one and
+        replaces it, so an interruption leaves the old index in place.
+        '''
+        if self.n_indexed == self.n_headers:
+            return
+        tail = sorted(self._tail_hashes())
+        tmp_filename = self.index_filename + '.tmp'
+        n_records = 0
+        with open(tmp_filename, 'wb') as writer:
+            writer.write(int_to_little_endian(self.n_headers, self.bytes_header))
+            # runs of records are copied as they are, with the new records
+            # inserted in between
+            copied = 0
+            for key, height in tail:
+                i = self._bisect(key)
+                if i > copied:
+                    writer.write(self._records[  # type: ignore
+                        self.bytes_header + copied * self.record_size:
+                        self.bytes_header + i * self.record_size])
+                    n_records += i - copied
+                    copied = i
+                if i < self.n_records and self._record_key(i) == key:
+                    # left behind by truncate
+                    copied = i + 1
+                writer.write(key + int_to_little_endian(height, self.bytes_height))
+                n_records += 1
+            if self.n_records > copied:
+                writer.write(self._records[  # type: ignore
+                    self.bytes_header + copied * self.record_size:])
+                n_records += self.n_records - copied
+            writer.flush()
+            os.fsync(writer.fileno())
+        if self._records is not None:
+            self._records.close()
+        self.index_file.close()
+        os.replace(tmp_filename, self.index_filename)
+        self.index_file = open(self.index_filename, 'r+b')
+        self._records = mmap.mmap(self.index_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        self.n_records = n_records
+        self.n_indexed = self.n_headers
+        self._pending = None
+
+    def _maybe_compact(self) -> None:
+        if self.n_headers - self.n_indexed >= max(self.merge_threshold,
+                                                  self.n_indexed >> 3):
+            self.compact()
+
+    def _data(self, end: int) -> mmap.mmap:
+        if self._data_map is None or len(self._data_map) < end:
+            if self._data_map is not None:
+                self._data_map.close()
+            self._data_map = mmap.mmap(self.data_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        return self._data_map
+
+    def _hashes(self, end: int) -> mmap.mmap:
+        if self._hashes_map is None or len(self._hashes_map) < end:
+            if self._hashes_map is not None:
+                self._hashes_map.close()
+            self._hashes_map = mmap.mmap(self.hashes_file.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+        return self._hashes_map
+
+    def _check_height(self, height: int) -> None:
+        if not 0 <= height < self.n_headers:
+            raise IndexError(f'no header at height {height}')
+
+    def raw(self, height: int) -> bytes:
+        self._check_height(height)
+        start = height * self.header_size
+        end = start + self.header_size
+        return self._data(end)[start:end]
+
+    def headers(self, start: int, stop: int) -> bytes:
+        '''raw headers of heights start .. stop - 1 as one buffer'''
+        start = max(start, 0)
+        stop = min(stop, self.n_headers)
+        if start >= stop:
+            return b''
+        end = stop * self.header_size
+        return self._data(end)[start * self.header_size:end]
+
+    def hash(self, height: int) -> bytes:
+        '''same as self[height].hash()'''
+        self._check_height(height)
+        start = height * self.hash_size
+        end = start + self.hash_size
+        return self._hashes(end)[start:end][::-1]
+
+    def height_of(self, block_hash: bytes) -> Optional[int]:
+        self._maybe_compact()
+        key = block_hash[::-1]
+        if self._pending is None:
+            self._pending = dict(self._tail_hashes())
+        height = self._pending.get(key)
+        if height is not None:
+            return height
+        i = self._bisect(key)
+        if i < self.n_records and self._record_key(i) == key:
+            height = self._record_height(i)
+            if height < self.n_indexed and self.hash(height) == block_hash:
+                return height
+        return None
+
+    def tip(self) -> Optional[Block]:
+        if self.n_headers == 0:
+            return None
+        return self[self.n_headers - 1]
+
+    def append(self, header: bytes) -> None:
+        self.extend(header)
+
+    def extend(self, headers: bytes) -> None:
+        '''append a buffer of 80 byte headers'''
+        if len(headers) % self.header_size != 0:
+            raise ValueError(f'buffer is not a multiple of {self.header_size} bytes')
+        self.data_file.write(headers)
+        # headers have to reach the file before their hashes
+        self.data_file.flush()
+        self._write_hashes(headers, self.n_headers)
+        self.n_headers += len(headers) // self.header_size
+        self._maybe_compact()
+
+    def _write_hashes(self, headers: bytes, height: int) -> None:
+        view = memoryview(headers)
+        size = self.header_size
+        hashes = [hash256(view[i:i + size]) for i in range(0, len(headers), size)]
+        if self._pending is not None:
+            for i, h in enumerate(hashes):
+                self._pending[h] = height + i
+        self.hashes_file.write(b''.join(hashes))
+        self.hashes_file.flush()
+
+    def truncate(self, height: int) -> None:
+        '''remove the headers from height on, e.g. on a reorg'''
+        if height >= self.n_headers:
+            return
+        height = max(height, 0)
+        self._close_maps()
+        self.data_file.truncate(height * self.header_size)
+        self.hashes_file.truncate(height * self.hash_size)
+        self.n_headers = height
+        if self.n_indexed > height:
+            self._set_n_indexed(height)
+        self._pending = None
+
+    def _close_maps(self) -> None:
+        if self._data_map is not None:
+            self._data_map.close()
+            self._data_map = None
+        if self._hashes_map is not None:
+            self._hashes_map.close()
+            self._hashes_map = None
+
+    def close(self) -> None:
+        self._close_maps()
+        if self._records is not None:
+            self._records.close()
+            self._records = None
+        self.data_file.close()
+        self.hashes_file.close()
+        self.index_file.close()
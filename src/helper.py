@@ -1,4 +1,6 @@
 import hashlib
+import struct
+from functools import lru_cache
 from io import BytesIO
 
 BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
@@ -19,6 +21,72 @@ def hash256(s: bytes) -> bytes:
     return hashlib.sha256(hashlib.sha256(s).digest()).digest()
 
 
+def merkle_parent_level(level: bytes) -> bytes:
+    '''
+    level is a contiguous buffer of 32 byte hashes.
+    Returns the parent level, the last hash is paired with itself if odd.
+    '''
+    if len(level) % 64 == 32:
+        level += level[-32:]
+    view = memoryview(level)
+    return b''.join([hash256(view[i:i + 64]) for i in range(0, len(level), 64)])
+
+
+def merkle_root(hashes: list[bytes]) -> bytes:
+    '''
+    merkle root of hashes in internal (little endian) byte order,
+    computed level by level over one buffer per level
+    '''
+    return merkle_root_mutated(hashes)[0]
+
+
+def merkle_root_mutated(hashes: list[bytes]) -> tuple[bytes, bool]:
+    '''
+    merkle root of hashes and whether two paired siblings of any level are
+    equal. Such a list has the same root as another one, e.g. [a, b, c] and
+    [a, b, c, c] (CVE-2012-2459), so a block with it is invalid.
+    '''
+    if len(hashes) == 0:
+        raise ValueError('no hashes')
+    level = b''.join(hashes)
+    mutated = False
+    while len(level) > 32:
+        for i in range(0, len(level) - 32, 64):
+            if level[i:i + 32] == level[i + 32:i + 64]:
+                mutated = True
+                break
+        level = merkle_parent_level(level)
+    return level, mutated
+
+
+def murmur3(data: bytes, seed: int = 0) -> int:
+    '''32 bit MurmurHash3 (x86), used by BIP37 bloom filters'''
+    c1 = 0xcc9e2d51
+    c2 = 0x1b873593
+    mask = 0xffffffff
+    h = seed & mask
+    n_body = len(data) - len(data) % 4
+    for (k,) in struct.iter_unpack('<I', data[:n_body]):
+        k = (k * c1) & mask
+        k = ((k << 15) | (k >> 17)) & mask
+        k = (k * c2) & mask
+        h ^= k
+        h = ((h << 13) | (h >> 19)) & mask
+        h = (h * 5 + 0xe6546b64) & mask
+    tail = data[n_body:]
+    if tail:
+        k = (int.from_bytes(tail, 'little') * c1) & mask
+        k = ((k << 15) | (k >> 17)) & mask
+        h ^= (k * c2) & mask
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & mask
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & mask
+    h ^= h >> 16
+    return h
+
+
 def encode_base58(b: bytes) -> str:
     count = 0
     for bi in b:
@@ -105,11 +173,24 @@ def h160_to_p2sh_address(h160: bytes, testnet=False) -> str:
     return encode_base58_checksum(prefix + h160)
 
 
-def bits_to_target(bits: bytes) -> int:
+# only a few distinct bits values occur in a chain,
+# so their targets and work are kept in one cache
+@lru_cache(maxsize=4096)
+def _decode_bits(bits: bytes) -> tuple[int, int]:
     exponent = bits[-1]
     coefficient = little_endian_to_int(bits[:-1])
     target = coefficient * (256**(exponent - 3))
-    return target
+    return target, (1 << 256) // (target + 1)
+
+
+def bits_to_target(bits: bytes) -> int:
+    # bytes() since the cache needs a hashable key (bytearray, memoryview)
+    return _decode_bits(bytes(bits))[0]
+
+
+def bits_to_work(bits: bytes) -> int:
+    '''expected number of hashes to find a header with bits'''
+    return _decode_bits(bytes(bits))[1]
 
 
 def target_to_bits(target: int) -> bytes:
@@ -125,12 +206,14 @@ def target_to_bits(target: int) -> bytes:
     return bits
 
 
-def calculate_new_bits(previous_bits: bytes, time_diff: int) -> bytes:
+def calculate_new_bits(previous_bits: bytes,
+                       time_diff: int,
+                       max_target: int = MAX_TARGET) -> bytes:
     if time_diff > TWOWEEKS * 4:
         time_diff = TWOWEEKS * 4
     if time_diff < TWOWEEKS // 4:
         time_diff = TWOWEEKS // 4
     new_target = bits_to_target(previous_bits) * time_diff // TWOWEEKS
-    if new_target > MAX_TARGET:
-        new_target = MAX_TARGET
+    if new_target > max_target:
+        new_target = max_target
     return target_to_bits(new_target)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+from io import BytesIO
+from typing import Iterable, Optional
+
+from src.block import Block
+from src.helper import (encode_varint, hash256, int_to_little_endian,
+                        little_endian_to_int, merkle_parent_level,
+                        read_varint)
+
+# hashes here are in internal (little endian) byte order,
+# i.e. tx.hash()[::-1] and block.merkle_root[::-1]
+
+
+class MerkleTree:
+    '''
+    All levels of the merkle tree of a block, each kept as one buffer of
+    32 byte hashes, so that branches for many transactions of the same
+    block come from a single tree.
+    '''
+    def __init__(self, hashes: list[bytes]) -> None:
+        if len(hashes) == 0:
+            raise ValueError('no hashes')
+        self.total = len(hashes)
+        self.levels = [b''.join(hashes)]
+        while len(self.levels[-1]) > 32:
+            self.levels.append(merkle_parent_level(self.levels[-1]))
+
+    def root(self) -> bytes:
+        return self.levels[-1]
+
+    def node(self, height: int, pos: int) -> bytes:
+        level = self.levels[height]
+        return level[pos * 32:(pos + 1) * 32]
+
+    def branch(self, index: int) -> list[bytes]:
+        '''sibling hashes from the leaf at index up to the root'''
+        if not 0 <= index < self.total:
+            raise IndexError(f'no leaf at {index}')
+        result = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling * 32 >= len(level):
+                # the last node of an odd level is paired with itself
+                sibling = index
+            result.append(level[sibling * 32:(sibling + 1) * 32])
+            index >>= 1
+        return result
+
+
+def verify_merkle_branch(leaf: bytes, index: int, branch: list[bytes],
+                         root: bytes) -> bool:
+    h = leaf
+    for sibling in branch:
+        if index & 1:
+            h = hash256(sibling + h)
+        else:
+            h = hash256(h + sibling)
+        index >>= 1
+    return index == 0 and h == root
+
+
+def bytes_to_bit_field(some_bytes: bytes) -> list[int]:
+    flag_bits = []
+    for byte in some_bytes:
+        for _ in range(8):
+            flag_bits.append(byte & 1)
+            byte >>= 1
+    return flag_bits
+
+
+def bit_field_to_bytes(bit_field: list[int]) -> bytes:
+    result = bytearray((len(bit_field) + 7) // 8)
+    for i, bit in enumerate(bit_field):
+        if bit:
+            result[i // 8] |= 1 << (i % 8)
+    return bytes(result)
+
+
+class MerkleBlock:
+    '''
+    Block header with a partial merkle tree (BIP37 merkleblock message):
+    the hashes and flag bits of a depth-first walk which only descends
+    into subtrees containing matched transactions.
+    '''
+    def __init__(self, header: Block, total: int, hashes: list[bytes],
+                 flags: bytes) -> None:
+        self.header = header
+        self.total = total
+        self.hashes = hashes
+        self.flags = flags
+
+    def __repr__(self) -> str:
+        return f'{self.header.hash().hex()}: {self.total} txs, {len(self.hashes)} hashes'
+
+    @classmethod
+    def parse(cls, stream: BytesIO) -> MerkleBlock:
+        header = Block.parse(stream)
+        total = little_endian_to_int(stream.read(4))
+        n_hashes = read_varint(stream)
+        raw_hashes = stream.read(32 * n_hashes)
+        if len(raw_hashes) != 32 * n_hashes:
+            raise SyntaxError('parsing merkleblock failed')
+        hashes = [raw_hashes[i:i + 32] for i in range(0, len(raw_hashes), 32)]
+        flags = stream.read(read_varint(stream))
+        return cls(header, total, hashes, flags)
+
+    def serialize(self) -> bytes:
+        result = self.header.serialize()
+        result += int_to_little_endian(self.total, 4)
+        result += encode_varint(len(self.hashes))
+        result += b''.join(self.hashes)
+        result += encode_varint(len(self.flags))
+        result += self.flags
+        return result
+
+    @classmethod
+    def from_tree(cls, header: Block, tree: MerkleTree,
+                  matched: Iterable[int]) -> MerkleBlock:
+        '''merkleblock proving the transactions at the matched indices'''
+        matches = bytearray(tree.total)
+        for index in matched:
+            matches[index] = 1
+        hashes: list[bytes] = []
+        flag_bits: list[int] = []
+
+        def walk(height: int, pos: int) -> None:
+            start = pos << height
+            stop = min((pos + 1) << height, tree.total)
+            parent_of_match = 1 in matches[start:stop]
+            flag_bits.append(int(parent_of_match))
+            if height == 0 or not parent_of_match:
+                hashes.append(tree.node(height, pos))
+                return
+            walk(height - 1, pos * 2)
+            if (pos * 2 + 1) << (height - 1) < tree.total:
+                walk(height - 1, pos * 2 + 1)
+
+        walk(len(tree.levels) - 1, 0)
+        return cls(header, tree.total, hashes, bit_field_to_bytes(flag_bits))
+
+    def _tree_height(self) -> int:
+        height = 0
+        while (1 << height) < self.total:
+            height += 1
+        return height
+
+    def _width(self, height: int) -> int:
+        return (self.total + (1 << height) - 1) >> height
+
+    def matched_indices(self) -> Optional[dict[int, bytes]]:
+        '''
+        Walks the partial tree and returns {index: tx hash} of the matched
+        transactions, or None if it is malformed or does not lead to
+        the merkle root of the header.
+        '''
+        if self.total == 0 or len(self.hashes) > self.total:
+            return None
+        flag_bits = bytes_to_bit_field(self.flags)
+        if len(flag_bits) < len(self.hashes):
+            return None
+        matched: dict[int, bytes] = {}
+        n_bits = 0
+        n_hashes = 0
+
+        def walk(height: int, pos: int) -> Optional[bytes]:
+            nonlocal n_bits, n_hashes
+            if n_bits >= len(flag_bits):
+                return None
+            flag = flag_bits[n_bits]
+            n_bits += 1
+            if height == 0 or not flag:
+                if n_hashes >= len(self.hashes):
+                    return None
+                h = self.hashes[n_hashes]
+                n_hashes += 1
+                if height == 0 and flag:
+                    matched[pos] = h
+                return h
+            left = walk(height - 1, pos * 2)
+            if left is None:
+                return None
+            if pos * 2 + 1 < self._width(height - 1):
+                right = walk(height - 1, pos * 2 + 1)
+                if right is None or right == left:
+                    # identical children would allow CVE-2012-2459
+                    return None
+            else:
+                right = left
+            return hash256(left + right)
+
+        root = walk(self._tree_height(), 0)
+        if root is None or root[::-1] != self.header.merkle_root:
+            return None
+        # every hash and every flag byte has to be used
+        if n_hashes != len(self.hashes) or (n_bits + 7) // 8 != len(self.flags):
+            return None
+        return matched
+
+    def is_valid(self) -> bool:
+        return self.matched_indices() is not None
+
+    def matched_hashes(self) -> list[bytes]:
+        '''tx hashes proven by this merkleblock in usual byte order'''
+        matched = self.matched_indices()
+        if matched is None:
+            raise ValueError('invalid merkleblock')
+        return [matched[index][::-1] for index in sorted(matched)]
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import time
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from typing import Callable, Iterable, Optional
+
+from src.block import Block
+from src.helper import hash256, int_to_little_endian
+from src.merkleblock import MerkleTree
+from src.script import Script
+from src.tx import Tx, TxIn
+
+
+def search_nonces(header: bytes, target: int, start: int,
+                  stop: int) -> tuple[Optional[int], int]:
+    '''
+    Tries nonces start .. stop - 1 for the header (only its first 76 bytes
+    are used). Returns (nonce whose hash is below target or None, number of
+    hashes computed).
+    The sha256 state after the first 64 bytes (midstate) does not depend
+    on the nonce, so it is computed once and copied for every nonce.
+    '''
+    midstate = hashlib.sha256(header[:64])
+    tail = header[64:76]
+    sha256 = hashlib.sha256
+    pack = struct.Struct('<I').pack
+    for nonce in range(start, stop):
+        h = midstate.copy()
+        h.update(tail + pack(nonce))
+        if int.from_bytes(sha256(h.digest()).digest(), 'little') < target:
+            return nonce, nonce - start + 1
+    return None, stop - start
+
+
+def with_extra_nonce(coinbase: Tx, extra_nonce: int) -> Tx:
+    '''copy of coinbase with extra_nonce pushed at the end of its ScriptSig'''
+    tx_in = coinbase.tx_ins[0]
+    script_sig = Script([*tx_in.script_sig.cmds,
+                         int_to_little_endian(extra_nonce, 8)])
+    return Tx(coinbase.version,
+              [TxIn(tx_in.prev_tx, tx_in.prev_index, script_sig,
+                    tx_in.sequence, tx_in.witness)],
+              coinbase.tx_outs, coinbase.locktime,
+              testnet=coinbase.testnet, segwit=coinbase.segwit)
+
+
+def compare_processes(header: bytes, n_hashes: int,
+                      process_counts: Iterable[int],
+                      chunk_size: int = 1 << 16) -> dict[int, float]:
+    '''hashes per second of Miner.benchmark for each number of processes'''
+    result = {}
+    for processes in process_counts:
+        with Miner(processes, chunk_size) as miner:
+            result[processes] = miner.benchmark(header, n_hashes)
+    return result
+
+
+class Miner:
+    '''
+    Searches a nonce satisfying Block.check_pow, with the nonce space split
+    into chunks of chunk_size handed to a pool of processes.
+    When all nonces fail, the timestamp is rolled forward (max_rolls times),
+    then the extra nonce in the coinbase is changed (max_extra_nonces times).
+
+    hashes and seconds add up over all searches, see stats().
+    '''
+    nonce_space = 1 << 32
+
+    def __init__(self,
+                 processes: Optional[int] = None,
+                 chunk_size: int = 1 << 16) -> None:
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.hashes = 0
+        self.seconds = 0.0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> Miner:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def stats(self) -> dict[str, float]:
+        return {
+            'processes': self.processes,
+            'hashes': self.hashes,
+            'seconds': self.seconds,
+            'hashes_per_second': self.hashes / self.seconds if self.seconds else 0.0,
+        }
+
+    def mine(self, block: Block, max_rolls: int = 0,
+             max_extra_nonces: int = 0,
+             coinbase_for: Optional[Callable[[int], Tx]] = None) -> bool:
+        '''
+        Sets block.nonce (and block.timestamp if rolled) to a valid one.
+        Extra nonces need block.txs: for extra_nonce 1, 2, ... the coinbase
+        is replaced by coinbase_for(extra_nonce) (by default with_extra_nonce
+        of the original coinbase), and the merkle root is recomputed along
+        the branch of the coinbase only.
+        Returns False, leaving block unchanged, if none was found.
+        '''
+        timestamp = block.timestamp
+        merkle_root = block.merkle_root
+        target = block.target()
+        if max_extra_nonces:
+            if not block.txs:
+                raise ValueError('extra nonces need the transactions')
+            coinbase = block.txs[0]
+            if coinbase_for is None:
+                def coinbase_for(extra_nonce: int) -> Tx:
+                    return with_extra_nonce(coinbase, extra_nonce)
+            # siblings on the way from the coinbase (leftmost) to the root
+            branch = MerkleTree(block.tx_hashes()).branch(0)
+        for extra_nonce in range(max_extra_nonces + 1):
+            if extra_nonce:
+                new_coinbase = coinbase_for(extra_nonce)  # type: ignore
+                h = hash256(new_coinbase.serialize())
+                for sibling in branch:
+                    h = hash256(h + sibling)
+                block.merkle_root = h[::-1]
+                block.timestamp = timestamp
+            for _ in range(max_rolls + 1):
+                nonce = self.search(block.serialize(), target, 0, self.nonce_space)
+                if nonce is not None:
+                    block.nonce = int_to_little_endian(nonce, 4)
+                    if extra_nonce:
+                        block.txs[0] = new_coinbase  # type: ignore
+                    return True
+                block.timestamp += 1
+        block.timestamp = timestamp
+        block.merkle_root = merkle_root
+        return False
+
+    def benchmark(self, header: bytes, n_hashes: int) -> float:
+        '''hashes per second over n_hashes nonces that never match'''
+        hashes, seconds = self.hashes, self.seconds
+        self.search(header, 0, 0, n_hashes)
+        return (self.hashes - hashes) / (self.seconds - seconds)
+
+    def search(self, header: bytes, target: int, start: int,
+               stop: int) -> Optional[int]:
+        started = time.perf_counter()
+        try:
+            if self.processes == 1:
+                return self._search_serial(header, target, start, stop)
+            return self._search_parallel(header, target, start, stop)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def _search_serial(self, header: bytes, target: int, start: int,
+                       stop: int) -> Optional[int]:
+        for chunk_start in range(start, stop, self.chunk_size):
+            chunk_stop = min(chunk_start + self.chunk_size, stop)
+            nonce, n_hashes = search_nonces(header, target, chunk_start, chunk_stop)
+            self.hashes += n_hashes
+            if nonce is not None:
+                return nonce
+        return None
+
+    def _search_parallel(self, header: bytes, target: int, start: int,
+                         stop: int) -> Optional[int]:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.processes)
+        chunk_starts = iter(range(start, stop, self.chunk_size))
+        pending: set[Future] = set()
+        found: Optional[int] = None
+        while True:
+            # keep every process busy without queueing the whole nonce space
+            while found is None and len(pending) < 2 * self.processes:
+                chunk_start = next(chunk_starts, None)
+                if chunk_start is None:
+                    break
+                chunk_stop = min(chunk_start + self.chunk_size, stop)
+                pending.add(self._pool.submit(search_nonces, header, target,
+                                              chunk_start, chunk_stop))
+            if not pending:
+                return found
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                nonce, n_hashes = future.result()
+                self.hashes += n_hashes
+                if nonce is not None and found is None:
+                    found = nonce
+            if found is not None:
+                for future in pending:
+                    future.cancel()
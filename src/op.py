@@ -1,5 +1,5 @@
 import hashlib
-from typing import Callable
+from typing import Callable, Optional
 
 from src.helper import hash160, hash256
 from src.secp256k1 import S256Point, Signature
@@ -20,47 +20,38 @@ OP_CHECKMULTISIGVERIFY = 175
 # https://en.bitcoin.it/wiki/Script
 
 
-def encode_num(num: int) -> bytes:
-    if num == 0:
-        return b''
+def _encode_num(num: int) -> bytes:
     abs_num = abs(num)
-    negative = num < 0
-    result = bytearray()
-    while abs_num:
-        result.append(abs_num & 0xff)
-        abs_num >>= 8
-    # if the top bit is set,
-    # for negative numbers we ensure that the top bit is set
-    # for positive numbers we ensure that the top bit is not set
-    if result[-1] & 0x80:
-        if negative:
-            result.append(0x80)
-        else:
-            result.append(0)
-    elif negative:
+    # one extra bit for the sign
+    result = bytearray(abs_num.to_bytes(abs_num.bit_length() // 8 + 1, 'little'))
+    if result[-1] == 0 and (len(result) == 1 or not result[-2] & 0x80):
+        # the extra byte is only needed if the top bit is set
+        del result[-1]
+    if num < 0:
         result[-1] |= 0x80
     return bytes(result)
 
 
+# results and arguments of arithmetic opcodes are mostly small numbers
+SMALL_NUM_MAX = 1024
+_SMALL_NUMS = [_encode_num(num) for num in range(-SMALL_NUM_MAX, SMALL_NUM_MAX + 1)]
+
+
+def encode_num(num: int) -> bytes:
+    if -SMALL_NUM_MAX <= num <= SMALL_NUM_MAX:
+        return _SMALL_NUMS[num + SMALL_NUM_MAX]
+    return _encode_num(num)
+
+
 def decode_num(element: bytes) -> int:
     if element == b'':
         return 0
-    # reverse for big endian
-    big_endian = element[::-1]
+    result = int.from_bytes(element, 'little')
     # top bit being 1 means it's negative
-    if big_endian[0] & 0x80:
-        negative = True
-        result = big_endian[0] & 0x7f
-    else:
-        negative = False
-        result = big_endian[0]
-    for c in big_endian[1:]:
-        result <<= 8
-        result += c
-    if negative:
-        return -result
-    else:
-        return result
+    sign_bit = 0x80 << 8 * (len(element) - 1)
+    if result & sign_bit:
+        return -(result ^ sign_bit)
+    return result
 
 
 def op_0(stack: list) -> bool:
@@ -724,12 +715,27 @@ def op_checksigverify(stack: list, z: int) -> bool:
     return op_checksig(stack, z) and op_verify(stack)
 
 
-def op_checkmultisig(stack: list, z: int) -> bool:
+MAX_PUBKEYS_PER_MULTISIG = 20
+
+# (z, [(pubkey, sig), ...]) -> [verified, ...]
+BatchVerifier = Callable[[int, list], list]
+
+
+def verify_pairs(z: int, pairs: list) -> list:
+    '''reference BatchVerifier, verifying the pairs one by one'''
+    return [point.verify(z, sig) for point, sig in pairs]
+
+
+def op_checkmultisig(stack: list,
+                     z: int,
+                     batch_verify: Optional[BatchVerifier] = None) -> bool:
     # 174
     if len(stack) < 1:
         return False
     # read a number:n
     n = decode_num(stack.pop())
+    if not 0 <= n <= MAX_PUBKEYS_PER_MULTISIG:
+        return False
     # read n pubkeys and a number:m
     if len(stack) < n + 1:
         return False
@@ -737,6 +743,8 @@ def op_checkmultisig(stack: list, z: int) -> bool:
     for _ in range(n):
         sec_pubkeys.append(stack.pop())
     m = decode_num(stack.pop())
+    if not 0 <= m <= n:
+        return False
     # read m signatures and a number:0
     if len(stack) < m + 1:
         return False
@@ -745,27 +753,57 @@ def op_checkmultisig(stack: list, z: int) -> bool:
         der_signatures.append(stack.pop()[:-1])
     stack.pop()  # to avoid off-by-one error
 
+    # Signatures have to match keys in the same order, so signature i can
+    # only be matched by key i .. i + n - m. Both lists are reversed here,
+    # which keeps the order. Keys which do not parse match no signature.
+    points: dict[int, Optional[S256Point]] = {}
+
+    def point(i_key: int) -> Optional[S256Point]:
+        if i_key not in points:
+            try:
+                points[i_key] = S256Point.parse(sec_pubkeys[i_key])
+            except (ValueError, SyntaxError):
+                points[i_key] = None
+        return points[i_key]
+
     try:
-        # parse
-        points = [S256Point.parse(sec) for sec in sec_pubkeys]
         sigs = [Signature.parse(der) for der in der_signatures]
-        # evaluate
-        for sig in sigs:
-            if len(points) == 0:
-                return False
-            while points:
-                point = points.pop(0)
-                if point.verify(z, sig):
+        if batch_verify is None:
+            def matches(i_sig: int, i_key: int) -> bool:
+                key = point(i_key)
+                return key is not None and key.verify(z, sigs[i_sig])
+        else:
+            candidates = [(i_sig, i_key) for i_sig in range(m)
+                          for i_key in range(i_sig, i_sig + n - m + 1)
+                          if point(i_key) is not None]
+            results = batch_verify(z, [(point(i_key), sigs[i_sig])
+                                       for i_sig, i_key in candidates])
+            verified = dict(zip(candidates, results))
+
+            def matches(i_sig: int, i_key: int) -> bool:
+                return verified.get((i_sig, i_key), False)
+
+        i_key = 0
+        for i_sig in range(m):
+            while True:
+                # stop as soon as the remaining keys can not cover
+                # the remaining signatures
+                if n - i_key < m - i_sig:
+                    return False
+                i_key += 1
+                if matches(i_sig, i_key - 1):
                     break
-        stack.append(encode_num(1))
     except (ValueError, SyntaxError):
         return False
+    stack.append(encode_num(1))
     return True
 
 
-def op_checkmultisigverify(stack: list, z: int) -> bool:
+def op_checkmultisigverify(stack: list,
+                           z: int,
+                           batch_verify: Optional[BatchVerifier] = None) -> bool:
     # 175: Same as OP_CHECKMULTISIG, but OP_VERIFY is executed afterward.
-    return op_checkmultisig(stack, z) and op_verify(stack)
+    return op_checkmultisig(stack, z, batch_verify) and op_verify(stack)
 
 
 def op_checklocktimeverify(stack, locktime, sequence):
@@ -986,3 +1024,42 @@ OP_CODE_NAMES: dict[int, str] = {
     184: 'OP_NOP9',
     185: 'OP_NOP10',
 }
+
+# calling conventions of the op functions
+CALL_STACK = 0  # operation(stack)
+CALL_ALTSTACK = 1  # operation(stack, altstack)
+CALL_BRANCH = 2  # OP_IF, OP_NOTIF, OP_ELSE, OP_ENDIF: run by the interpreter
+CALL_Z = 3  # operation(stack, z)
+CALL_LOCKTIME = 4  # operation(stack, locktime, sequence)
+CALL_SEQUENCE = 5  # operation(stack, version, sequence)
+
+OP_CODE_CONVENTIONS: dict[int, int] = {
+    OP_IF: CALL_BRANCH,
+    OP_NOTIF: CALL_BRANCH,
+    OP_ELSE: CALL_BRANCH,
+    OP_ENDIF: CALL_BRANCH,
+    OP_TOALTSTACK: CALL_ALTSTACK,
+    OP_FROMALTSTACK: CALL_ALTSTACK,
+    OP_CHECKSIG: CALL_Z,
+    OP_CHECKSIGVERIFY: CALL_Z,
+    OP_CHECKMULTISIG: CALL_Z,
+    OP_CHECKMULTISIGVERIFY: CALL_Z,
+    177: CALL_LOCKTIME,
+    178: CALL_SEQUENCE,
+}
+
+
+def build_op_code_table() -> list[Optional[tuple[Callable, int]]]:
+    '''
+    Returns (operation, calling convention) for each of the 256 op codes,
+    or None for op codes which are not implemented.
+    '''
+    table: list[Optional[tuple[Callable, int]]] = [None] * 256
+    for op_code, operation in OP_CODE_FUNCTIONS.items():
+        table[op_code] = (operation, OP_CODE_CONVENTIONS.get(op_code, CALL_STACK))
+    table[OP_ELSE] = (op_nop, CALL_BRANCH)
+    table[OP_ENDIF] = (op_nop, CALL_BRANCH)
+    return table
+
+
+OP_CODE_TABLE = build_op_code_table()
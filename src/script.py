@@ -1,26 +1,106 @@
 from __future__ import annotations
 
+from collections import OrderedDict
 from io import BytesIO
 from logging import getLogger
 from typing import Optional, Union
 
 from src.helper import (encode_varint, int_to_little_endian,
                         little_endian_to_int, read_varint)
-from src.op import (OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY, OP_CHECKSIG,
-                    OP_CHECKSIGVERIFY, OP_CODE_FUNCTIONS, OP_CODE_NAMES,
-                    OP_FROMALTSTACK, OP_IF, OP_NOTIF, OP_PUSHDATA1,
-                    OP_PUSHDATA2, OP_TOALTSTACK, op_equal, op_hash160,
-                    op_verify)
+from src.op import (CALL_ALTSTACK, CALL_BRANCH, CALL_LOCKTIME, CALL_STACK,
+                    CALL_Z, BatchVerifier, OP_CHECKMULTISIG, OP_CODE_NAMES, OP_CODE_TABLE, OP_ELSE, OP_ENDIF,
+                    OP_IF, OP_NOTIF, OP_PUSHDATA1, OP_PUSHDATA2, decode_num,
+                    op_equal, op_hash160, op_verify)
 
 LOGGER = getLogger(__name__)
 
+# consensus limits of script evaluation
+MAX_OPS_PER_SCRIPT = 201
+MAX_STACK_SIZE = 1000
+MAX_SCRIPT_ELEMENT_SIZE = 520
+MAX_SCRIPT_SIZE = 10000
+OP_16 = 96
+
+
+class ScriptLimits:
+    '''
+    Resource limits enforced by Script.evaluate.
+    - max_ops          : non-push ops (and public keys of OP_CHECKMULTISIG)
+    - max_stack_size   : elements on the stack and the altstack together
+    - max_element_size : bytes of a pushed element
+    - max_script_size  : bytes of a serialized script
+    Stricter values can be used as a local policy.
+    '''
+    def __init__(self,
+                 max_ops: int = MAX_OPS_PER_SCRIPT,
+                 max_stack_size: int = MAX_STACK_SIZE,
+                 max_element_size: int = MAX_SCRIPT_ELEMENT_SIZE,
+                 max_script_size: int = MAX_SCRIPT_SIZE) -> None:
+        self.max_ops = max_ops
+        self.max_stack_size = max_stack_size
+        self.max_element_size = max_element_size
+        self.max_script_size = max_script_size
+
+
+CONSENSUS_LIMITS = ScriptLimits()
+
 
 class Script:
-    def __init__(self, cmds: Optional[list[Union[bytes, int]]] = None) -> None:
-        self.cmds: list[Union[bytes, int]] = cmds if cmds is not None else []
+    '''
+    A script is either built from cmds, or parsed from raw bytes.
+    A parsed script keeps its raw bytes, decodes cmds only when they are
+    first accessed and serializes back to the very same bytes, unless
+    cmds were changed since (in place, or by assigning a new list).
+    '''
+    def __init__(self,
+                 cmds: Optional[list[Union[bytes, int]]] = None,
+                 raw: Optional[bytes] = None) -> None:
+        self._raw = raw
+        if cmds is None and raw is None:
+            cmds = []
+        self._cmds = cmds
+        # copy of the cmds decoded from _raw, to notice in-place changes
+        self._decoded: Optional[list[Union[bytes, int]]] = None
+        self._pubkey_type: Optional[str] = None
+
+    @property
+    def cmds(self) -> list[Union[bytes, int]]:
+        if self._cmds is None:
+            self._cmds = decode_cmds(self._raw)  # type: ignore
+            self._decoded = self._cmds[:]
+        return self._cmds
+
+    @cmds.setter
+    def cmds(self, cmds: list[Union[bytes, int]]) -> None:
+        self._cmds = cmds
+        self._raw = None
+        self._decoded = None
+        self._pubkey_type = None
+
+    def _check_changed(self) -> None:
+        # drops what was derived from cmds handed out and changed since
+        if self._decoded is not None and self._cmds != self._decoded:
+            self._raw = None
+            self._decoded = None
+            self._pubkey_type = None
+
+    def pubkey_type(self) -> Optional[str]:
+        '''
+        Returns 'p2pkh' or 'p2sh' if this is such a ScriptPubKey, otherwise
+        None. The result is kept, which pays off for interned scripts.
+        '''
+        self._check_changed()
+        if self._pubkey_type is None:
+            if is_p2pkh_script_pubkey(self.cmds):
+                self._pubkey_type = 'p2pkh'
+            elif is_p2sh_script_pubkey(self.cmds):
+                self._pubkey_type = 'p2sh'
+            else:
+                self._pubkey_type = ''
+        return self._pubkey_type or None
 
     def __add__(self, other: Script) -> Script:
-        return self.__class__(self.cmds + other.cmds)
+        return Script(self.cmds + other.cmds)
 
     def __repr__(self) -> str:
         result: list[str] = []
@@ -37,33 +117,23 @@ class Script:
 
     @classmethod
     def parse(cls, stream: BytesIO):
+        script = cls.parse_lazy(stream)
+        # decode now, to raise SyntaxError for malformed scripts
+        _ = script.cmds
+        return script
+
+    @classmethod
+    def parse_lazy(cls, stream: BytesIO):
         length = read_varint(stream)
-        cmds: list[Union[bytes, int]] = []
-        count = 0
-        while count < length:
-            current: bytes = stream.read(1)
-            count += 1
-            current_byte: int = current[0]
-            if 1 <= current_byte <= 75:
-                n = current_byte
-                cmds.append(stream.read(n))
-                count += n
-            elif current_byte == OP_PUSHDATA1:
-                data_length = little_endian_to_int(stream.read(1))
-                cmds.append(stream.read(data_length))
-                count += 1 + data_length
-            elif current_byte == OP_PUSHDATA2:
-                data_length = little_endian_to_int(stream.read(2))
-                cmds.append(stream.read(data_length))
-                count += 2 + data_length
-            else:
-                op_code = current_byte
-                cmds.append(op_code)
-        if count != length:
+        raw = stream.read(length)
+        if len(raw) != length:
             raise SyntaxError('parsing script failed')
-        return cls(cmds)
+        return cls(raw=raw)
 
     def raw_serialize(self) -> bytes:
+        self._check_changed()
+        if self._raw is not None:
+            return self._raw
         result = b''
         for cmd_i in self.cmds:
             if isinstance(cmd_i, int):
@@ -87,45 +157,131 @@ class Script:
                 result += cmd_i
         return result
 
+    def size(self) -> int:
+        '''length of raw_serialize(), without encoding the cmds'''
+        self._check_changed()
+        if self._raw is not None:
+            return len(self._raw)
+        size = 0
+        for cmd in self.cmds:
+            if isinstance(cmd, int):
+                size += 1
+            else:
+                # push op code and the length itself
+                length = len(cmd)
+                size += length + (1 if length <= 75 else 2 if length <= 255 else 3)
+        return size
+
     def serialize(self) -> bytes:
         result = self.raw_serialize()
         total = len(result)
         return encode_varint(total) + result
 
-    def evaluate(self, z: int) -> bool:
+    def evaluate(self,
+                 z: int,
+                 version: Optional[int] = None,
+                 locktime: Optional[int] = None,
+                 sequence: Optional[int] = None,
+                 limits: ScriptLimits = CONSENSUS_LIMITS,
+                 batch_verify: Optional[BatchVerifier] = None,
+                 script_sig_length: Optional[int] = None) -> bool:
+        '''
+        z is the signature hash. version, locktime and sequence (of the
+        input) are only needed by OP_CHECKLOCKTIMEVERIFY and
+        OP_CHECKSEQUENCEVERIFY, which fail without them.
+        Evaluation is aborted as soon as one of limits is exceeded.
+        batch_verify is handed to OP_CHECKMULTISIG(VERIFY).
+        If this is a ScriptSig followed by a ScriptPubKey, script_sig_length
+        is the number of cmds of the ScriptSig: op counts are then limited
+        for each of them separately. Their serialized sizes are not known
+        here once they are combined, so they are left to the caller
+        (see template.evaluate_scripts).
+        '''
+        if script_sig_length is None and self.size() > limits.max_script_size:
+            LOGGER.info('script size limit exceeded')
+            return False
+        # cmds are walked with a program counter, and may only grow at the
+        # end (RedeemScript of p2sh)
         cmds: list[Union[bytes, int]] = self.cmds[:]
+        # op counts do not depend on execution, check them first
+        # index of the first cmd of the ScriptPubKey, None if not split
+        script_pubkey_start = script_sig_length
+        n_ops = count_ops(cmds, 0, limits, script_pubkey_start)
+        if n_ops is None:
+            return False
+        script_pubkey_ops: Optional[int] = 0
+        if script_pubkey_start is not None:
+            script_pubkey_ops = count_ops(cmds, script_pubkey_start, limits)
+            if script_pubkey_ops is None:
+                return False
+        jumps = find_conditional_jumps(cmds)
+        if jumps is None:
+            LOGGER.info('unbalanced conditional')
+            return False
         stack: list = []
         altstack: list = []
-        while len(cmds) > 0:
-            cmd_i = cmds.pop(0)
+        pc = 0
+        while pc < len(cmds):
+            if len(stack) + len(altstack) > limits.max_stack_size:
+                LOGGER.info('stack size limit exceeded')
+                return False
+            if pc == script_pubkey_start:
+                # ops of the ScriptSig do not count for the ScriptPubKey
+                n_ops = script_pubkey_ops
+                script_pubkey_start = None
+            cmd_i = cmds[pc]
+            pc += 1
             if isinstance(cmd_i, int):
-                operation = OP_CODE_FUNCTIONS[cmd_i]
-                operation_name = OP_CODE_NAMES[cmd_i]
-                if cmd_i in (OP_IF, OP_NOTIF):
-                    if not operation(stack, cmds):
-                        LOGGER.info(f'bad op: {operation_name}')
-                        return False
-                elif cmd_i in (OP_TOALTSTACK, OP_FROMALTSTACK):
-                    if not operation(stack, altstack):
-                        LOGGER.info(f'bad op: {operation_name}')
-                        return False
-                elif cmd_i in (OP_CHECKSIG, OP_CHECKSIGVERIFY,
-                               OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY):
-                    if not operation(stack, z):
-                        LOGGER.info(f'bad op: {operation_name}')
-                        return False
+                entry = OP_CODE_TABLE[cmd_i]
+                if entry is None:
+                    LOGGER.info('unknown op: %s', cmd_i)
+                    return False
+                operation, convention = entry
+                if convention == CALL_STACK:
+                    result = operation(stack)
+                elif convention == CALL_BRANCH:
+                    if cmd_i == OP_ENDIF:
+                        continue
+                    if cmd_i == OP_ELSE:
+                        # 103: the branch before OP_ELSE was run, skip the rest
+                        pc = jumps[pc - 1] + 1
+                        continue
+                    # 99, 100: run the branch selected by the top element,
+                    # jumping over the other one
+                    result = len(stack) > 0
+                    if result:
+                        condition = decode_num(stack.pop()) != 0
+                        if condition != (cmd_i == OP_IF):
+                            pc = jumps[pc - 1] + 1
+                elif convention == CALL_ALTSTACK:
+                    result = operation(stack, altstack)
+                elif convention == CALL_Z:
+                    if cmd_i < OP_CHECKMULTISIG:
+                        result = operation(stack, z)
+                    else:
+                        if len(stack) > 0:
+                            # each public key counts as an op
+                            n_ops += decode_num(stack[-1])
+                            if n_ops > limits.max_ops:
+                                LOGGER.info('op count limit exceeded')
+                                return False
+                        result = operation(stack, z, batch_verify)
+                elif convention == CALL_LOCKTIME:
+                    result = locktime is not None and sequence is not None \
+                        and operation(stack, locktime, sequence)
                 else:
-                    if not operation(stack):
-                        LOGGER.info(f'bad op: {operation_name}')
-                        return False
+                    result = version is not None and sequence is not None \
+                        and operation(stack, version, sequence)
+                if not result:
+                    LOGGER.info('bad op: %s', OP_CODE_NAMES[cmd_i])
+                    return False
             else:
                 stack.append(cmd_i)
 
                 # parse RedeemScript
-                if is_p2sh_script_pubkey(self.cmds):
-                    cmds.pop()
-                    h160 = cmds.pop()
-                    cmds.pop()
+                if len(cmds) - pc == 3 and is_p2sh_script_pubkey(cmds[pc:]):
+                    h160 = cmds[pc + 1]
+                    del cmds[pc:]
                     if not op_hash160(stack):
                         return False
                     stack.append(h160)
@@ -134,10 +290,26 @@ class Script:
                     if not op_verify(stack):
                         LOGGER.info('bad p2sh h160')
                         return False
+                    if len(cmd_i) > limits.max_script_size:
+                        LOGGER.info('script size limit exceeded')
+                        return False
                     redeem_script = encode_varint(len(cmd_i)) + cmd_i
                     stream = BytesIO(redeem_script)
                     cmds.extend(Script.parse(stream).cmds)
+                    # RedeemScript is counted as a script of its own
+                    n_ops = count_ops(cmds, pc, limits)
+                    if n_ops is None:
+                        return False
+                    script_pubkey_start = None
+                    redeem_jumps = find_conditional_jumps(cmds, start=pc)
+                    if redeem_jumps is None:
+                        LOGGER.info('unbalanced conditional')
+                        return False
+                    jumps.update(redeem_jumps)
 
+        if len(stack) + len(altstack) > limits.max_stack_size:
+            LOGGER.info('stack size limit exceeded')
+            return False
         if len(stack) == 0:
             return False
         if stack.pop() == b'':
@@ -145,6 +317,154 @@ class Script:
         return True
 
 
+class InternedScript(Script):
+    '''Script shared through ScriptInterner, cmds can not be reassigned'''
+    @property
+    def cmds(self) -> list[Union[bytes, int]]:
+        if self._cmds is None:
+            self._cmds = decode_cmds(self._raw)  # type: ignore
+            self._decoded = self._cmds[:]
+        return self._cmds
+
+    @cmds.setter
+    def cmds(self, cmds: list[Union[bytes, int]]) -> None:
+        raise TypeError('interned script is immutable')
+
+
+class ScriptInterner:
+    '''
+    LRU map of raw script bytes -> InternedScript, so that outputs paying
+    to the same ScriptPubKey share one Script object (and its decoded cmds
+    and pubkey_type).
+    '''
+    def __init__(self, max_entries: Optional[int] = 1 << 16) -> None:
+        self.max_entries = max_entries
+        self.scripts: OrderedDict[bytes, InternedScript] = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.scripts)
+
+    def intern(self, raw: bytes) -> InternedScript:
+        script = self.scripts.get(raw)
+        if script is not None:
+            self.hits += 1
+            self.saved_bytes += len(raw)
+            self.scripts.move_to_end(raw)
+            return script
+        self.misses += 1
+        script = InternedScript(raw=raw)
+        self.scripts[raw] = script
+        self.n_bytes += len(raw)
+        if self.max_entries is not None and len(self.scripts) > self.max_entries:
+            old_raw, _ = self.scripts.popitem(last=False)
+            self.n_bytes -= len(old_raw)
+        return script
+
+    def parse(self, stream: BytesIO) -> InternedScript:
+        length = read_varint(stream)
+        raw = stream.read(length)
+        if len(raw) != length:
+            raise SyntaxError('parsing script failed')
+        return self.intern(raw)
+
+    def clear(self) -> None:
+        self.scripts.clear()
+        self.n_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self.scripts),
+            'bytes': self.n_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'saved_bytes': self.saved_bytes,
+        }
+
+
+# shared by the parsers of ScriptPubKeys
+SCRIPT_INTERNER = ScriptInterner()
+
+
+def decode_cmds(raw: bytes) -> list[Union[bytes, int]]:
+    '''split raw script bytes (without the length prefix) into cmds'''
+    cmds: list[Union[bytes, int]] = []
+    length = len(raw)
+    i = 0
+    while i < length:
+        current_byte = raw[i]
+        i += 1
+        if 1 <= current_byte <= 75:
+            data_length = current_byte
+        elif current_byte == OP_PUSHDATA1:
+            data_length = raw[i] if i < length else 0
+            i += 1
+        elif current_byte == OP_PUSHDATA2:
+            data_length = little_endian_to_int(raw[i:i + 2])
+            i += 2
+        else:
+            cmds.append(current_byte)
+            continue
+        cmds.append(raw[i:i + data_length])
+        i += data_length
+    if i != length:
+        raise SyntaxError('parsing script failed')
+    return cmds
+
+
+def count_ops(cmds: list[Union[bytes, int]], start: int,
+              limits: ScriptLimits, stop: Optional[int] = None) -> Optional[int]:
+    '''
+    Returns the number of non-push ops in cmds[start:stop],
+    or None if there are too many or an element is too large.
+    Ops in branches which are not executed count as well.
+    The script size is checked on the serialized script, since cmds do
+    not tell how their pushes were encoded.
+    '''
+    n_ops = 0
+    for i in range(start, len(cmds) if stop is None else stop):
+        cmd = cmds[i]
+        if isinstance(cmd, int):
+            if cmd > OP_16:
+                n_ops += 1
+        elif len(cmd) > limits.max_element_size:
+            LOGGER.info('element size limit exceeded')
+            return None
+    if n_ops > limits.max_ops:
+        LOGGER.info('op count limit exceeded')
+        return None
+    return n_ops
+
+
+def find_conditional_jumps(cmds: list[Union[bytes, int]],
+                           start: int = 0) -> Optional[dict[int, int]]:
+    '''
+    Returns a jump table for OP_IF/OP_NOTIF/OP_ELSE in cmds[start:].
+    Each of them is mapped to the index of the OP_ELSE or OP_ENDIF that
+    closes its branch, or None if the conditionals are not balanced.
+    '''
+    jumps: dict[int, int] = {}
+    opened: list[int] = []
+    for i in range(start, len(cmds)):
+        cmd = cmds[i]
+        if not isinstance(cmd, int):
+            continue
+        if cmd in (OP_IF, OP_NOTIF):
+            opened.append(i)
+        elif cmd in (OP_ELSE, OP_ENDIF):
+            if len(opened) == 0:
+                return None
+            jumps[opened.pop()] = i
+            if cmd == OP_ELSE:
+                opened.append(i)
+    if len(opened) > 0:
+        return None
+    return jumps
+
+
 def is_p2pkh_script_pubkey(cmds: list[Union[bytes, int]]) -> bool:
     '''
     Returns whether this follows
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+from io import BytesIO
+from typing import Optional, Union
+
+from src.helper import encode_varint, hash160
+from src.op import (OP_CHECKMULTISIG, BatchVerifier, op_checkmultisig,
+                    op_checksig)
+from src.script import (CONSENSUS_LIMITS, MAX_SCRIPT_ELEMENT_SIZE, Script,
+                        ScriptLimits)
+
+P2PKH = 'p2pkh'
+P2SH_MULTISIG = 'p2sh-multisig'
+
+OP_1 = 81
+OP_16 = 96
+
+
+def parse_multisig_redeem_script(
+        raw_redeem: bytes) -> Optional[tuple[int, list[bytes]]]:
+    '''
+    Returns (m, sec_pubkeys) if raw_redeem is
+    [OP_m, <sec 1>, ..., <sec n>, OP_n, OP_CHECKMULTISIG], otherwise None.
+    '''
+    try:
+        cmds = Script.parse(BytesIO(encode_varint(len(raw_redeem)) + raw_redeem)).cmds
+    except (IndexError, SyntaxError):
+        return None
+    if len(cmds) < 4 or cmds[-1] != OP_CHECKMULTISIG:
+        return None
+    m, n = cmds[0], cmds[-2]
+    if not isinstance(m, int) or not isinstance(n, int) \
+            or not OP_1 <= m <= n <= OP_16:
+        return None
+    sec_pubkeys = list(cmds[1:-2])
+    if len(sec_pubkeys) != n - OP_1 + 1 \
+            or not all(isinstance(sec, bytes) for sec in sec_pubkeys):
+        return None
+    return m - OP_1 + 1, sec_pubkeys  # type: ignore
+
+
+def classify_script(script_sig: Script, script_pubkey: Script) -> Optional[str]:
+    '''
+    Returns the template which script_sig + script_pubkey exactly follows,
+    or None if the generic interpreter has to be used.
+    '''
+    sig_cmds = script_sig.cmds
+    if any(isinstance(cmd, bytes) and len(cmd) > MAX_SCRIPT_ELEMENT_SIZE
+           for cmd in sig_cmds):
+        # let the generic interpreter reject it
+        return None
+    pubkey_type = script_pubkey.pubkey_type()
+    if pubkey_type == 'p2pkh':
+        if len(sig_cmds) == 2 and all(isinstance(cmd, bytes) for cmd in sig_cmds):
+            return P2PKH
+        return None
+    if pubkey_type == 'p2sh':
+        # [OP_0, <sig 1>, ..., <sig m>, <RedeemScript>]
+        if len(sig_cmds) < 3 or sig_cmds[0] != 0 \
+                or not all(isinstance(cmd, bytes) for cmd in sig_cmds[1:]):
+            return None
+        multisig = parse_multisig_redeem_script(sig_cmds[-1])  # type: ignore
+        if multisig is not None and multisig[0] == len(sig_cmds) - 2:
+            return P2SH_MULTISIG
+    return None
+
+
+def verify_p2pkh(script_sig: Script,
+                 script_pubkey: Script,
+                 z: int,
+                 batch_verify: Optional[BatchVerifier] = None) -> bool:
+    # a single signature is verified directly, batch_verify is not used
+    sig, sec = script_sig.cmds
+    if hash160(sec) != script_pubkey.cmds[2]:  # type: ignore
+        return False
+    stack = [sig, sec]
+    return op_checksig(stack, z) and stack[-1] != b''
+
+
+def verify_p2sh_multisig(script_sig: Script,
+                         script_pubkey: Script,
+                         z: int,
+                         batch_verify: Optional[BatchVerifier] = None) -> bool:
+    raw_redeem: bytes = script_sig.cmds[-1]  # type: ignore
+    if hash160(raw_redeem) != script_pubkey.cmds[1]:
+        return False
+    m, sec_pubkeys = parse_multisig_redeem_script(raw_redeem)  # type: ignore
+    # the stack the generic interpreter would have built for OP_CHECKMULTISIG
+    stack: list[Union[bytes, int]] = [b'']
+    stack.extend(script_sig.cmds[1:-1])
+    stack.append(bytes([m]))
+    stack.extend(sec_pubkeys)
+    stack.append(bytes([len(sec_pubkeys)]))
+    return op_checkmultisig(stack, z, batch_verify) and stack[-1] != b''
+
+
+VERIFIERS = {
+    P2PKH: verify_p2pkh,
+    P2SH_MULTISIG: verify_p2sh_multisig,
+}
+
+
+def evaluate_scripts(script_sig: Script,
+                     script_pubkey: Script,
+                     z: int,
+                     version: Optional[int] = None,
+                     locktime: Optional[int] = None,
+                     sequence: Optional[int] = None,
+                     limits: ScriptLimits = CONSENSUS_LIMITS,
+                     batch_verify: Optional[BatchVerifier] = None) -> bool:
+    '''
+    Same result as (script_sig + script_pubkey).evaluate(z, ...) with
+    script_sig_length=len(script_sig.cmds), i.e. limits apply to each
+    script separately, with fast paths for the common templates.
+    The templates stay within the consensus limits, so other limits
+    always go through the generic interpreter.
+    '''
+    # sizes of the scripts as serialized, pushes need not be minimal
+    if script_sig.size() > limits.max_script_size \
+            or script_pubkey.size() > limits.max_script_size:
+        return False
+    template = None
+    if limits is CONSENSUS_LIMITS:
+        template = classify_script(script_sig, script_pubkey)
+    if template is None:
+        return (script_sig + script_pubkey).evaluate(
+            z, version, locktime, sequence, limits, batch_verify,
+            script_sig_length=len(script_sig.cmds))
+    return VERIFIERS[template](script_sig, script_pubkey, z, batch_verify)
@@ -1,16 +1,22 @@
 from __future__ import annotations
 
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Optional
-
-import requests
+from typing import Iterable, Mapping, Optional
 
+from src.backend import (MAINNET_URL, TESTNET_URL, AsyncHttpBackend,
+                         HttpBackend, TxBackend)
 from src.helper import (SIGHASH_ALL, encode_varint, hash256,
                         int_to_little_endian, little_endian_to_int,
                         read_varint)
-from src.script import Script, is_p2sh_script_pubkey
+from src.op import BatchVerifier
+from src.script import SCRIPT_INTERNER, Script, is_p2sh_script_pubkey
 from src.secp256k1 import PrivateKey
+from src.template import evaluate_scripts
+from src.txcache import TxCache
+from src.txstore import TxStore
 
 
 class Tx:
@@ -22,12 +28,16 @@ class Tx:
                  tx_ins: list[TxIn],
                  tx_outs: list[TxOut],
                  locktime: int,
-                 testnet: bool = False):
+                 testnet: bool = False,
+                 segwit: bool = False):
         self.version = version
         self.tx_ins = tx_ins
         self.tx_outs = tx_outs
         self.locktime = locktime
         self.testnet = testnet
+        self.segwit = segwit
+        # (prev_tx, prev_index) -> TxOut spent by this transaction
+        self.prevouts: Optional[dict[tuple[bytes, int], TxOut]] = None
 
     def id(self) -> str:
         return self.hash().hex()
@@ -40,6 +50,13 @@ class Tx:
         version = little_endian_to_int(stream.read(cls.bytes_version))
 
         n_tx_in = read_varint(stream)
+        segwit = False
+        if n_tx_in == 0:
+            # BIP144: marker 0x00 (no tx can have 0 inputs) and flag 0x01
+            if stream.read(1) != b'\x01':
+                raise SyntaxError('invalid segwit flag')
+            segwit = True
+            n_tx_in = read_varint(stream)
         tx_ins = []
         for _ in range(n_tx_in):
             tx_ins.append(TxIn.parse(stream))
@@ -49,8 +66,15 @@ class Tx:
         for _ in range(n_tx_out):
             tx_outs.append(TxOut.parse(stream))
 
+        if segwit:
+            for tx_in in tx_ins:
+                n_items = read_varint(stream)
+                tx_in.witness = [stream.read(read_varint(stream))
+                                 for _ in range(n_items)]
+
         locktime = little_endian_to_int(stream.read(cls.bytes_locktime))
-        return cls(version, tx_ins, tx_outs, locktime, testnet=testnet)
+        return cls(version, tx_ins, tx_outs, locktime, testnet=testnet,
+                   segwit=segwit)
 
     def serialize(self) -> bytes:
         result = int_to_little_endian(self.version, self.bytes_version)
@@ -66,10 +90,74 @@ class Tx:
         result += int_to_little_endian(self.locktime, self.bytes_locktime)
         return result
 
-    def fee(self) -> int:
+    def serialize_segwit(self) -> bytes:
+        '''
+        serialization with marker, flag and witness (BIP144).
+        serialize() leaves them out, as the tx id is computed without them.
+        '''
+        if not self.segwit:
+            return self.serialize()
+        result = int_to_little_endian(self.version, self.bytes_version)
+        result += b'\x00\x01'
+
+        result += encode_varint(len(self.tx_ins))
+        for tx_in_i in self.tx_ins:
+            result += tx_in_i.serialize()
+
+        result += encode_varint(len(self.tx_outs))
+        for tx_out_i in self.tx_outs:
+            result += tx_out_i.serialize()
+
+        for tx_in_i in self.tx_ins:
+            result += encode_varint(len(tx_in_i.witness))
+            for item in tx_in_i.witness:
+                result += encode_varint(len(item)) + item
+
+        result += int_to_little_endian(self.locktime, self.bytes_locktime)
+        return result
+
+    def resolve_prevouts(
+        self,
+        utxos: Optional[Mapping[tuple[bytes, int], TxOut]] = None
+    ) -> dict[tuple[bytes, int], TxOut]:
+        '''
+        gather the outputs spent by this transaction, once for all of
+        fee, sig_hash and verify_input.
+        utxos maps (prev_tx, prev_index) to TxOut and is looked up first,
+        the rest is fetched by TxFetcher at once.
+        '''
+        prevouts: dict[tuple[bytes, int], TxOut] = {}
+        missing: list[tuple[bytes, int]] = []
+        for tx_in in self.tx_ins:
+            outpoint = (tx_in.prev_tx, tx_in.prev_index)
+            if utxos is not None and outpoint in utxos:
+                prevouts[outpoint] = utxos[outpoint]
+            elif self.prevouts is not None and outpoint in self.prevouts:
+                prevouts[outpoint] = self.prevouts[outpoint]
+            else:
+                missing.append(outpoint)
+        if missing:
+            txs = TxFetcher.fetch_many([prev_tx.hex() for prev_tx, _ in missing],
+                                       testnet=self.testnet)
+            for prev_tx, prev_index in missing:
+                prevouts[(prev_tx, prev_index)] = \
+                    txs[prev_tx.hex()].tx_outs[prev_index]
+        self.prevouts = prevouts
+        return prevouts
+
+    def prevout(self, input_index: int) -> TxOut:
+        tx_in = self.tx_ins[input_index]
+        outpoint = (tx_in.prev_tx, tx_in.prev_index)
+        if self.prevouts is None or outpoint not in self.prevouts:
+            self.resolve_prevouts()
+        return self.prevouts[outpoint]
+
+    def fee(self,
+            utxos: Optional[Mapping[tuple[bytes, int], TxOut]] = None) -> int:
+        prevouts = self.resolve_prevouts(utxos)
         in_values = 0
         for tx_in_i in self.tx_ins:
-            in_values += tx_in_i.value()
+            in_values += prevouts[(tx_in_i.prev_tx, tx_in_i.prev_index)].amount
         out_amounts = 0
         for tx_out_i in self.tx_outs:
             out_amounts += tx_out_i.amount
@@ -83,7 +171,7 @@ class Tx:
             TxIn(prev_tx=tx_in.prev_tx,
                  prev_index=tx_in.prev_index,
                  script_sig=redeem_script
-                 if redeem_script else tx_in.script_pubkey(self.testnet),
+                 if redeem_script else self.prevout(i).script_pub_key,
                  sequence=tx_in.sequence)
             if i == input_index else TxIn(prev_tx=tx_in.prev_tx,
                                           prev_index=tx_in.prev_index,
@@ -100,10 +188,12 @@ class Tx:
                        int_to_little_endian(hash_type, 4))
         return int.from_bytes(h256, 'big')
 
-    def verify_input(self, input_index: int) -> bool:
-        # verify i-th transaction input
+    def verify_input(self,
+                     input_index: int,
+                     batch_verify: Optional[BatchVerifier] = None) -> bool:
+        # verify i-th transaction input, batch_verify goes to OP_CHECKMULTISIG
         tx_in = self.tx_ins[input_index]
-        script_pubkey = tx_in.script_pubkey(testnet=self.testnet)
+        script_pubkey = self.prevout(input_index).script_pub_key
         if is_p2sh_script_pubkey(script_pubkey.cmds):
             cmd = tx_in.script_sig.cmds[-1]
             if isinstance(cmd, bytes):
@@ -115,18 +205,37 @@ class Tx:
             redeem_script = None
         script_sig = tx_in.script_sig
         z = self.sig_hash(input_index, redeem_script=redeem_script)
-        s = script_sig + script_pubkey
-        return s.evaluate(z)
-
-    def verify(self) -> bool:
+        return evaluate_scripts(script_sig,
+                                script_pubkey,
+                                z,
+                                version=self.version,
+                                locktime=self.locktime,
+                                sequence=tx_in.sequence,
+                                batch_verify=batch_verify)
+
+    def verify(
+            self,
+            utxos: Optional[Mapping[tuple[bytes, int], TxOut]] = None,
+            batch_verify: Optional[BatchVerifier] = None) -> bool:
         # verify whole transaction
-        if self.fee() < 0:
+        if self.fee(utxos) < 0:
             return False
         for i in range(len(self.tx_ins)):
-            if not self.verify_input(i):
+            if not self.verify_input(i, batch_verify):
                 return False
         return True
 
+    async def verify_async(self,
+                           batch_verify: Optional[BatchVerifier] = None) -> bool:
+        # fetch all previous transactions concurrently, then verify locally
+        txs = await AsyncTxFetcher.fetch_many(
+            [tx_in.prev_tx.hex() for tx_in in self.tx_ins],
+            testnet=self.testnet)
+        utxos = {(tx_in.prev_tx, tx_in.prev_index):
+                 txs[tx_in.prev_tx.hex()].tx_outs[tx_in.prev_index]
+                 for tx_in in self.tx_ins}
+        return self.verify(utxos, batch_verify)
+
     def sign_input(self,
                    pk: PrivateKey,
                    input_index: int,
@@ -159,7 +268,8 @@ class TxIn:
                  prev_tx: bytes,
                  prev_index: int,
                  script_sig: Optional[Script] = None,
-                 sequence: int = 0xff_ff_ff_ff) -> None:
+                 sequence: int = 0xff_ff_ff_ff,
+                 witness: Optional[list[bytes]] = None) -> None:
         self.prev_tx = prev_tx
         self.prev_index = prev_index
         if script_sig is None:
@@ -167,6 +277,7 @@ class TxIn:
         else:
             self.script_sig = script_sig
         self.sequence = sequence
+        self.witness: list[bytes] = witness if witness is not None else []
 
     def __repr__(self) -> str:
         return f'{self.prev_tx.hex()}:{self.prev_index}'
@@ -175,7 +286,7 @@ class TxIn:
     def parse(cls, stream: BytesIO) -> TxIn:
         prev_tx = stream.read(32)[::-1]
         prev_index = little_endian_to_int(stream.read(4))
-        script_sig = Script.parse(stream)
+        script_sig = Script.parse_lazy(stream)
         sequence = little_endian_to_int(stream.read(4))
         return cls(prev_tx, prev_index, script_sig, sequence)
 
@@ -209,7 +320,7 @@ class TxOut:
     @classmethod
     def parse(cls, stream: BytesIO) -> TxOut:
         amount = little_endian_to_int(stream.read(8))
-        script_pub_key = Script.parse(stream)
+        script_pub_key = SCRIPT_INTERNER.parse(stream)
         return cls(amount, script_pub_key)
 
     def serialize(self) -> bytes:
@@ -218,61 +329,157 @@ class TxOut:
         return result
 
 
+def parse_raw_tx(raw: bytes, testnet: bool = False) -> Tx:
+    return Tx.parse(BytesIO(raw), testnet=testnet)
+
+
 class TxFetcher:
-    cache: dict[str, Tx] = {}
+    cache: TxCache = TxCache(parse=parse_raw_tx)
+    store: Optional[TxStore] = None
+    backend: TxBackend = HttpBackend()
+    max_workers = 16
 
     @classmethod
     def get_url(cls, testnet: bool = False) -> str:
-        # https://blockstream.info/nojs/
-        # https://github.com/Blockstream/esplora/blob/master/API.md
-        if testnet:
-            return 'https://blockstream.info/testnet/api'
-        else:
-            return 'https://blockstream.info/api'
+        if isinstance(cls.backend, HttpBackend):
+            return cls.backend.get_url(testnet)
+        return TESTNET_URL if testnet else MAINNET_URL
+
+    @classmethod
+    def configure_cache(cls,
+                        max_entries: Optional[int] = None,
+                        max_bytes: Optional[int] = None,
+                        hot_entries: Optional[int] = None):
+        new_cache = TxCache(parse=parse_raw_tx,
+                            max_entries=max_entries,
+                            max_bytes=max_bytes,
+                            hot_entries=hot_entries)
+        for k, raw in cls.cache.raw_items():
+            new_cache.put_raw(k, raw)
+        cls.cache = new_cache
+
+    @classmethod
+    def lookup(cls, tx_id: str, testnet: bool = False) -> Optional[Tx]:
+        # look up the cache and the local store, without using the backend
+        tx = cls.cache.get(tx_id)
+        if tx is None and cls.store is not None and tx_id in cls.store:
+            # parse lazily, only what is actually looked up
+            raw = cls.store.get(tx_id)
+            tx = parse_raw_tx(raw, testnet)
+            cls.cache.put(tx_id, tx, len(raw))
+        return tx
+
+    @classmethod
+    def add(cls, tx_id: str, raw: bytes, testnet: bool = False) -> Tx:
+        tx = parse_raw_tx(raw, testnet=testnet)
+        if tx.id() != tx_id:
+            raise ValueError(f'not the same id {tx.id()} vs {tx_id}.')
+        cls.cache.put(tx_id, tx, len(raw))
+        if cls.store is not None:
+            cls.store.put(tx_id, raw)
+        return tx
 
     @classmethod
     def fetch(cls,
               tx_id: str,
               testnet: bool = False,
               fresh: bool = False) -> Tx:
-        if fresh or (tx_id not in cls.cache):
-            url = f'{cls.get_url(testnet)}/tx/{tx_id}/hex'
-            response = requests.get(url)
-            try:
-                raw = bytes.fromhex(response.text.strip())
-            except ValueError:
-                raise ValueError(f'unexpected response: {response.text}')
-            if raw[4] == 0:
-                raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
-                tx.locktime = little_endian_to_int(raw[-4:])
+        tx = None if fresh else cls.lookup(tx_id, testnet)
+        if tx is None:
+            raw = cls.backend.fetch_raw(tx_id, testnet)
+            tx = cls.add(tx_id, raw, testnet)
+        tx.testnet = testnet
+        return tx
+
+    @classmethod
+    def fetch_many(cls,
+                   tx_ids: Iterable[str],
+                   testnet: bool = False,
+                   fresh: bool = False) -> dict[str, Tx]:
+        '''
+        fetch transactions, sending the backend lookups concurrently
+        with at most max_workers requests in flight
+        '''
+        result: dict[str, Tx] = {}
+        missing: list[str] = []
+        for tx_id in dict.fromkeys(tx_ids):
+            tx = None if fresh else cls.lookup(tx_id, testnet)
+            if tx is None:
+                missing.append(tx_id)
             else:
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
+                result[tx_id] = tx
+        if len(missing) == 1:
+            result[missing[0]] = cls.fetch(missing[0], testnet, fresh=True)
+        elif missing:
+            n_workers = min(cls.max_workers, len(missing))
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                raws = executor.map(
+                    lambda tx_id: cls.backend.fetch_raw(tx_id, testnet),
+                    missing)
+                # parse and store in this thread, the cache is not locked
+                for tx_id, raw in zip(missing, raws):
+                    result[tx_id] = cls.add(tx_id, raw, testnet)
+        for tx in result.values():
+            tx.testnet = testnet
+        return result
 
-            if tx.id() != tx_id:
-                raise ValueError(f'not the same id {tx.id()} vs {tx_id}.')
+    @classmethod
+    def open_store(cls, filename: str):
+        cls.close_store()
+        cls.store = TxStore(filename)
 
-            cls.cache[tx_id] = tx
-        cls.cache[tx_id].testnet = testnet
-        return cls.cache[tx_id]
+    @classmethod
+    def close_store(cls):
+        if cls.store is not None:
+            cls.store.close()
+            cls.store = None
 
     @classmethod
     def load_cache(cls, filename: str):
         with open(filename, 'r') as reader:
             disk_cache = json.loads(reader.read())
         for k, raw_hex in disk_cache.items():
-            raw = bytes.fromhex(raw_hex)
-            if raw[4] == 0:
-                raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw))
-                tx.locktime = little_endian_to_int(raw[-4:])
-            else:
-                tx = Tx.parse(BytesIO(raw))
-            cls.cache[k] = tx
+            cls.cache.put_raw(k, bytes.fromhex(raw_hex))
 
     @classmethod
     def dump_cache(cls, filename: str):
         with open(filename, 'w') as writer:
-            to_dump = {k: tx.serialize().hex() for k, tx in cls.cache.items()}
+            to_dump = {k: raw.hex() for k, raw in cls.cache.raw_items()}
             s = json.dumps(to_dump, sort_keys=True, indent=4)
             writer.write(s)
+
+
+class AsyncTxFetcher:
+    '''
+    asyncio version of TxFetcher.
+    The cache and the store are shared with TxFetcher.
+    '''
+    backend: AsyncHttpBackend = AsyncHttpBackend()
+    max_concurrency = 16
+
+    @classmethod
+    async def fetch(cls,
+                    tx_id: str,
+                    testnet: bool = False,
+                    fresh: bool = False) -> Tx:
+        tx = None if fresh else TxFetcher.lookup(tx_id, testnet)
+        if tx is None:
+            raw = await cls.backend.fetch_raw(tx_id, testnet)
+            tx = TxFetcher.add(tx_id, raw, testnet)
+        tx.testnet = testnet
+        return tx
+
+    @classmethod
+    async def fetch_many(cls,
+                         tx_ids: Iterable[str],
+                         testnet: bool = False,
+                         fresh: bool = False) -> dict[str, Tx]:
+        semaphore = asyncio.Semaphore(cls.max_concurrency)
+
+        async def fetch_one(tx_id: str) -> Tx:
+            async with semaphore:
+                return await cls.fetch(tx_id, testnet, fresh)
+
+        unique_ids = list(dict.fromkeys(tx_ids))
+        txs = await asyncio.gather(*[fetch_one(i) for i in unique_ids])
+        return dict(zip(unique_ids, txs))
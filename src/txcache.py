@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, Optional
+
+
+class TxCache:
+    '''
+    LRU cache of transactions with optional bounds.
+
+    - max_entries : maximum number of cached transactions
+    - max_bytes   : maximum approximate memory usage
+    - hot_entries : number of most recently used transactions kept parsed,
+                    older ones are kept as raw bytes and parsed again on access
+
+    Parsed transactions are accounted as parsed_size_factor times their
+    serialized size (measured with tracemalloc for typical p2pkh txs).
+    '''
+    parsed_size_factor = 8
+
+    def __init__(self,
+                 parse: Callable[[bytes], Any],
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 hot_entries: Optional[int] = None) -> None:
+        self.parse = parse
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hot_entries = hot_entries
+        self.hot: OrderedDict[str, Any] = OrderedDict()
+        self.cold: OrderedDict[str, bytes] = OrderedDict()
+        self.sizes: dict[str, int] = {}
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.hot) + len(self.cold)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.hot or key in self.cold
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.cold
+        yield from self.hot
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, tx: Any) -> None:
+        self.put(key, tx, len(tx.serialize_segwit()))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self),
+            'hot_entries': len(self.hot),
+            'cold_entries': len(self.cold),
+            'bytes': self.n_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def get(self, key: str) -> Any:
+        if key in self.hot:
+            self.hits += 1
+            self.hot.move_to_end(key)
+            return self.hot[key]
+        if key in self.cold:
+            self.hits += 1
+            raw = self.cold.pop(key)
+            size = self.sizes.pop(key)
+            self.n_bytes -= size
+            tx = self.parse(raw)
+            self.put(key, tx, size)
+            return tx
+        self.misses += 1
+        return None
+
+    def put(self, key: str, tx: Any, size: int) -> None:
+        '''store a parsed transaction whose serialized size is size'''
+        self.discard(key)
+        self.hot[key] = tx
+        self.sizes[key] = size * self.parsed_size_factor
+        self.n_bytes += self.sizes[key]
+        if self.hot_entries is not None:
+            while len(self.hot) > self.hot_entries:
+                self._demote()
+        self._evict()
+
+    def put_raw(self, key: str, raw: bytes) -> None:
+        '''store a transaction as raw bytes without parsing it'''
+        self.discard(key)
+        self.cold[key] = raw
+        self.sizes[key] = len(raw)
+        self.n_bytes += self.sizes[key]
+        self._evict()
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        if key in self.hot:
+            value = self.hot[key]
+        elif key in self.cold:
+            value = self.parse(self.cold[key])
+        else:
+            return default
+        self.discard(key)
+        return value
+
+    def discard(self, key: str) -> None:
+        if key not in self:
+            return
+        self.hot.pop(key, None)
+        self.cold.pop(key, None)
+        self.n_bytes -= self.sizes.pop(key)
+
+    def clear(self) -> None:
+        self.hot.clear()
+        self.cold.clear()
+        self.sizes.clear()
+        self.n_bytes = 0
+
+    def raw_items(self) -> Iterator[tuple[str, bytes]]:
+        for key, raw in self.cold.items():
+            yield key, raw
+        for key, tx in self.hot.items():
+            yield key, tx.serialize_segwit()
+
+    def _demote(self) -> None:
+        key, tx = self.hot.popitem(last=False)
+        raw = tx.serialize_segwit()
+        self.n_bytes -= self.sizes[key]
+        self.cold[key] = raw
+        self.sizes[key] = len(raw)
+        self.n_bytes += self.sizes[key]
+
+    def _over_limit(self) -> bool:
+        if self.max_entries is not None and len(self) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self.n_bytes > self.max_bytes:
+            return True
+        return False
+
+    def _evict(self) -> None:
+        # raw entries go first, in LRU order within each tier
+        while self._over_limit() and len(self) > 0:
+            if self.cold:
+                key, _ = self.cold.popitem(last=False)
+            else:
+                key, _ = self.hot.popitem(last=False)
+            self.n_bytes -= self.sizes.pop(key)
+            self.evictions += 1
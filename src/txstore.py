@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+from typing import Iterator, Optional
+
+from src.helper import int_to_little_endian, little_endian_to_int
+
+
+class TxStore:
+    '''
+    Append-only binary store of raw transactions.
+
+    - <filename>     : raw transactions written back to back
+    - <filename>.idx : <number of sorted records 8> followed by fixed-size
+                       records of <txid 32><offset 8><length 4>
+
+    The index is not loaded on open: its sorted records are memory-mapped
+    and searched by bisection. New records are appended to the index file
+    unsorted and kept in a small dict as well; once there are
+    merge_threshold of them (or an eighth of the sorted records, if more)
+    they are merged into the sorted records (compaction).
+    The data file is memory-mapped and transactions are returned as raw
+    bytes, so parsing is left to the caller.
+    '''
+    bytes_tx_id = 32
+    bytes_offset = 8
+    bytes_length = 4
+    record_size = bytes_tx_id + bytes_offset + bytes_length
+    bytes_header = 8
+    merge_threshold = 1 << 12
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.data_file = open(filename, 'ab+')
+        self.index_file = open(self.index_filename, 'ab+')
+        # records not merged into the sorted ones yet
+        self.pending: dict[bytes, tuple[int, int]] = {}
+        self.n_sorted = 0
+        self._records: Optional[mmap.mmap] = None
+        self._map: Optional[mmap.mmap] = None
+        self._open_index()
+
+    def __enter__(self) -> TxStore:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.n_sorted + len(self.pending)
+
+    def __contains__(self, tx_id: str) -> bool:
+        return self._lookup(bytes.fromhex(tx_id)) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.n_sorted):
+            yield self._key(i).hex()
+        for key in self.pending:
+            yield key.hex()
+
+    def _open_index(self) -> None:
+        index_size = os.path.getsize(self.index_filename)
+        if index_size < self.bytes_header:
+            # new index, or an interrupted write of the header
+            self.index_file.truncate(0)
+            self.index_file.write(int_to_little_endian(0, self.bytes_header))
+            self.index_file.flush()
+            return
+        self._records = self._map_index()
+        self.n_sorted = little_endian_to_int(self._records[:self.bytes_header])
+        # ignore a trailing partial record left by an interrupted write
+        n_records = (index_size - self.bytes_header) // self.record_size
+        data_size = os.path.getsize(self.filename)
+        n_valid = n_records
+        for i in range(self.n_sorted, n_records):
+            offset, length = self._entry(i)
+            if offset + length > data_size:
+                # data was not fully written
+                n_valid = i
+                break
+            self.pending[self._key(i)] = (offset, length)
+        if n_valid != n_records or index_size != self._record_start(n_records):
+            # later records have to be appended at a record boundary
+            self.index_file.truncate(self._record_start(n_valid))
+
+    def _map_index(self) -> mmap.mmap:
+        return mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _record_start(self, i: int) -> int:
+        return self.bytes_header + i * self.record_size
+
+    def _key(self, i: int) -> bytes:
+        start = self._record_start(i)
+        return self._records[start:start + self.bytes_tx_id]  # type: ignore
+
+    def _entry(self, i: int) -> tuple[int, int]:
+        start = self._record_start(i) + self.bytes_tx_id
+        records = self._records
+        offset = little_endian_to_int(records[start:start + self.bytes_offset])  # type: ignore
+        start += self.bytes_offset
+        length = little_endian_to_int(records[start:start + self.bytes_length])  # type: ignore
+        return offset, length
+
+    def _bisect(self, key: bytes) -> int:
+        '''position of the first sorted record whose txid is not below key'''
+        lo, hi = 0, self.n_sorted
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _lookup(self, key: bytes) -> Optional[tuple[int, int]]:
+        entry = self.pending.get(key)
+        if entry is not None:
+            return entry
+        i = self._bisect(key)
+        if i < self.n_sorted and self._key(i) == key:
+            return self._entry(i)
+        return None
+
+    def _data_map(self, end: int) -> mmap.mmap:
+        if self._map is None or len(self._map) < end:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self.data_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        return self._map
+
+    def get(self, tx_id: str) -> Optional[bytes]:
+        entry = self._lookup(bytes.fromhex(tx_id))
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._data_map(offset + length)[offset:offset + length]
+
+    def put(self, tx_id: str, raw: bytes) -> None:
+        key = bytes.fromhex(tx_id)
+        if self._lookup(key) is not None:
+            return
+        self.data_file.seek(0, os.SEEK_END)
+        offset = self.data_file.tell()
+        self.data_file.write(raw)
+        # data has to reach the file before the index refers to it
+        self.data_file.flush()
+        record = key
+        record += int_to_little_endian(offset, self.bytes_offset)
+        record += int_to_little_endian(len(raw), self.bytes_length)
+        self.index_file.write(record)
+        self.index_file.flush()
+        self.pending[key] = (offset, len(raw))
+        if len(self.pending) >= max(self.merge_threshold, self.n_sorted >> 3):
+            self.compact()
+
+    def compact(self) -> None:
+        '''
+        Merges the pending records into the sorted ones. The new index is
+        written next to the old one and replaces it, so an interruption
+        leaves the old index in place.
+        '''
+        if not self.pending:
+            return
+        tmp_filename = self.index_filename + '.tmp'
+        with open(tmp_filename, 'wb') as writer:
+            writer.write(int_to_little_endian(len(self), self.bytes_header))
+            # runs of sorted records are copied as they are, with the
+            # pending records inserted in between
+            copied = 0
+            for key in sorted(self.pending):
+                i = self._bisect(key)
+                if i > copied:
+                    writer.write(self._records[  # type: ignore
+                        self._record_start(copied):self._record_start(i)])
+                    copied = i
+                offset, length = self.pending[key]
+                writer.write(key
+                             + int_to_little_endian(offset, self.bytes_offset)
+                             + int_to_little_endian(length, self.bytes_length))
+            if self.n_sorted > copied:
+                writer.write(self._records[  # type: ignore
+                    self._record_start(copied):self._record_start(self.n_sorted)])
+            writer.flush()
+            os.fsync(writer.fileno())
+        if self._records is not None:
+            self._records.close()
+        self.index_file.close()
+        os.replace(tmp_filename, self.index_filename)
+        self.index_file = open(self.index_filename, 'ab+')
+        self.n_sorted = len(self)
+        self.pending = {}
+        self._records = self._map_index()
+
+    def import_json(self, filename: str) -> None:
+        '''import a cache file written by TxFetcher.dump_cache'''
+        with open(filename, 'r') as reader:
+            disk_cache = json.loads(reader.read())
+        for tx_id, raw_hex in disk_cache.items():
+            self.put(tx_id, bytes.fromhex(raw_hex))
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._records is not None:
+            self._records.close()
+            self._records = None
+        self.data_file.close()
+        self.index_file.close()
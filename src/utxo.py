@@ -0,0 +1,370 @@
+from __future__ import annotations
+
+import dbm
+from array import array
+from collections.abc import Mapping
+from io import BytesIO
+from typing import Iterable, Iterator, Optional
+
+from src.helper import int_to_little_endian, little_endian_to_int
+from src.script import SCRIPT_INTERNER
+from src.tx import Tx, TxOut
+
+Outpoint = tuple[bytes, int]
+UndoData = list[tuple[Outpoint, TxOut]]
+
+
+def encode_outpoint(outpoint: Outpoint) -> bytes:
+    prev_tx, prev_index = outpoint
+    return prev_tx + int_to_little_endian(prev_index, 4)
+
+
+def decode_outpoint(key: bytes) -> Outpoint:
+    return key[:32], little_endian_to_int(key[32:36])
+
+
+class UtxoSet(Mapping):
+    '''
+    Unspent transaction outputs keyed by (prev_tx, prev_index).
+
+    Recently created outputs are kept in memory (hot tier). When there are
+    more than max_hot of them, the oldest ones are written to a dbm file
+    (disk tier) as <amount 8><script_pub_key>, as recent outputs are the
+    most likely to be spent soon. An outpoint lives in exactly one tier.
+    Without filename, everything stays in memory.
+
+    As a Mapping it can be handed to Tx.fee / Tx.verify as utxos.
+    '''
+    def __init__(self,
+                 filename: Optional[str] = None,
+                 max_hot: Optional[int] = None) -> None:
+        self.hot: dict[Outpoint, TxOut] = {}
+        self.max_hot = max_hot
+        self.db = dbm.open(filename, 'c') if filename is not None else None
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self) -> UtxoSet:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __getitem__(self, outpoint: Outpoint) -> TxOut:
+        tx_out = self.get(outpoint)
+        if tx_out is None:
+            raise KeyError(outpoint)
+        return tx_out
+
+    def __contains__(self, outpoint: object) -> bool:
+        if outpoint in self.hot:
+            return True
+        return self.db is not None \
+            and encode_outpoint(outpoint) in self.db  # type: ignore
+
+    def __iter__(self) -> Iterator[Outpoint]:
+        yield from self.hot
+        if self.db is not None:
+            for key in self.db.keys():
+                yield decode_outpoint(key)
+
+    def __len__(self) -> int:
+        n_disk = len(self.db) if self.db is not None else 0
+        return len(self.hot) + n_disk
+
+    def get(self, outpoint: Outpoint, default=None) -> Optional[TxOut]:
+        tx_out = self.hot.get(outpoint)
+        if tx_out is None and self.db is not None:
+            value = self.db.get(encode_outpoint(outpoint))
+            if value is not None:
+                tx_out = TxOut.parse(BytesIO(value))
+        if tx_out is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return tx_out
+
+    def add(self, outpoint: Outpoint, tx_out: TxOut) -> None:
+        self.hot[outpoint] = tx_out
+        if self.db is not None and self.max_hot is not None:
+            # dict keeps insertion order, so the first entries are the oldest
+            while len(self.hot) > self.max_hot:
+                old_outpoint = next(iter(self.hot))
+                old_tx_out = self.hot.pop(old_outpoint)
+                self.db[encode_outpoint(old_outpoint)] = old_tx_out.serialize()
+
+    def spend(self, outpoint: Outpoint) -> TxOut:
+        tx_out = self.hot.pop(outpoint, None)
+        if tx_out is not None:
+            return tx_out
+        key = encode_outpoint(outpoint)
+        if self.db is not None and key in self.db:
+            tx_out = TxOut.parse(BytesIO(self.db[key]))
+            del self.db[key]
+            return tx_out
+        raise KeyError(f'missing or spent output: {outpoint[0].hex()}:{outpoint[1]}')
+
+    def flush(self) -> None:
+        '''move the hot tier to disk'''
+        if self.db is None:
+            return
+        for outpoint, tx_out in self.hot.items():
+            self.db[encode_outpoint(outpoint)] = tx_out.serialize()
+        self.hot.clear()
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+    def apply_tx(self, tx: Tx) -> UndoData:
+        undo: UndoData = []
+        if not tx.is_coinbase():
+            try:
+                for tx_in in tx.tx_ins:
+                    outpoint = (tx_in.prev_tx, tx_in.prev_index)
+                    undo.append((outpoint, self.spend(outpoint)))
+            except KeyError:
+                for outpoint, tx_out in undo:
+                    self.add(outpoint, tx_out)
+                raise
+        tx_hash = tx.hash()
+        for i, tx_out in enumerate(tx.tx_outs):
+            # OP_RETURN outputs can never be spent. The raw byte is checked,
+            # as script_pub_keys which do not decode are valid in outputs.
+            if tx_out.script_pub_key.raw_serialize()[:1] == b'\x6a':
+                continue
+            self.add((tx_hash, i), tx_out)
+        return undo
+
+    def apply_block(self, txs: list[Tx]) -> UndoData:
+        '''
+        spend the inputs and add the outputs of txs in order.
+        Returns the spent outputs, which undo_block needs to revert it.
+        If an input is missing, the txs applied so far are reverted.
+        '''
+        undo: UndoData = []
+        n_applied = 0
+        try:
+            for tx in txs:
+                undo.extend(self.apply_tx(tx))
+                n_applied += 1
+        except KeyError:
+            self.undo_block(txs[:n_applied], undo)
+            raise
+        return undo
+
+    def undo_block(self, txs: list[Tx], undo: UndoData) -> None:
+        # outputs are removed in reverse order before restoring spent ones
+        tx_hashes = set()
+        for tx in reversed(txs):
+            tx_hash = tx.hash()
+            tx_hashes.add(tx_hash)
+            for i in range(len(tx.tx_outs)):
+                outpoint = (tx_hash, i)
+                if outpoint in self:
+                    self.spend(outpoint)
+        for outpoint, tx_out in undo:
+            # outputs created and spent within txs are not restored
+            if outpoint[0] not in tx_hashes:
+                self.add(outpoint, tx_out)
+
+
+class CompactUtxoSet(Mapping):
+    '''
+    Read-mostly set of outputs packed into a few contiguous buffers,
+    for holding a very large number of outputs in memory.
+
+    - keys    : sorted 36 byte outpoints <prev_tx 32><prev_index 4>
+    - amounts : array of unsigned 64 bit integers
+    - offsets : start of each raw script_pub_key in scripts
+    - lengths : length of each raw script_pub_key
+    - scripts : raw script_pub_keys, in the order they were loaded
+    - spent   : one flag byte per output
+
+    Lookup is a binary search over keys, and a script_pub_key is only
+    parsed into Script when a TxOut is requested.
+    '''
+    key_size = 36
+
+    def __init__(self) -> None:
+        self.keys = b''
+        self.amounts = array('Q')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.scripts = bytearray()
+        self.spent = bytearray()
+        self.n_spent = 0
+
+    @classmethod
+    def from_items(cls, items: Iterable[tuple[Outpoint, int, bytes]]) -> CompactUtxoSet:
+        '''bulk-load (outpoint, amount, raw script_pub_key) items'''
+        result = cls()
+        result.load(items)
+        return result
+
+    @classmethod
+    def from_txs(cls, txs: Iterable[Tx]) -> CompactUtxoSet:
+        '''bulk-load all outputs of txs'''
+        def items() -> Iterator[tuple[Outpoint, int, bytes]]:
+            for tx in txs:
+                tx_hash = tx.hash()
+                for i, tx_out in enumerate(tx.tx_outs):
+                    yield ((tx_hash, i), tx_out.amount,
+                           tx_out.script_pub_key.raw_serialize())
+
+        return cls.from_items(items())
+
+    def load(self, items: Iterable[tuple[Outpoint, int, bytes]]) -> None:
+        '''
+        Adds items at once. Only the new items are sorted; the existing
+        buffers are copied in runs between the places of the new items,
+        whose scripts are appended to scripts.
+        A spent (not yet compacted) outpoint may be loaded again.
+        '''
+        batch = sorted(((encode_outpoint(outpoint), amount, script)
+                        for outpoint, amount, script in items),
+                       key=lambda record: record[0])
+        n = len(self.amounts)
+        # places of the new items, checked before anything is changed
+        places = []
+        last_key = None
+        for key, _, _ in batch:
+            i = self._bisect(key)
+            if key == last_key or (i < n and self._key(i) == key
+                                   and not self.spent[i]):
+                raise ValueError(f'duplicate outpoint: {decode_outpoint(key)}')
+            last_key = key
+            places.append(i)
+
+        keys = []
+        amounts = array('Q')
+        offsets = array('Q')
+        lengths = array('I')
+        spent = bytearray()
+        scripts = self.scripts
+        copied = 0
+        for (key, amount, script), i in zip(batch, places):
+            if i > copied:
+                keys.append(self.keys[copied * self.key_size:i * self.key_size])
+                amounts += self.amounts[copied:i]
+                offsets += self.offsets[copied:i]
+                lengths += self.lengths[copied:i]
+                spent += self.spent[copied:i]
+                copied = i
+            if i < n and self._key(i) == key:
+                # takes the place of the spent output
+                copied = i + 1
+                self.n_spent -= 1
+            keys.append(key)
+            amounts.append(amount)
+            offsets.append(len(scripts))
+            lengths.append(len(script))
+            spent.append(0)
+            scripts += script
+        keys.append(self.keys[copied * self.key_size:])
+        self.keys = b''.join(keys)
+        self.amounts = amounts + self.amounts[copied:]
+        self.offsets = offsets + self.offsets[copied:]
+        self.lengths = lengths + self.lengths[copied:]
+        self.spent = spent + self.spent[copied:]
+
+    def _key(self, i: int) -> bytes:
+        return self.keys[i * self.key_size:(i + 1) * self.key_size]
+
+    def _script(self, i: int) -> bytes:
+        start = self.offsets[i]
+        return bytes(self.scripts[start:start + self.lengths[i]])
+
+    def _bisect(self, key: bytes) -> int:
+        '''position of the first key which is not below key'''
+        lo, hi = 0, len(self.amounts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, outpoint: Outpoint) -> Optional[int]:
+        key = encode_outpoint(outpoint)
+        i = self._bisect(key)
+        if i < len(self.amounts) and self._key(i) == key \
+                and not self.spent[i]:
+            return i
+        return None
+
+    def __getitem__(self, outpoint: Outpoint) -> TxOut:
+        i = self._find(outpoint)
+        if i is None:
+            raise KeyError(outpoint)
+        return self._tx_out(i)
+
+    def _tx_out(self, i: int) -> TxOut:
+        return TxOut(self.amounts[i], SCRIPT_INTERNER.intern(self._script(i)))
+
+    def __contains__(self, outpoint: object) -> bool:
+        return self._find(outpoint) is not None  # type: ignore
+
+    def __iter__(self) -> Iterator[Outpoint]:
+        for i in range(len(self.amounts)):
+            if not self.spent[i]:
+                yield decode_outpoint(self._key(i))
+
+    def __len__(self) -> int:
+        return len(self.amounts) - self.n_spent
+
+    def amount(self, outpoint: Outpoint) -> int:
+        i = self._find(outpoint)
+        if i is None:
+            raise KeyError(outpoint)
+        return self.amounts[i]
+
+    def raw_script_pubkey(self, outpoint: Outpoint) -> bytes:
+        i = self._find(outpoint)
+        if i is None:
+            raise KeyError(outpoint)
+        return self._script(i)
+
+    def spend(self, outpoint: Outpoint) -> TxOut:
+        i = self._find(outpoint)
+        if i is None:
+            raise KeyError(outpoint)
+        tx_out = self._tx_out(i)
+        self.spent[i] = 1
+        self.n_spent += 1
+        return tx_out
+
+    def compact(self) -> None:
+        '''drop spent outputs and scripts no longer referred to'''
+        if not self.n_spent and len(self.scripts) == sum(self.lengths):
+            return
+        keys = bytearray()
+        amounts = array('Q')
+        offsets = array('Q')
+        lengths = array('I')
+        scripts = bytearray()
+        for i in range(len(self.amounts)):
+            if self.spent[i]:
+                continue
+            keys += self._key(i)
+            amounts.append(self.amounts[i])
+            offsets.append(len(scripts))
+            lengths.append(self.lengths[i])
+            start = self.offsets[i]
+            scripts += self.scripts[start:start + self.lengths[i]]
+        self.keys = bytes(keys)
+        self.amounts = amounts
+        self.offsets = offsets
+        self.lengths = lengths
+        self.scripts = scripts
+        self.spent = bytearray(len(amounts))
+        self.n_spent = 0
+
+    def memory_usage(self) -> int:
+        return len(self.keys) + len(self.scripts) + len(self.spent) \
+            + self.amounts.itemsize * len(self.amounts) \
+            + self.offsets.itemsize * len(self.offsets) \
+            + self.lengths.itemsize * len(self.lengths)
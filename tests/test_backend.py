@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+import src.backend as target
+from src.txstore import TxStore
+
+TX_ID = '11' * 32
+RAW_TX = b'\x01\x00\x00\x00' + b'\xab' * 10
+
+
+def test_stub_server_http_backend():
+    with target.StubServer({TX_ID: RAW_TX}) as server:
+        backend = target.HttpBackend(mainnet_url=server.url,
+                                     testnet_url=server.url + '/testnet')
+        assert backend.get_url() == server.url
+        assert backend.fetch_raw(TX_ID) == RAW_TX
+        assert backend.fetch_raw(TX_ID, testnet=True) == RAW_TX
+        with pytest.raises(ValueError, match='HTTP 404'):
+            backend.fetch_raw('22' * 32)
+        backend.close()
+        assert server.n_requests == 3
+
+
+def test_store_backend(tmp_path):
+    with TxStore(str(tmp_path / 'tx.dat')) as store:
+        store.put(TX_ID, RAW_TX)
+        backend = target.StoreBackend(store)
+        assert backend.fetch_raw(TX_ID) == RAW_TX
+        with pytest.raises(ValueError):
+            backend.fetch_raw('22' * 32)
+
+
+def test_tx_backend_abstract():
+    with pytest.raises(TypeError):
+        target.TxBackend()
+
+
+def test_async_http_backend():
+    async def run(url: str):
+        backend = target.AsyncHttpBackend(mainnet_url=url,
+                                          testnet_url=url + '/testnet')
+        raw = await backend.fetch_raw(TX_ID)
+        raw_testnet = await backend.fetch_raw(TX_ID, testnet=True)
+        with pytest.raises(ValueError, match='HTTP 404'):
+            await backend.fetch_raw('22' * 32)
+        # one connection was kept alive for all three requests
+        assert [len(idle) for idle in backend.idle.values()] == [1]
+        raws = await asyncio.gather(*[backend.fetch_raw(TX_ID) for _ in range(4)])
+        assert raws == [RAW_TX] * 4
+        assert 1 <= sum(len(idle) for idle in backend.idle.values()) <= 4
+        await backend.close()
+        assert backend.idle == {}
+        return raw, raw_testnet
+
+    with target.StubServer({TX_ID: RAW_TX}) as server:
+        assert asyncio.run(run(server.url)) == (RAW_TX, RAW_TX)
+        assert server.n_requests == 7
+
+
+class BrokenWriter:
+    '''writer of an idle connection the server has reset'''
+    def __init__(self) -> None:
+        self.closed = False
+
+    def write(self, data: bytes) -> None:
+        pass
+
+    async def drain(self) -> None:
+        raise BrokenPipeError
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+    def close(self) -> None:
+        self.closed = True
+
+    async def wait_closed(self) -> None:
+        pass
+
+
+def test_async_http_backend_stale_connections():
+    async def run(backend: target.AsyncHttpBackend, key: tuple) -> list:
+        loop = asyncio.get_running_loop()
+        # a reset connection, and one cut off in the middle of the body
+        truncated = asyncio.StreamReader()
+        truncated.feed_data(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nab')
+        truncated.feed_eof()
+        stale = [(loop, asyncio.StreamReader(), BrokenWriter()),
+                 (loop, truncated, BrokenWriter())]
+        results = []
+        for entry in stale:
+            backend.idle.setdefault(key, []).append(entry)
+            results.append(await backend.fetch_raw(TX_ID))
+            assert entry[2].closed
+        return results
+
+    with target.StubServer({TX_ID: RAW_TX}) as server:
+        backend = target.AsyncHttpBackend(mainnet_url=server.url)
+        host, port = server.server.server_address[:2]
+        assert asyncio.run(run(backend, (host, port, False))) == [RAW_TX] * 2
+        assert server.n_requests == 2
+        # connections left idle are closed when asyncio.run ends the loop
+        assert backend.idle == {}
+        assert asyncio.run(backend.fetch_raw(TX_ID)) == RAW_TX
+        assert backend.idle == {}
+
+
+def test_async_http_backend_chunked():
+    async def run() -> tuple:
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'Transfer-Encoding: chunked\r\n\r\n'
+                         b'3\r\nabc\r\n2;ext=1\r\nde\r\n0\r\nX-Trailer: 1\r\n\r\n')
+        return await target.AsyncHttpBackend._read_response(
+            b'HTTP/1.1 404 Not Found\r\n', reader)
+
+    assert asyncio.run(run()) == (404, 'abcde', True)
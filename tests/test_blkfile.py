@@ -0,0 +1,66 @@
+import pytest
+import src.blkfile as target
+from src.block import Block
+from src.script import p2pkh_script
+from src.tx import Tx, TxIn, TxOut
+
+
+def make_block(i: int, n_txs: int) -> Block:
+    txs = [Tx(1, [TxIn(bytes([i + 1]) * 32, j)], [TxOut(1000 * j, p2pkh_script(b'\x00' * 20))], 0)
+           for j in range(n_txs)]
+    block = Block(1, bytes([i]) * 32, b'\x00' * 32, i, b'\xff\xff\x00\x1d', b'\x00' * 4, txs=txs)
+    block.merkle_root = block.compute_merkle_root()
+    return block
+
+
+def write_blk(filename: str, blocks: list, magic: bytes = target.MAINNET_MAGIC,
+              padding: int = 0) -> None:
+    with open(filename, 'wb') as writer:
+        for block in blocks:
+            raw = block.serialize_full()
+            writer.write(magic + len(raw).to_bytes(4, 'little') + raw)
+        writer.write(b'\x00' * padding)
+
+
+def block_summary(raw_block: target.RawBlock) -> tuple:
+    return raw_block.header.hash(), sum(tx_out.amount for tx in raw_block.txs() for tx_out in tx.tx_outs)
+
+
+def test_read_blocks(tmp_path):
+    blocks = [make_block(i, i + 1) for i in range(3)]
+    filename = str(tmp_path / 'blk00000.dat')
+    write_blk(filename, blocks, padding=100)
+
+    raw_blocks = list(target.read_blocks(filename))
+    assert [raw_block.header.hash() for raw_block in raw_blocks] == [block.hash() for block in blocks]
+    assert [raw_block.n_txs() for raw_block in raw_blocks] == [1, 2, 3]
+    assert raw_blocks[0].offset == 8
+    assert [tx.id() for tx in raw_blocks[2].txs()] == [tx.id() for tx in blocks[2].txs]
+    assert raw_blocks[2].block().validate_merkle_root()
+
+    # other network
+    write_blk(filename, blocks, magic=target.REGTEST_MAGIC)
+    with pytest.raises(ValueError):
+        list(target.read_blocks(filename))
+    assert len(list(target.read_blocks(filename, magic=target.REGTEST_MAGIC))) == 3
+
+    # truncated
+    with open(filename, 'r+b') as writer:
+        writer.truncate(50)
+    with pytest.raises(ValueError):
+        list(target.read_blocks(filename, magic=target.REGTEST_MAGIC))
+
+    empty = str(tmp_path / 'blk00001.dat')
+    open(empty, 'wb').close()
+    assert list(target.read_blocks(empty)) == []
+
+
+def test_map_blocks(tmp_path):
+    filenames = []
+    expected = []
+    for i in range(3):
+        blocks = [make_block(i * 10 + j, 2) for j in range(4)]
+        filenames.append(str(tmp_path / f'blk{i:05}.dat'))
+        write_blk(filenames[-1], blocks)
+        expected.append((filenames[-1], [(block.hash(), 1000) for block in blocks]))
+    assert list(target.map_blocks(filenames, block_summary, processes=2)) == expected
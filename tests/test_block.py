@@ -2,6 +2,8 @@ from io import BytesIO
 
 import pytest
 import src.block as target
+from src.script import p2pkh_script
+from src.tx import Tx, TxIn, TxOut
 
 
 def test_block1():
@@ -95,3 +97,70 @@ def test_check_pow(block_hex: str, expected: bool):
     stream = BytesIO(block_raw)
     block = target.Block.parse(stream)
     assert block.check_pow() == expected
+
+
+def test_block_parse_full():
+    txs = [
+        Tx(1, [TxIn(bytes([i + 1]) * 32, 0, witness=[b'\x01'] * i)],
+           [TxOut(1000 * (i + 1), p2pkh_script(b'\x00' * 20))], 0, segwit=i > 0)
+        for i in range(3)
+    ]
+    block = target.Block(1, b'\x00' * 32, b'\x00' * 32, 0, b'\xff\xff\x00\x1d',
+                         b'\x00' * 4, txs=txs)
+    assert not block.validate_merkle_root()
+    block.merkle_root = block.compute_merkle_root()
+    assert block.validate_merkle_root()
+
+    raw = block.serialize_full()
+    parsed = target.Block.parse_full(BytesIO(raw))
+    assert parsed.hash() == block.hash()
+    assert [tx.id() for tx in parsed.txs] == [tx.id() for tx in txs]
+    assert parsed.txs[2].tx_ins[0].witness == [b'\x01'] * 2
+    assert parsed.validate_merkle_root()
+    assert parsed.serialize_full() == raw
+
+    # the header alone has no transactions
+    header = target.Block.parse(BytesIO(raw))
+    assert header.txs is None
+    assert not header.validate_merkle_root()
+    with pytest.raises(ValueError):
+        header.serialize_full()
+
+
+def test_block_cache():
+    block_raw = bytes.fromhex(
+        '04000000fbedbbf0cfdaf278c094f187f2eb987c86a199da22bbb20400000000000000007b7697b29129648fa08b4bcd13c9d5e60abb973a1efac9c8d573c71c807c56c3d6213557faa80518c3737ec1'
+    )
+    block = target.Block.parse(BytesIO(block_raw))
+    assert block.serialize() is block.serialize()
+    h = block.hash()
+    assert block.check_pow()
+
+    # changing a header field drops the cached serialization and hash
+    block.nonce = bytes.fromhex('c3737ec0')
+    assert block.serialize() == block_raw[:-1] + b'\xc0'
+    assert block.hash() != h
+    assert not block.check_pow()
+
+    t = block.target()
+    block.bits = bytes.fromhex('ffff001d')
+    assert block.target() != t
+    assert block.target() == target.MAX_TARGET
+
+    with pytest.raises(AttributeError):
+        block.foo = 1
+    with pytest.raises(SyntaxError):
+        target.Block.parse(BytesIO(block_raw[:79]))
+
+
+def test_block_validate_merkle_root_mutated():
+    # [a, b, c] and [a, b, c, c] have the same root (CVE-2012-2459)
+    txs = [Tx(1, [TxIn(bytes([i + 1]) * 32, 0)], [TxOut(1000, p2pkh_script(b'\x00' * 20))], 0)
+           for i in range(3)]
+    block = target.Block(1, b'\x00' * 32, b'\x00' * 32, 0, b'\xff\xff\x00\x1d',
+                         b'\x00' * 4, txs=txs)
+    block.merkle_root = block.compute_merkle_root()
+    assert block.validate_merkle_root()
+    block.txs = txs + txs[2:]
+    assert block.compute_merkle_root() == block.merkle_root
+    assert not block.validate_merkle_root()
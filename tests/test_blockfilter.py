@@ -0,0 +1,84 @@
+import random
+from io import BytesIO
+
+import pytest
+import src.blockfilter as target
+from src.block import Block
+from src.script import Script, p2pkh_script
+from src.tx import Tx, TxIn, TxOut
+
+KEY0 = int.from_bytes(bytes(range(8)), 'little')
+KEY1 = int.from_bytes(bytes(range(8, 16)), 'little')
+
+GENESIS_COINBASE = bytes.fromhex(
+    '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000'
+)
+
+
+def make_testnet_genesis() -> Block:
+    tx = Tx.parse(BytesIO(GENESIS_COINBASE))
+    return Block(1, b'\x00' * 32, tx.hash(), 1296688602, bytes.fromhex('ffff001d'),
+                 (414098458).to_bytes(4, 'little'), txs=[tx])
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'', 0x726fdb47dd0e0e31),
+    (bytes(range(8)), 0x93f5f5799a932462),
+    (bytes(range(15)), 0xa129ca6149be45e5),
+])
+def test_siphash(data: bytes, expected: int):
+    assert target.siphash(KEY0, KEY1, data) == expected
+
+
+def test_golomb_coding():
+    rng = random.Random(1)
+    values = sorted({rng.randrange(1 << 30) for _ in range(1000)})
+    data = target.golomb_encode(values, 19)
+    assert list(target.golomb_decode(data, len(values), 19)) == values
+    assert target.golomb_encode([], 19) == b''
+
+
+def test_basic_filter_genesis():
+    # BIP158 test vector of testnet block 0
+    block = make_testnet_genesis()
+    assert block.hash().hex() == '000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943'
+    gcs = target.basic_filter(block, {})
+    assert gcs.serialize().hex() == '019dfca8'
+    script = block.txs[0].tx_outs[0].script_pub_key.raw_serialize()
+    assert gcs.match(script)
+    assert not gcs.match(b'\x51')
+    assert target.match_filters([(block.hash(), gcs.serialize())], [b'\x51', script]) == [block.hash()]
+    assert target.match_filters([(block.hash(), gcs.serialize())], [b'\x51']) == []
+
+
+def test_basic_filter_elements():
+    spent = TxOut(5000, p2pkh_script(b'\x01' * 20))
+    coinbase = Tx(1, [TxIn(b'\x00' * 32, 0xffffffff)],
+                  [TxOut(5000, p2pkh_script(b'\x02' * 20)), TxOut(0, Script([0x6a, b'\xff']))], 0)
+    tx = Tx(1, [TxIn(b'\x03' * 32, 1)], [TxOut(4000, p2pkh_script(b'\x02' * 20))], 0)
+    block = Block(1, b'\x00' * 32, b'\x00' * 32, 0, b'\xff\xff\x00\x1d', b'\x00' * 4,
+                  txs=[coinbase, tx])
+    elements = target.basic_filter_elements(block, {(b'\x03' * 32, 1): spent})
+    # OP_RETURN output left out, duplicates merged
+    assert elements == {p2pkh_script(b'\x01' * 20).raw_serialize(),
+                        p2pkh_script(b'\x02' * 20).raw_serialize()}
+    with pytest.raises(KeyError):
+        target.basic_filter_elements(block, {})
+
+    gcs = target.basic_filter(block, {(b'\x03' * 32, 1): spent})
+    parsed = target.GCSFilter.parse(gcs.serialize(), gcs.key)
+    assert parsed.n == 2
+    assert all(parsed.match(element) for element in elements)
+
+
+def test_gcs_filter_match_any():
+    rng = random.Random(2)
+    key = bytes(16)
+    items = [rng.randbytes(25) for _ in range(500)]
+    gcs = target.GCSFilter.build(items, key)
+    assert gcs.n == 500
+    others = [rng.randbytes(25) for _ in range(100)]
+    # false positive rate is about 1 / M
+    assert not gcs.match_any(others)
+    assert gcs.match_any(others + items[250:251])
+    assert not target.GCSFilter.build([], key).match_any(items)
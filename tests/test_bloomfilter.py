@@ -0,0 +1,80 @@
+import pytest
+import src.bloomfilter as target
+from src.block import Block
+from src.script import Script, p2pkh_script
+from src.tx import Tx, TxIn, TxOut
+
+
+def test_bloom_filter():
+    bf = target.BloomFilter(10, 5, 99)
+    bf.add(b'Hello World')
+    assert bf.filter_bytes().hex() == '0000000a080000000140'
+    bf.add(b'Goodbye!')
+    assert bf.filter_bytes().hex() == '4000600a080000010940'
+    assert bf.filterload().hex() == '0a4000600a080000010940050000006300000001'
+    assert b'Hello World' in bf
+    assert b'Goodbye!' in bf
+
+    many = target.BloomFilter(10, 5, 99)
+    many.add_many([b'Hello World', b'Goodbye!'])
+    assert many.filter_bytes() == bf.filter_bytes()
+
+
+@pytest.mark.parametrize('n, rate, expected', [
+    (1, 0.0001, (2, 11)),
+    (1000, 0.01, (1198, 6)),
+    (10 ** 6, 0.0001, (target.MAX_FILTER_SIZE, 1)),
+])
+def test_bloom_filter_for_elements(n: int, rate: float, expected: tuple):
+    bf = target.BloomFilter.for_elements(n, rate, 0)
+    assert (bf.size, bf.function_count) == expected
+
+
+def test_bloom_filter_matches_tx():
+    h160 = b'\x12' * 20
+    paying = Tx(1, [TxIn(b'\x01' * 32, 0, Script([b'\x30' * 70, b'\x02' * 33]))],
+                [TxOut(1000, p2pkh_script(b'\x00' * 20)), TxOut(2000, p2pkh_script(h160))], 0)
+    spending = Tx(1, [TxIn(paying.hash(), 1)], [TxOut(1500, p2pkh_script(b'\x00' * 20))], 0)
+    other = Tx(1, [TxIn(b'\x02' * 32, 0)], [TxOut(1000, p2pkh_script(b'\x00' * 20))], 0)
+
+    bf = target.BloomFilter(100, 5, 1234)
+    bf.add(h160)
+    assert bf.filter_txs([paying, other, spending]) == [paying, spending]
+
+    # without updates the outpoint of the matched output is not added
+    bf = target.BloomFilter(100, 5, 1234, flags=target.BLOOM_UPDATE_NONE)
+    bf.add(h160)
+    assert bf.filter_txs([paying, other, spending]) == [paying]
+
+    # tx hash and data pushed in ScriptSig
+    bf = target.BloomFilter(100, 5, 1234)
+    bf.add(other.hash()[::-1])
+    bf.add(b'\x02' * 33)
+    assert bf.filter_txs([paying, other, spending]) == [paying, other]
+
+
+def test_bloom_filter_malformed_scripts():
+    # a push of 3 bytes with 2 left, and an OP_PUSHDATA1 without length
+    coinbase = Tx(1, [TxIn(b'\x00' * 32, 0xffffffff, Script(raw=b'\x03\x01\x02'))],
+                  [TxOut(5000, Script(raw=b'\x4c'))], 0)
+    h160 = b'\x12' * 20
+    paying = Tx(1, [TxIn(b'\x01' * 32, 0, Script(raw=b'\x02\xab\xcd\x4d\x01'))],
+                [TxOut(2000, p2pkh_script(h160))], 0)
+    assert list(target.pushed_data(coinbase.tx_ins[0].script_sig)) == []
+    assert list(target.pushed_data(paying.tx_ins[0].script_sig)) == [b'\xab\xcd']
+
+    bf = target.BloomFilter(100, 5, 1234)
+    bf.add(h160)
+    assert not bf.matches_tx(coinbase)
+    assert bf.matches_tx(paying)
+    # data before the malformed push still matches
+    bf = target.BloomFilter(100, 5, 1234)
+    bf.add(b'\xab\xcd')
+    assert bf.filter_txs([coinbase, paying]) == [paying]
+
+    block = Block(1, b'\x00' * 32, b'\x00' * 32, 0, b'\xff\xff\x00\x1d', b'\x00' * 4,
+                  txs=[coinbase, paying])
+    block.merkle_root = block.compute_merkle_root()
+    mb = bf.merkle_block(block)
+    assert mb.is_valid()
+    assert mb.matched_hashes() == [paying.hash()]
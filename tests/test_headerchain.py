@@ -0,0 +1,138 @@
+import hashlib
+
+import pytest
+import src.headerchain as target
+from src.helper import bits_to_target, calculate_new_bits, hash256
+
+GENESIS = bytes.fromhex(
+    '0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c'
+)
+BLOCK1 = bytes.fromhex(
+    '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051fd1e4ba744bbbe680e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e36299'
+)
+EASY_BITS = bytes.fromhex('ffff7f20')
+
+
+class SmallChain(target.HeaderChain):
+    retarget_interval = 4
+    max_target = bits_to_target(EASY_BITS)
+
+
+def make_header(prev: bytes, timestamp: int, bits: bytes, valid: bool = True) -> bytes:
+    # search a nonce whose hash is below (or not below) the target
+    t = bits_to_target(bits)
+    for nonce in range(1 << 16):
+        header = (b'\x01\x00\x00\x00' + prev + hashlib.sha256(prev).digest()
+                  + timestamp.to_bytes(4, 'little') + bits + nonce.to_bytes(4, 'little'))
+        if (int.from_bytes(hash256(header), 'little') < t) == valid:
+            return header
+    raise AssertionError('no nonce found')
+
+
+def make_chain(n: int, start: bytes = b'\x00' * 32) -> list:
+    headers = []
+    prev, bits, period_start = start, EASY_BITS, 0
+    for height in range(n):
+        timestamp = 600 * height
+        if height > 0 and height % SmallChain.retarget_interval == 0:
+            bits = calculate_new_bits(bits, 600 * (height - 1) - period_start,
+                                      SmallChain.max_target)
+            period_start = timestamp
+        headers.append(make_header(prev, timestamp, bits))
+        prev = hash256(headers[-1])
+    return headers
+
+
+def test_header_chain_mainnet():
+    chain = target.HeaderChain(GENESIS)
+    assert chain.add_headers(BLOCK1) == 1
+    assert chain.height == 1
+    assert chain.tip_hash() == bytes.fromhex(
+        '00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048')
+
+
+def test_header_chain():
+    headers = make_chain(11)
+    # bits are lowered at 4 and 8
+    assert headers[4][72:76] != headers[3][72:76]
+    assert headers[8][72:76] != headers[7][72:76]
+
+    chain = SmallChain(headers[0])
+    assert chain.add_headers(b''.join(headers[1:6])) == 5
+    assert chain.add_headers(b''.join(headers[6:])) == 5
+    assert chain.height == 10
+    assert chain.tip_hash() == hash256(headers[-1])[::-1]
+
+
+def test_header_chain_checkpoint():
+    # the period start of the checkpoint is unknown, retarget at 4 is not checked
+    headers = make_chain(6)
+    chain = SmallChain(headers[2], height=2)
+    assert chain.add_headers(b''.join(headers[3:])) == 3
+    assert chain.height == 5
+
+
+def test_header_chain_fail():
+    headers = make_chain(7)
+    prev = hash256(headers[5])
+
+    broken = headers[:6] + [make_header(b'\x11' * 32, 3600, headers[5][72:76])]
+    with pytest.raises(ValueError, match='header 6: does not link'):
+        SmallChain(headers[0]).add_headers(b''.join(broken[1:]))
+
+    broken = headers[:6] + [make_header(prev, 3600, EASY_BITS)]
+    with pytest.raises(ValueError, match='header 6: bits changed'):
+        SmallChain(headers[0]).add_headers(b''.join(broken[1:]))
+
+    broken = headers[:6] + [make_header(prev, 3600, headers[5][72:76], valid=False)]
+    chain = SmallChain(headers[0])
+    with pytest.raises(ValueError, match='header 6: insufficient proof of work'):
+        chain.add_headers(b''.join(broken[1:]))
+    # the valid headers stay
+    assert chain.height == 5
+    assert chain.tip_hash() == prev[::-1]
+    assert chain.add_headers(headers[6]) == 1
+
+    # bits kept at the retarget
+    broken = headers[:4] + [make_header(hash256(headers[3]), 2400, EASY_BITS)]
+    with pytest.raises(ValueError, match='header 4: bad retarget'):
+        SmallChain(headers[0]).add_headers(b''.join(broken[1:]))
+
+    with pytest.raises(ValueError):
+        SmallChain(headers[0]).add_headers(headers[1][:79])
+
+
+def test_chainwork_mainnet():
+    assert target.bits_to_work(GENESIS[72:76]) == 0x100010001
+    headers = GENESIS + BLOCK1
+    assert target.chainwork(headers) == 0x200020002
+    assert target.cumulative_chainwork(headers) == [0x100010001, 0x200020002]
+    assert target.cumulative_chainwork(BLOCK1, 0x100010001) == [0x200020002]
+    assert target.header_targets(headers) == [bits_to_target(GENESIS[72:76])] * 2
+    assert target.chainwork(b'') == 0
+
+    chain = target.HeaderChain(GENESIS)
+    assert chain.chainwork == 0x100010001
+    chain.add_headers(BLOCK1)
+    assert chain.chainwork == 0x200020002
+
+
+def test_chainwork_retarget():
+    headers = make_chain(11)
+    buffer = b''.join(headers)
+    targets = [bits_to_target(header[72:76]) for header in headers]
+    assert target.header_targets(buffer) == targets
+    works = [(1 << 256) // (t + 1) for t in targets]
+    assert target.cumulative_chainwork(buffer) == [sum(works[:i + 1]) for i in range(11)]
+    assert target.chainwork(buffer) == sum(works)
+
+    chain = SmallChain(headers[0])
+    chain.add_headers(b''.join(headers[1:]))
+    assert chain.chainwork == sum(works)
+    # a chain with fewer headers has less work
+    assert target.chainwork(b''.join(headers[:10])) < chain.chainwork
+
+    assert target.retarget_schedule(buffer, 0, 4) == [
+        (0, EASY_BITS), (4, headers[4][72:76]), (8, headers[8][72:76])]
+    assert target.retarget_schedule(b''.join(headers[2:9]), 2, 4) == [
+        (2, EASY_BITS), (4, headers[4][72:76]), (8, headers[8][72:76])]
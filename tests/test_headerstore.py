@@ -0,0 +1,104 @@
+import pytest
+import src.headerstore as target
+from src.helper import hash256
+
+GENESIS = bytes.fromhex(
+    '0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c'
+)
+BLOCK1 = bytes.fromhex(
+    '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051fd1e4ba744bbbe680e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e36299'
+)
+GENESIS_HASH = bytes.fromhex('000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f')
+BLOCK1_HASH = bytes.fromhex('00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048')
+
+
+def test_header_store(tmp_path):
+    filename = str(tmp_path / 'headers.dat')
+    with target.HeaderStore(filename) as store:
+        assert len(store) == 0
+        assert store.tip() is None
+        assert store.height_of(GENESIS_HASH) is None
+        store.append(GENESIS)
+        assert store.height_of(GENESIS_HASH) == 0
+        store.extend(BLOCK1)
+        assert len(store) == 2
+        assert store.raw(1) == BLOCK1
+        assert store.headers(0, 5) == GENESIS + BLOCK1
+        assert store.hash(1) == BLOCK1_HASH
+        assert store[1].hash() == BLOCK1_HASH
+        assert store[1].prev_block == GENESIS_HASH
+        assert store.tip().hash() == BLOCK1_HASH
+        assert store.height_of(BLOCK1_HASH) == 1
+        assert BLOCK1_HASH in store
+        with pytest.raises(IndexError):
+            store.raw(2)
+        with pytest.raises(ValueError):
+            store.extend(BLOCK1[:79])
+
+    # reopen
+    with target.HeaderStore(filename) as store:
+        assert len(store) == 2
+        assert [block.hash() for block in store] == [GENESIS_HASH, BLOCK1_HASH]
+        assert store.height_of(BLOCK1_HASH) == 1
+
+        store.truncate(1)
+        assert len(store) == 1
+        assert store.height_of(BLOCK1_HASH) is None
+        assert store.tip().hash() == GENESIS_HASH
+        store.append(BLOCK1)
+        assert store.height_of(BLOCK1_HASH) == 1
+
+
+def test_header_store_recover(tmp_path):
+    filename = str(tmp_path / 'headers.dat')
+    with target.HeaderStore(filename) as store:
+        store.append(GENESIS)
+    # interrupted write: a header without its hash and a partial header
+    with open(filename, 'ab') as writer:
+        writer.write(BLOCK1 + BLOCK1[:40])
+
+    with target.HeaderStore(filename) as store:
+        assert len(store) == 2
+        assert store.hash(1) == BLOCK1_HASH
+        assert store.height_of(BLOCK1_HASH) == 1
+        store.append(GENESIS)
+        assert store.raw(2) == GENESIS
+
+
+def test_header_store_index(tmp_path):
+    # the store does not validate, any 80 bytes will do
+    headers = [i.to_bytes(80, 'little') for i in range(20)]
+    others = [(i + 100).to_bytes(80, 'little') for i in range(20)]
+    hashes = [hash256(header)[::-1] for header in headers]
+    filename = str(tmp_path / 'headers.dat')
+    with target.HeaderStore(filename) as store:
+        store.merge_threshold = 8
+        for header in headers:
+            store.append(header)
+        # heights below n_indexed are only in the sorted records on disk
+        assert store.n_indexed == 16
+        assert store._pending is None
+        assert [store.height_of(h) for h in hashes] == list(range(20))
+        assert len(store._pending) == 4
+        assert store.height_of(b'\x00' * 32) is None
+
+        # indexed records above the new tip are ignored
+        store.truncate(10)
+        assert store.n_indexed == 10
+        assert [store.height_of(h) for h in hashes[8:12]] == [8, 9, None, None]
+        for header in others[10:15]:
+            store.append(header)
+        assert store.height_of(hashes[11]) is None
+        assert store.height_of(hash256(others[11])[::-1]) == 11
+
+    with target.HeaderStore(filename) as store:
+        assert store.n_indexed == 10
+        assert store._pending is None
+        assert store.height_of(hashes[3]) == 3
+        assert len(store._pending) == 5
+        store.compact()
+        assert store.n_indexed == 15
+        assert store._pending is None
+        assert store.height_of(hash256(others[14])[::-1]) == 14
+        assert store.height_of(hashes[14]) is None
+        assert [store.height_of(h) for h in hashes[:10]] == list(range(10))
@@ -134,6 +134,10 @@ def test_h160_to_p2sh_address(h160: bytes, testnet: bool, expected: str):
 ])
 def test_bits_to_target(bits: bytes, expected: int):
     assert target.bits_to_target(bits) == expected
+    # mutable buffers are accepted as well
+    assert target.bits_to_target(bytearray(bits)) == expected
+    assert target.bits_to_target(memoryview(bytearray(bits))) == expected
+    assert target.bits_to_work(bytearray(bits)) == (1 << 256) // (expected + 1)
 
 
 @pytest.mark.parametrize(
@@ -165,3 +169,50 @@ def test_target_bits_target():
 def test_calculate_new_bits(previous_bits: bytes, time_diff: int,
                             expected: bytes):
     assert target.calculate_new_bits(previous_bits, time_diff) == expected
+
+
+def merkle_root_naive(hashes: list) -> bytes:
+    if len(hashes) == 1:
+        return hashes[0]
+    if len(hashes) % 2 == 1:
+        hashes = hashes + hashes[-1:]
+    return merkle_root_naive([target.hash256(hashes[i] + hashes[i + 1])
+                              for i in range(0, len(hashes), 2)])
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 5, 8, 27])
+def test_merkle_root(n: int):
+    hashes = [target.hash256(bytes([i])) for i in range(n)]
+    assert target.merkle_root(hashes) == merkle_root_naive(hashes)
+
+
+def test_merkle_root_fail():
+    with pytest.raises(ValueError):
+        target.merkle_root([])
+
+
+@pytest.mark.parametrize('data, seed, expected', [
+    (b'', 0, 0),
+    (b'', 1, 0x514e28b7),
+    (b'', 0xffffffff, 0x81f16f39),
+    (b'\x00\x00\x00\x00', 0, 0x2362f9de),
+    (b'Hello, world!', 0x9747b28c, 0x24884cba),
+    (b'The quick brown fox jumps over the lazy dog', 0x9747b28c, 0x2fa826cd),
+])
+def test_murmur3(data: bytes, seed: int, expected: int):
+    assert target.murmur3(data, seed) == expected
+
+
+@pytest.mark.parametrize('n, duplicated, expected', [
+    (3, [], False),
+    (3, [2], True),
+    (5, [], False),
+    # duplicated pair on the second level
+    (6, [4, 5], True),
+])
+def test_merkle_root_mutated(n: int, duplicated: list, expected: bool):
+    hashes = [target.hash256(bytes([i])) for i in range(n)]
+    hashes += [hashes[i] for i in duplicated]
+    root, mutated = target.merkle_root_mutated(hashes)
+    assert root == merkle_root_naive(hashes)
+    assert mutated == expected
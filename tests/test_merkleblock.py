@@ -0,0 +1,75 @@
+from io import BytesIO
+
+import pytest
+import src.merkleblock as target
+from src.block import Block
+from src.helper import hash256, merkle_root
+
+
+def make_tree(n: int):
+    hashes = [hash256(i.to_bytes(4, 'little')) for i in range(n)]
+    tree = target.MerkleTree(hashes)
+    header = Block(1, b'\x00' * 32, tree.root()[::-1], 0, b'\xff\xff\x00\x1d', b'\x00' * 4)
+    return hashes, tree, header
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 7, 16, 27])
+def test_merkle_tree_branch(n: int):
+    hashes, tree, _ = make_tree(n)
+    assert tree.root() == merkle_root(hashes)
+    for index, leaf in enumerate(hashes):
+        branch = tree.branch(index)
+        assert target.verify_merkle_branch(leaf, index, branch, tree.root())
+        assert not target.verify_merkle_branch(leaf, index + (1 << len(branch)),
+                                               branch, tree.root())
+        assert not target.verify_merkle_branch(b'\x00' * 32, index, branch, tree.root())
+    with pytest.raises(IndexError):
+        tree.branch(n)
+
+
+@pytest.mark.parametrize('n, matched', [
+    (1, [0]),
+    (7, []),
+    (7, [6]),
+    (16, [0, 5, 15]),
+    (27, [3, 4, 26]),
+])
+def test_merkleblock(n: int, matched: list):
+    hashes, tree, header = make_tree(n)
+    mb = target.MerkleBlock.from_tree(header, tree, matched)
+    assert mb.is_valid()
+    assert mb.matched_hashes() == [hashes[i][::-1] for i in matched]
+
+    parsed = target.MerkleBlock.parse(BytesIO(mb.serialize()))
+    assert parsed.serialize() == mb.serialize()
+    assert parsed.matched_indices() == {i: hashes[i] for i in matched}
+
+
+def test_merkleblock_invalid():
+    _, tree, header = make_tree(16)
+    mb = target.MerkleBlock.from_tree(header, tree, [5])
+
+    wrong_hash = target.MerkleBlock(header, mb.total, [b'\x00' * 32] + mb.hashes[1:], mb.flags)
+    assert not wrong_hash.is_valid()
+    with pytest.raises(ValueError):
+        wrong_hash.matched_hashes()
+
+    extra_hash = target.MerkleBlock(header, mb.total, mb.hashes + [b'\x00' * 32], mb.flags)
+    assert not extra_hash.is_valid()
+
+    extra_flags = target.MerkleBlock(header, mb.total, mb.hashes, mb.flags + b'\x00')
+    assert not extra_flags.is_valid()
+
+    short_flags = target.MerkleBlock(header, mb.total, mb.hashes, mb.flags[:1])
+    assert not short_flags.is_valid()
+
+    wrong_total = target.MerkleBlock(header, 17, mb.hashes, mb.flags)
+    assert not wrong_total.is_valid()
+
+
+def test_merkleblock_duplicate():
+    # [a, b, c] and [a, b, c, c] have the same root, the latter is rejected
+    hashes, tree, header = make_tree(3)
+    mb = target.MerkleBlock.from_tree(header, target.MerkleTree(hashes + hashes[2:]), [3])
+    mb.total = 4
+    assert not mb.is_valid()
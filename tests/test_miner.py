@@ -0,0 +1,102 @@
+import pytest
+import src.miner as target
+from src.block import Block
+from src.script import Script
+from src.tx import Tx, TxIn, TxOut
+
+EASY_BITS = bytes.fromhex('ffff7f20')
+# target of 1 can not be met
+IMPOSSIBLE_BITS = bytes.fromhex('01000003')
+
+
+def make_block(bits: bytes) -> Block:
+    return Block(0x20000000, b'\x11' * 32, b'\x22' * 32, 1600000000, bits, b'\x00' * 4)
+
+
+def test_search_nonces():
+    block = make_block(EASY_BITS)
+    nonce, n_hashes = target.search_nonces(block.serialize(), block.target(), 0, 100)
+    assert n_hashes == nonce + 1
+    block.nonce = nonce.to_bytes(4, 'little')
+    assert block.check_pow()
+    # all nonces before it fail
+    for i in range(nonce):
+        block.nonce = i.to_bytes(4, 'little')
+        assert not block.check_pow()
+
+    assert target.search_nonces(block.serialize(), 0, 10, 20) == (None, 10)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_miner_mine(processes: int):
+    # a nonce with 8 leading zero bits
+    block = make_block(bytes.fromhex('ffff7f1f'))
+    with target.Miner(processes, chunk_size=64) as miner:
+        assert miner.mine(block)
+        assert block.check_pow()
+        stats = miner.stats()
+        assert stats['hashes'] >= target.search_nonces(
+            block.serialize(), block.target(), 0, 1 << 16)[1]
+        assert stats['hashes_per_second'] > 0
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_miner_roll(processes: int):
+    block = make_block(IMPOSSIBLE_BITS)
+    with target.Miner(processes, chunk_size=3) as miner:
+        miner.nonce_space = 8
+        assert not miner.mine(block, max_rolls=2)
+        assert miner.hashes == 24
+        assert block.timestamp == 1600000000
+        assert block.nonce == b'\x00' * 4
+
+        assert miner.benchmark(block.serialize(), 100) > 0
+        assert miner.hashes == 124
+
+
+def make_full_block(bits: bytes) -> Block:
+    coinbase = Tx(1, [TxIn(b'\x00' * 32, 0xffffffff, Script([b'\x01\x00\x00']))],
+                  [TxOut(5000, Script([0x51]))], 0)
+    txs = [coinbase] + [Tx(1, [TxIn(bytes([i]) * 32, 0)], [TxOut(i, Script([0x51]))], 0)
+                        for i in range(1, 5)]
+    block = make_block(bits)
+    block.txs = txs
+    block.merkle_root = block.compute_merkle_root()
+    return block
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_miner_extra_nonce(processes: int):
+    block = make_full_block(IMPOSSIBLE_BITS)
+    coinbase = block.txs[0]
+    merkle_root = block.merkle_root
+    with target.Miner(processes, chunk_size=3) as miner:
+        miner.nonce_space = 4
+        assert not miner.mine(block, max_rolls=1, max_extra_nonces=2)
+        assert miner.hashes == 4 * 2 * 3
+    assert block.merkle_root == merkle_root
+    assert block.txs[0] is coinbase
+    assert block.timestamp == 1600000000
+
+    # about half of the hashes meet this target: find a header whose
+    # only nonce fails, so that the coinbase has to change
+    block = make_full_block(EASY_BITS)
+    while block.check_pow():
+        block.timestamp += 1
+    with target.Miner(processes) as miner:
+        miner.nonce_space = 1
+        assert miner.mine(block, max_extra_nonces=20)
+    assert block.check_pow()
+    assert block.validate_merkle_root()
+    assert block.txs[0].tx_ins[0].script_sig.cmds[0] == b'\x01\x00\x00'
+    assert len(block.txs[0].tx_ins[0].script_sig.cmds) == 2
+
+    with pytest.raises(ValueError):
+        target.Miner(1).mine(make_block(IMPOSSIBLE_BITS), max_extra_nonces=1)
+
+
+def test_compare_processes():
+    header = make_block(EASY_BITS).serialize()
+    result = target.compare_processes(header, 2000, [1, 2], chunk_size=500)
+    assert list(result) == [1, 2]
+    assert all(rate > 0 for rate in result.values())
@@ -12,6 +12,11 @@ from src.secp256k1 import PrivateKey
     (-255, b'\xff\x80'),
     (256, b'\x00\x01'),
     (-256, b'\x00\x81'),
+    (127, b'\x7f'),
+    (-128, b'\x80\x80'),
+    # outside the small number cache
+    (0x7fffffff, b'\xff\xff\xff\x7f'),
+    (-0x80000000, b'\x00\x00\x00\x80\x80'),
 ])
 def test_encode_num(n: int, expected: bytes):
     assert target.encode_num(n) == expected
@@ -25,11 +30,21 @@ def test_encode_num(n: int, expected: bytes):
     (b'\xff\x80', -255),
     (b'\x00\x01', 256),
     (b'\x00\x81', -256),
+    (b'\xff\xff\xff\x7f', 0x7fffffff),
+    (b'\x00\x00\x00\x80\x80', -0x80000000),
+    # not minimally encoded
+    (b'\x80', 0),
+    (b'\x01\x00\x80', -1),
 ])
 def test_decode_num(b: bytes, expected: int):
     assert target.decode_num(b) == expected
 
 
+def test_num_round_trip():
+    for n in range(-70000, 70000, 7):
+        assert target.decode_num(target.encode_num(n)) == n
+
+
 def test_operations1():
     stack = [6, 5, 4, 3, 2, 1]
 
@@ -428,3 +443,68 @@ def test_op_checkmultisig_3():
     # fail!!
     stack = [b'', sig3, sig1, b'\x02', sec1, sec2, sec3, b'\x03']
     assert not target.op_checkmultisig(stack, z)
+
+    # signature of another message
+    stack = [b'', sig1, b'\x01', sec1, sec2, sec3, b'\x03']
+    assert not target.op_checkmultisig(stack, z + 1)
+
+
+def test_op_checkmultisig_lazy():
+    # 1-of-3 whose first key matches, the invalid keys are never parsed
+    z = 456
+    pk1 = PrivateKey(secret=123)
+    sig1 = pk1.sign(z).der() + int_to_little_endian(1, 1)
+    sec1 = pk1.public_point.sec()
+    stack = [b'', sig1, b'\x01', b'\x02' + b'\xff' * 32, b'\x05', sec1, b'\x03']
+    assert target.op_checkmultisig(stack, z)
+    assert target.decode_num(stack[0]) == 1
+
+    # m > n
+    stack = [b'', sig1, sig1, b'\x02', sec1, b'\x01']
+    assert not target.op_checkmultisig(stack, z)
+
+
+def test_op_checkmultisig_batch_verify():
+    z = 456
+    pks = [PrivateKey(secret=secret) for secret in (123, 789, 555)]
+    sigs = [pk.sign(z).der() + int_to_little_endian(1, 1) for pk in pks]
+    secs = [pk.public_point.sec() for pk in pks]
+    batches = []
+
+    def batch_verify(z: int, pairs: list) -> list:
+        batches.append(len(pairs))
+        return target.verify_pairs(z, pairs)
+
+    stack = [b'', sigs[0], sigs[2], b'\x02', *secs, b'\x03']
+    assert target.op_checkmultisig(stack, z, batch_verify)
+    assert target.decode_num(stack[0]) == 1
+    # each signature has 2 candidate keys
+    assert batches == [4]
+
+    stack = [b'', sigs[2], sigs[0], b'\x02', *secs, b'\x03']
+    assert not target.op_checkmultisig(stack, z, batch_verify)
+
+    # a key which does not parse matches nothing, instead of failing the op
+    batches.clear()
+    for batch in (None, batch_verify):
+        stack = [b'', sigs[0], b'\x01', b'\x02' + b'\xff' * 32, b'\x05', secs[0], b'\x03']
+        assert target.op_checkmultisig(stack, z, batch)
+        assert target.decode_num(stack[0]) == 1
+    # only the parsed key was a candidate
+    assert batches == [1]
+
+
+@pytest.mark.parametrize('op_code, expected', [
+    (0, (target.op_0, target.CALL_STACK)),
+    (99, (target.op_if, target.CALL_BRANCH)),
+    (103, (target.op_nop, target.CALL_BRANCH)),
+    (107, (target.op_toaltstack, target.CALL_ALTSTACK)),
+    (172, (target.op_checksig, target.CALL_Z)),
+    (177, (target.op_checklocktimeverify, target.CALL_LOCKTIME)),
+    (178, (target.op_checksequenceverify, target.CALL_SEQUENCE)),
+    (80, None),
+    (255, None),
+])
+def test_op_code_table(op_code: int, expected):
+    assert len(target.OP_CODE_TABLE) == 256
+    assert target.OP_CODE_TABLE[op_code] == expected
@@ -2,7 +2,9 @@ from io import BytesIO
 
 import pytest
 import src.script as target
-from src.op import encode_num
+from src.helper import hash160
+from src.op import encode_num, verify_pairs
+from src.secp256k1 import PrivateKey
 
 
 @pytest.mark.parametrize('b, expected', [
@@ -151,3 +153,260 @@ def test_is_p2pkh_script_pubkey(cmds: list, expected: bool):
 ])
 def test_is_p2sh_script_pubkey(cmds: list, expected: bool):
     assert target.is_p2sh_script_pubkey(cmds) == expected
+
+
+@pytest.mark.parametrize('cmds, expected', [
+    # OP_1 OP_IF OP_2 OP_ELSE OP_3 OP_ENDIF OP_2 OP_EQUAL
+    ([81, 99, 82, 103, 83, 104, 82, 135], True),
+    # OP_0 OP_IF OP_2 OP_ELSE OP_3 OP_ENDIF OP_3 OP_EQUAL
+    ([0, 99, 82, 103, 83, 104, 83, 135], True),
+    # OP_0 OP_NOTIF OP_2 OP_ELSE OP_3 OP_ENDIF OP_2 OP_EQUAL
+    ([0, 100, 82, 103, 83, 104, 82, 135], True),
+    # OP_0 OP_IF OP_RETURN OP_ENDIF OP_1
+    ([0, 99, 106, 104, 81], True),
+    # nested: OP_1 OP_0 OP_IF OP_IF OP_RETURN OP_ENDIF OP_ELSE OP_IF OP_4 OP_ENDIF OP_ENDIF OP_4 OP_EQUAL
+    ([81, 0, 99, 99, 106, 104, 103, 99, 84, 104, 104, 84, 135], True),
+    # OP_0 OP_IF OP_2 OP_ELSE OP_RETURN OP_ELSE OP_3 OP_ENDIF
+    ([0, 99, 82, 103, 106, 103, 83, 104], False),
+    # OP_1 OP_1 OP_IF OP_2 OP_ELSE OP_RETURN OP_ELSE OP_3 OP_ENDIF OP_ADD OP_5 OP_EQUAL
+    ([81, 81, 99, 82, 103, 106, 103, 83, 104, 147, 85, 135], True),
+    # unbalanced
+    ([81, 99, 82], False),
+    ([81, 104], False),
+    ([81, 103, 81], False),
+    # OP_IF with an empty stack
+    ([99, 104], False),
+    # unknown opcode
+    ([81, 0xba], False),
+])
+def test_script_evaluate_conditionals(cmds: list, expected: bool):
+    assert target.Script(cmds).evaluate(0) == expected
+
+
+@pytest.mark.parametrize('cmds, expected', [
+    ([81, 99, 82, 103, 83, 104], {1: 3, 3: 5}),
+    ([99, 99, 104, 103, 104], {0: 3, 1: 2, 3: 4}),
+    ([b'\x63', 81], {}),
+    ([99], None),
+    ([104], None),
+])
+def test_find_conditional_jumps(cmds: list, expected):
+    assert target.find_conditional_jumps(cmds) == expected
+
+
+def test_script_evaluate_long_script():
+    # OP_1 followed by many OP_DUP OP_DROP, and deeply nested OP_IFs
+    n = 20000
+    cmds = [81] + [0x76, 0x75] * n + [81, 99] * 1000 + [104] * 1000
+    limits = target.ScriptLimits(max_ops=10**6, max_script_size=10**6)
+    assert target.Script(cmds).evaluate(0, limits=limits)
+    assert not target.Script(cmds).evaluate(0)
+
+
+def test_script_evaluate_p2sh():
+    z = 12345
+    private_key = PrivateKey(secret=8675309)
+    sec = private_key.public_point.sec()
+    sig = private_key.sign(z).der() + b'\x01'
+    # 1-of-1 multisig as RedeemScript
+    redeem_script = target.Script([81, sec, 81, 174])
+    raw_redeem = redeem_script.raw_serialize()
+    script_pubkey = target.Script([0xa9, hash160(raw_redeem), 0x87])
+    script_sig = target.Script([0, sig, raw_redeem])
+    assert (script_sig + script_pubkey).evaluate(z)
+
+    wrong_hash = target.Script([0xa9, hash160(b'wrong'), 0x87])
+    assert not (script_sig + wrong_hash).evaluate(z)
+
+    # signature of another message matches no key
+    assert not (script_sig + script_pubkey).evaluate(z + 1)
+
+    # batch_verify reaches OP_CHECKMULTISIG
+    pairs = []
+
+    def batch_verify(z: int, candidates: list) -> list:
+        pairs.extend(candidates)
+        return verify_pairs(z, candidates)
+
+    assert (script_sig + script_pubkey).evaluate(z, batch_verify=batch_verify)
+    assert len(pairs) == 1
+
+
+@pytest.mark.parametrize('kwargs, expected', [
+    ({}, False),
+    ({'locktime': 600000}, False),
+    ({'locktime': 600000, 'sequence': 0xfffffffe}, True),
+    ({'locktime': 400000, 'sequence': 0xfffffffe}, False),
+])
+def test_script_evaluate_checklocktimeverify(kwargs: dict, expected: bool):
+    # <500000> OP_CHECKLOCKTIMEVERIFY
+    s = target.Script([encode_num(500000), 177])
+    assert s.evaluate(0, **kwargs) == expected
+
+
+@pytest.mark.parametrize('kwargs, expected', [
+    ({}, False),
+    ({'version': 2, 'sequence': 20}, True),
+    ({'version': 2, 'sequence': 5}, True),
+])
+def test_script_evaluate_checksequenceverify(kwargs: dict, expected: bool):
+    # <10> OP_CHECKSEQUENCEVERIFY
+    s = target.Script([encode_num(10), 178])
+    assert s.evaluate(0, **kwargs) == expected
+
+
+SEC1 = PrivateKey(secret=1).public_point.sec()
+
+
+@pytest.mark.parametrize('cmds, expected', [
+    # 201 OP_NOPs are fine, 202 are not, even when not executed
+    ([81] + [97] * 201, True),
+    ([81] + [97] * 202, False),
+    ([0, 99] + [97] * 201 + [104, 81], False),
+    # pushes are not counted
+    ([81] * 301 + [0x6d] * 150, True),
+    # element size
+    ([b'\x01' * 520], True),
+    ([b'\x01' * 521, 0x75, 81], False),
+    # stack size
+    ([81] * 1000, True),
+    ([81] * 1001, False),
+    ([81] * 999 + [0x6b, 0x76, 0x76], False),
+    # script size
+    ([b'\x01' * 500] * 19 + [0x6d] * 9, True),
+    ([b'\x01' * 500] * 20 + [0x6d] * 10, False),
+    # 0-of-1 OP_CHECKMULTISIG counts its public key
+    ([97] * 199 + [0, 0, SEC1, 81, 174], True),
+    ([97] * 200 + [0, 0, SEC1, 81, 174], False),
+])
+def test_script_evaluate_limits(cmds: list, expected: bool):
+    assert target.Script(cmds).evaluate(0) == expected
+
+
+@pytest.mark.parametrize('script_sig, script_pubkey, expected', [
+    # the op limit applies to each script
+    ([97] * 150, [97] * 100 + [81], True),
+    ([97] * 202, [81], False),
+    ([81], [97] * 202, False),
+    # public keys of OP_CHECKMULTISIG count for the script running it
+    ([97] * 200, [0, 0, SEC1, 81, 174], True),
+    ([81], [97] * 200 + [0, 0, SEC1, 81, 174], False),
+])
+def test_script_evaluate_limits_per_script(script_sig: list, script_pubkey: list,
+                                           expected: bool):
+    s = target.Script(script_sig) + target.Script(script_pubkey)
+    assert s.evaluate(0, script_sig_length=len(script_sig)) == expected
+
+
+# 914 elements: 900 of 1 byte and 14 of 520 bytes, all pushed with
+# OP_PUSHDATA2, which is 10922 bytes but 9122 with minimal pushes
+NON_MINIMAL_PUSHES = (b'\x4d\x01\x00\x01' * 900
+                      + (b'\x4d\x08\x02' + b'\x01' * 520) * 14)
+
+
+def test_script_evaluate_size_non_minimal():
+    s = target.Script(raw=NON_MINIMAL_PUSHES)
+    assert s.size() == 10922
+    assert not s.evaluate(0)
+    # the same cmds, pushed minimally
+    assert target.Script(s.cmds[:]).size() == 9122
+    assert target.Script(s.cmds[:]).evaluate(0)
+
+
+def test_script_evaluate_policy_limits():
+    s = target.Script([81] * 10)
+    assert s.evaluate(0)
+    assert not s.evaluate(0, limits=target.ScriptLimits(max_stack_size=5))
+    s = target.Script([b'\x01' * 100])
+    assert not s.evaluate(0, limits=target.ScriptLimits(max_element_size=80))
+    assert not s.evaluate(0, limits=target.ScriptLimits(max_script_size=100))
+    assert not target.Script([81, 97, 97]).evaluate(
+        0, limits=target.ScriptLimits(max_ops=1))
+
+
+def test_script_parse_lazy():
+    # OP_PUSHDATA1 is not the minimal push for 3 bytes
+    raw = b'\x4c\x03\xff\xee\xdd' + b'\x76'
+    s = target.Script.parse_lazy(BytesIO(b'\x06' + raw + b'\x00'))
+    assert s._cmds is None
+    assert s.serialize() == b'\x06' + raw
+    assert s._cmds is None
+    assert s.cmds == [b'\xff\xee\xdd', 0x76]
+    # still serialized to the original bytes
+    assert s.raw_serialize() == raw
+
+    # changing cmds in place drops the raw bytes as well
+    s.cmds.append(0x87)
+    assert s.raw_serialize() == b'\x03\xff\xee\xdd\x76\x87'
+    s = target.Script.parse_lazy(BytesIO(b'\x06' + raw))
+    s.cmds[1] = 0x87
+    assert s.serialize() == b'\x05\x03\xff\xee\xdd\x87'
+
+    # assigning cmds drops the raw bytes
+    s.cmds = [b'\xff\xee\xdd']
+    assert s.serialize() == b'\x04\x03\xff\xee\xdd'
+
+
+def test_script_parse_lazy_fail():
+    with pytest.raises(SyntaxError):
+        target.Script.parse_lazy(BytesIO(b'\x05\x01\x02'))
+    s = target.Script.parse_lazy(BytesIO(b'\x02\x03\xff'))
+    with pytest.raises(SyntaxError):
+        _ = s.cmds
+
+
+@pytest.mark.parametrize('raw, expected', [
+    (b'', []),
+    (b'\x00\x51', [0, 0x51]),
+    (b'\x02\xff\xee\x87', [b'\xff\xee', 0x87]),
+    (b'\x4d\x02\x00\xff\xee', [b'\xff\xee']),
+])
+def test_decode_cmds(raw: bytes, expected: list):
+    assert target.decode_cmds(raw) == expected
+
+
+@pytest.mark.parametrize('raw', [b'\x02\xff', b'\x4c', b'\x4c\x02\xff', b'\x4d\x02'])
+def test_decode_cmds_fail(raw: bytes):
+    with pytest.raises(SyntaxError):
+        target.decode_cmds(raw)
+
+
+def test_script_interner():
+    interner = target.ScriptInterner(max_entries=2)
+    h160 = bytes(20)
+    raw = target.p2pkh_script(h160).raw_serialize()
+    s1 = interner.parse(BytesIO(target.encode_varint(len(raw)) + raw))
+    s2 = interner.intern(raw)
+    assert s1 is s2
+    assert s1.cmds == target.p2pkh_script(h160).cmds
+    assert s1.pubkey_type() == 'p2pkh'
+    assert interner.stats() == {'entries': 1, 'bytes': 25, 'hits': 1,
+                                'misses': 1, 'saved_bytes': 25}
+
+    # interned scripts are shared, so cmds can not be reassigned
+    with pytest.raises(TypeError):
+        s1.cmds = []
+    # but combined with another script they make an ordinary one
+    combined = s1 + target.Script([0x51])
+    assert type(combined) is target.Script
+    combined.cmds = [0x51]
+    assert combined.serialize() == b'\x01\x51'
+
+    # least recently used script is dropped
+    interner.intern(b'\x6a')
+    interner.intern(b'\x51')
+    assert len(interner) == 2
+    assert interner.intern(raw) is not s1
+    assert interner.stats()['bytes'] == 26
+
+
+@pytest.mark.parametrize('cmds, expected', [
+    ([0x76, 0xa9, bytes(20), 0x88, 0xac], 'p2pkh'),
+    ([0xa9, bytes(20), 0x87], 'p2sh'),
+    ([0x6a], None),
+])
+def test_script_pubkey_type(cmds: list, expected):
+    s = target.Script(cmds)
+    assert s.pubkey_type() == expected
+    s.cmds = [0x6a]
+    assert s.pubkey_type() is None
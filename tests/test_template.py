@@ -0,0 +1,128 @@
+import pytest
+import src.template as target
+from src.helper import hash160
+from src.op import verify_pairs
+from src.script import Script, p2pkh_script
+from src.secp256k1 import PrivateKey
+
+Z = 0x1234567890
+PRIVATE_KEYS = [PrivateKey(secret=secret) for secret in (123, 456, 789)]
+SECS = [pk.public_point.sec() for pk in PRIVATE_KEYS]
+SIGS = [pk.sign(Z).der() + b'\x01' for pk in PRIVATE_KEYS]
+
+
+def p2sh_script(raw_redeem: bytes) -> Script:
+    return Script([0xa9, hash160(raw_redeem), 0x87])
+
+
+def multisig_redeem(m: int, secs: list) -> bytes:
+    return Script([0x50 + m] + secs + [0x50 + len(secs), 0xae]).raw_serialize()
+
+
+REDEEM_2_OF_3 = multisig_redeem(2, SECS)
+P2PKH_SCRIPT = p2pkh_script(hash160(SECS[0]))
+P2SH_SCRIPT = p2sh_script(REDEEM_2_OF_3)
+
+CASES = [
+    # p2pkh
+    (Script([SIGS[0], SECS[0]]), P2PKH_SCRIPT, target.P2PKH),
+    (Script([SIGS[1], SECS[0]]), P2PKH_SCRIPT, target.P2PKH),
+    (Script([SIGS[0], SECS[1]]), P2PKH_SCRIPT, target.P2PKH),
+    (Script([b'\x30\x01\x02\x01', SECS[0]]), P2PKH_SCRIPT, target.P2PKH),
+    (Script([SIGS[0], SECS[0], SECS[0]]), P2PKH_SCRIPT, None),
+    (Script([0x76, SECS[0]]), P2PKH_SCRIPT, None),
+    # p2sh multisig
+    (Script([0, SIGS[0], SIGS[1], REDEEM_2_OF_3]), P2SH_SCRIPT, target.P2SH_MULTISIG),
+    (Script([0, SIGS[0], SIGS[2], REDEEM_2_OF_3]), P2SH_SCRIPT, target.P2SH_MULTISIG),
+    (Script([0, SIGS[1], SIGS[2], REDEEM_2_OF_3]), P2SH_SCRIPT, target.P2SH_MULTISIG),
+    (Script([0, SIGS[1], SIGS[0], REDEEM_2_OF_3]), P2SH_SCRIPT, target.P2SH_MULTISIG),
+    (Script([0, SIGS[0], SIGS[0], REDEEM_2_OF_3]), P2SH_SCRIPT, target.P2SH_MULTISIG),
+    (Script([0, SIGS[0], REDEEM_2_OF_3]), P2SH_SCRIPT, None),
+    (Script([0, SIGS[0], SIGS[1], SIGS[2], REDEEM_2_OF_3]), P2SH_SCRIPT, None),
+    (Script([0, SIGS[0], SIGS[1], multisig_redeem(2, SECS[:2])]), P2SH_SCRIPT, target.P2SH_MULTISIG),
+    (Script([0, SIGS[0], multisig_redeem(1, SECS[:1])]), p2sh_script(multisig_redeem(1, SECS[:1])), target.P2SH_MULTISIG),
+    (Script([81, SIGS[0], SIGS[1], REDEEM_2_OF_3]), P2SH_SCRIPT, None),
+    # p2sh but not multisig: OP_2 OP_EQUAL
+    (Script([0, b'\x02', b'\x52\x87']), p2sh_script(b'\x52\x87'), None),
+    # neither
+    (Script([84]), Script([85, 147, 89, 135]), None),
+    # too large an element
+    (Script([0, SIGS[0], multisig_redeem(1, SECS[:1] * 16)]), p2sh_script(multisig_redeem(1, SECS[:1] * 16)), None),
+]
+
+
+def run(f):
+    try:
+        return f()
+    except Exception as e:
+        return type(e)
+
+
+@pytest.mark.parametrize('script_sig, script_pubkey, template', CASES)
+def test_classify_script(script_sig: Script, script_pubkey: Script, template):
+    assert target.classify_script(script_sig, script_pubkey) == template
+
+
+@pytest.mark.parametrize('script_sig, script_pubkey, template', CASES)
+@pytest.mark.parametrize('z', [Z, Z + 1])
+def test_evaluate_scripts_differential(script_sig: Script,
+                                       script_pubkey: Script, template,
+                                       z: int):
+    # the fast paths must agree with the generic interpreter
+    generic = run(lambda: (script_sig + script_pubkey).evaluate(z))
+    fast = run(lambda: target.evaluate_scripts(script_sig, script_pubkey, z))
+    assert fast == generic
+
+
+def test_evaluate_scripts_p2pkh():
+    assert target.evaluate_scripts(Script([SIGS[0], SECS[0]]), P2PKH_SCRIPT, Z)
+    assert not target.evaluate_scripts(Script([SIGS[0], SECS[0]]),
+                                       P2PKH_SCRIPT, Z + 1)
+
+
+def test_evaluate_scripts_limits_per_script():
+    # 250 ops in total, but no more than 201 in either script
+    assert target.evaluate_scripts(Script([0x61] * 150),
+                                   Script([0x61] * 100 + [0x51]), Z)
+    assert not target.evaluate_scripts(Script([0x61] * 202), Script([0x51]), Z)
+    # as does the size limit, on the serialized scripts
+    big = [b'\x01' * 500] * 19 + [0x6d] * 9
+    assert target.evaluate_scripts(Script(big), Script(big + [0x51]), Z)
+    assert not target.evaluate_scripts(Script([b'\x01' * 500] * 20 + [0x6d] * 10),
+                                       Script([0x51]), Z)
+    # 10922 bytes, but 9122 if the pushes were minimal
+    non_minimal = b'\x4d\x01\x00\x01' * 900 + (b'\x4d\x08\x02' + b'\x01' * 520) * 14
+    assert not target.evaluate_scripts(Script(raw=non_minimal), Script([0x51]), Z)
+    assert target.evaluate_scripts(Script(Script(raw=non_minimal).cmds[:]),
+                                   Script([0x51]), Z)
+
+
+def test_evaluate_scripts_batch_verify():
+    pairs = []
+
+    def batch_verify(z: int, candidates: list) -> list:
+        pairs.extend(candidates)
+        return verify_pairs(z, candidates)
+
+    # p2sh multisig template and bare multisig (generic evaluation)
+    for script_sig, script_pubkey in (
+            (Script([0, SIGS[0], SIGS[2], REDEEM_2_OF_3]), P2SH_SCRIPT),
+            (Script([0, SIGS[0], SIGS[2]]), Script([0x52] + SECS + [0x53, 0xae]))):
+        pairs.clear()
+        assert target.evaluate_scripts(script_sig, script_pubkey, Z,
+                                       batch_verify=batch_verify)
+        assert pairs
+
+
+@pytest.mark.parametrize('raw_redeem, expected', [
+    (REDEEM_2_OF_3, (2, SECS)),
+    (multisig_redeem(1, SECS[:1]), (1, SECS[:1])),
+    (Script([0x53, SECS[0], 0x51, 0xae]).raw_serialize(), None),
+    (Script([0x51, SECS[0], SECS[1], 0x51, 0xae]).raw_serialize(), None),
+    (Script([0x51, 0x51, 0x51, 0xae]).raw_serialize(), None),
+    (Script([0x51, SECS[0], 0x51, 0xac]).raw_serialize(), None),
+    (b'\x52\x87', None),
+    (b'\x4c', None),
+])
+def test_parse_multisig_redeem_script(raw_redeem: bytes, expected):
+    assert target.parse_multisig_redeem_script(raw_redeem) == expected
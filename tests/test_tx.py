@@ -1,9 +1,11 @@
+import asyncio
 from io import BytesIO
 from typing import Optional
 
 import pytest
 import src.tx as target
-from src.script import Script
+from src.backend import AsyncHttpBackend, HttpBackend, StubServer
+from src.script import Script, p2pkh_script
 from src.secp256k1 import PrivateKey
 
 
@@ -141,3 +143,138 @@ def test_tx_coinbase_height():
     stream2 = BytesIO(raw_tx2)
     tx2 = target.Tx.parse(stream2)
     assert tx2.coinbase_height() is None
+
+
+def test_tx_fetcher_store(tmp_path):
+    tx_id = '452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03'
+    raw_tx = bytes.fromhex(
+        '0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600'
+    )
+    filename = str(tmp_path / 'tx.dat')
+    target.TxFetcher.open_store(filename)
+    try:
+        target.TxFetcher.store.put(tx_id, raw_tx)
+        target.TxFetcher.cache.pop(tx_id, None)
+        tx = target.TxFetcher.fetch(tx_id)
+        assert tx.id() == tx_id
+        assert target.TxFetcher.cache[tx_id] is tx
+    finally:
+        target.TxFetcher.close_store()
+        target.TxFetcher.cache.pop(tx_id, None)
+    assert target.TxFetcher.store is None
+
+
+def make_prev_txs(n: int) -> list:
+    # independent transactions paying 1000 * (i + 1) to a p2pkh script
+    return [
+        target.Tx(1, [target.TxIn(bytes([i + 1]) * 32, 0)],
+                  [target.TxOut(1000 * (i + 1), p2pkh_script(b'\x00' * 20))],
+                  0) for i in range(n)
+    ]
+
+
+def test_tx_fetcher_fetch_many():
+    prev_txs = make_prev_txs(5)
+    txs = {tx.id(): tx.serialize() for tx in prev_txs}
+    backend = target.TxFetcher.backend
+    with StubServer(txs) as server:
+        target.TxFetcher.backend = HttpBackend(mainnet_url=server.url)
+        try:
+            # one of them is already cached
+            target.TxFetcher.fetch(prev_txs[0].id())
+            fetched = target.TxFetcher.fetch_many(list(txs) + list(txs))
+            assert server.n_requests == 5
+            assert sorted(fetched) == sorted(txs)
+            for tx_id, tx in fetched.items():
+                assert tx.serialize() == txs[tx_id]
+
+            # spend all of them
+            tx_ins = [target.TxIn(tx.hash(), 0) for tx in prev_txs]
+            tx_outs = [target.TxOut(10000, p2pkh_script(b'\x00' * 20))]
+            tx = target.Tx(1, tx_ins, tx_outs, 0)
+            assert tx.fee() == 5000
+            assert server.n_requests == 5
+        finally:
+            target.TxFetcher.backend = backend
+            for tx_id in txs:
+                target.TxFetcher.cache.discard(tx_id)
+
+
+def test_tx_verify_async():
+    private_key = PrivateKey(secret=8675309)
+    h160 = private_key.public_point.hash160()
+    prev_txs = [
+        target.Tx(1, [target.TxIn(bytes([i + 1]) * 32, 0)],
+                  [target.TxOut(1000, p2pkh_script(h160))], 0)
+        for i in range(3)
+    ]
+    txs = {tx.id(): tx.serialize() for tx in prev_txs}
+    tx_ins = [target.TxIn(tx.hash(), 0) for tx in prev_txs]
+    tx_outs = [target.TxOut(2500, p2pkh_script(h160))]
+    tx = target.Tx(1, tx_ins, tx_outs, 0)
+
+    backend = target.TxFetcher.backend
+    async_backend = target.AsyncTxFetcher.backend
+    with StubServer(txs) as server:
+        target.TxFetcher.backend = HttpBackend(mainnet_url=server.url)
+        target.AsyncTxFetcher.backend = AsyncHttpBackend(
+            mainnet_url=server.url)
+        try:
+            for i in range(len(tx_ins)):
+                assert tx.sign_input(private_key, i)
+            for tx_id in txs:
+                target.TxFetcher.cache.discard(tx_id)
+            n_requests = server.n_requests
+
+            assert asyncio.run(tx.verify_async())
+            assert server.n_requests == n_requests + len(txs)
+        finally:
+            target.TxFetcher.backend = backend
+            target.AsyncTxFetcher.backend = async_backend
+            for tx_id in txs:
+                target.TxFetcher.cache.discard(tx_id)
+
+
+def test_tx_resolve_prevouts_with_utxos():
+    private_key = PrivateKey(secret=8675309)
+    script_pubkey = p2pkh_script(private_key.public_point.hash160())
+    utxos = {
+        (bytes([i + 1]) * 32, i): target.TxOut(1000 * (i + 1), script_pubkey)
+        for i in range(3)
+    }
+    tx_ins = [target.TxIn(prev_tx, prev_index) for prev_tx, prev_index in utxos]
+    tx = target.Tx(1, tx_ins, [target.TxOut(5000, script_pubkey)], 0)
+
+    # nothing is fetched, everything comes from the given utxos
+    assert tx.fee(utxos) == 1000
+    assert tx.prevouts == utxos
+    assert tx.prevout(2) is utxos[(b'\x03' * 32, 2)]
+    for i in range(len(tx_ins)):
+        assert tx.sign_input(private_key, i)
+    assert tx.verify(utxos)
+
+    utxos[(b'\x01' * 32, 0)] = target.TxOut(0, script_pubkey)
+    assert tx.fee(utxos) == 0
+    assert not tx.verify({(b'\x01' * 32, 0): target.TxOut(0, script_pubkey),
+                          (b'\x02' * 32, 1): target.TxOut(0, script_pubkey)})
+
+
+def test_tx_parse_segwit():
+    tx_ins = [target.TxIn(b'\x01' * 32, 0, witness=[b'\x30' * 71, b'\x02' * 33]),
+              target.TxIn(b'\x02' * 32, 1, Script([b'\xff']), witness=[])]
+    tx_outs = [target.TxOut(1000, p2pkh_script(b'\x00' * 20))]
+    tx = target.Tx(2, tx_ins, tx_outs, 100, segwit=True)
+    raw = tx.serialize_segwit()
+    assert raw[4:6] == b'\x00\x01'
+
+    parsed = target.Tx.parse(BytesIO(raw))
+    assert parsed.segwit
+    assert parsed.tx_ins[0].witness == [b'\x30' * 71, b'\x02' * 33]
+    assert parsed.tx_ins[1].witness == []
+    assert parsed.locktime == 100
+    assert parsed.serialize_segwit() == raw
+    # the id does not depend on the witness
+    assert parsed.id() == target.Tx.parse(BytesIO(tx.serialize())).id()
+
+    with pytest.raises(SyntaxError):
+        target.Tx.parse(BytesIO(raw[:5] + b'\x02' + raw[6:]))
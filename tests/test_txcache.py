@@ -0,0 +1,88 @@
+from io import BytesIO
+
+import src.txcache as target
+from src.script import p2pkh_script
+from src.tx import Tx, TxIn, TxOut, parse_raw_tx
+
+
+class DummyTx:
+    def __init__(self, raw: bytes):
+        self.raw = raw
+
+    def serialize_segwit(self) -> bytes:
+        return self.raw
+
+
+def new_cache(**kwargs) -> target.TxCache:
+    return target.TxCache(parse=DummyTx, **kwargs)
+
+
+def test_txcache_get_put():
+    cache = new_cache()
+    assert cache.get('a') is None
+    cache['a'] = DummyTx(b'\x01' * 10)
+    assert 'a' in cache
+    assert cache['a'].raw == b'\x01' * 10
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.n_bytes == 10 * cache.parsed_size_factor
+    assert cache.pop('a').raw == b'\x01' * 10
+    assert len(cache) == 0
+    assert cache.n_bytes == 0
+
+
+def test_txcache_max_entries():
+    cache = new_cache(max_entries=2)
+    cache['a'] = DummyTx(b'a')
+    cache['b'] = DummyTx(b'b')
+    cache.get('a')
+    cache['c'] = DummyTx(b'c')
+    # 'b' is the least recently used
+    assert list(cache) == ['a', 'c']
+    assert cache.evictions == 1
+
+
+def test_txcache_max_bytes():
+    cache = new_cache(max_bytes=25 * target.TxCache.parsed_size_factor)
+    for key in 'abc':
+        cache[key] = DummyTx(key.encode() * 10)
+    assert list(cache) == ['b', 'c']
+    assert cache.n_bytes == 20 * cache.parsed_size_factor
+
+
+def test_txcache_hot_entries():
+    cache = new_cache(hot_entries=1)
+    cache['a'] = DummyTx(b'a' * 10)
+    cache['b'] = DummyTx(b'b' * 10)
+    assert list(cache.hot) == ['b']
+    assert cache.cold['a'] == b'a' * 10
+    assert cache.n_bytes == 10 + 10 * cache.parsed_size_factor
+
+    # access parses the cold entry again and demotes the other one
+    assert cache['a'].raw == b'a' * 10
+    assert list(cache.hot) == ['a']
+    assert list(cache.cold) == ['b']
+    assert dict(cache.raw_items()) == {'a': b'a' * 10, 'b': b'b' * 10}
+
+
+def test_txcache_put_raw_evicted_first():
+    cache = new_cache(max_entries=2)
+    cache['a'] = DummyTx(b'a')
+    cache.put_raw('b', b'b')
+    cache['c'] = DummyTx(b'c')
+    assert list(cache) == ['a', 'c']
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.n_bytes == 0
+
+
+def test_txcache_segwit():
+    tx = Tx(1, [TxIn(b'\x01' * 32, 0, witness=[b'\x30' * 71, b'\x02' * 33])],
+            [TxOut(1000, p2pkh_script(b'\x00' * 20))], 0, segwit=True)
+    cache = target.TxCache(parse=parse_raw_tx, hot_entries=0)
+    cache[tx.id()] = tx
+    # demoted to raw bytes, the witness is kept
+    assert cache.cold[tx.id()] == tx.serialize_segwit()
+    assert cache[tx.id()].segwit
+    assert dict(cache.raw_items()) == {tx.id(): tx.serialize_segwit()}
+    assert Tx.parse(BytesIO(dict(cache.raw_items())[tx.id()])).tx_ins[0].witness == tx.tx_ins[0].witness
@@ -0,0 +1,85 @@
+import json
+
+import src.txstore as target
+
+RAW_TX1 = bytes.fromhex(
+    '0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600'
+)
+TX_ID1 = '11' * 32
+TX_ID2 = '22' * 32
+
+
+def test_txstore_put_get(tmp_path):
+    filename = str(tmp_path / 'tx.dat')
+    with target.TxStore(filename) as store:
+        assert len(store) == 0
+        assert store.get(TX_ID1) is None
+        store.put(TX_ID1, RAW_TX1)
+        store.put(TX_ID2, b'\x01\x02\x03')
+        assert TX_ID1 in store
+        assert store.get(TX_ID1) == RAW_TX1
+        assert store.get(TX_ID2) == b'\x01\x02\x03'
+        # already stored entries are not appended again
+        store.put(TX_ID1, RAW_TX1)
+        assert len(store) == 2
+
+    # reopen: only the index is loaded
+    with target.TxStore(filename) as store:
+        assert len(store) == 2
+        assert sorted(store) == [TX_ID1, TX_ID2]
+        assert store.get(TX_ID1) == RAW_TX1
+        assert store.get(TX_ID2) == b'\x01\x02\x03'
+
+
+def test_txstore_truncated_index(tmp_path):
+    filename = str(tmp_path / 'tx.dat')
+    with target.TxStore(filename) as store:
+        store.put(TX_ID1, RAW_TX1)
+    with open(filename + '.idx', 'ab') as writer:
+        writer.write(b'\x00' * 10)
+    with target.TxStore(filename) as store:
+        assert len(store) == 1
+        assert store.get(TX_ID1) == RAW_TX1
+        # the partial record is dropped before appending
+        store.put(TX_ID2, b'\x01\x02\x03')
+    with target.TxStore(filename) as store:
+        assert sorted(store) == [TX_ID1, TX_ID2]
+        assert store.get(TX_ID2) == b'\x01\x02\x03'
+
+
+def test_txstore_compact(tmp_path):
+    filename = str(tmp_path / 'tx.dat')
+    tx_ids = [bytes([i * 37 % 256]).hex() * 32 for i in range(1, 40)]
+    with target.TxStore(filename) as store:
+        store.merge_threshold = 8
+        for i, tx_id in enumerate(tx_ids):
+            store.put(tx_id, bytes([i]) * (i + 1))
+        assert store.n_sorted == 32
+        assert len(store.pending) == 7
+        # a txid which sorts between the stored ones is not found
+        assert store.get('00' * 32) is None
+        assert all(store.get(tx_id) == bytes([i]) * (i + 1)
+                   for i, tx_id in enumerate(tx_ids))
+
+    # reopen: only the unmerged records are read
+    with target.TxStore(filename) as store:
+        assert store.n_sorted == 32
+        assert len(store.pending) == 7
+        assert sorted(store) == sorted(tx_ids)
+        store.compact()
+        assert len(store.pending) == 0
+        assert len(store) == 39
+    with target.TxStore(filename) as store:
+        assert store.n_sorted == 39
+        assert list(store) == sorted(tx_ids)
+        assert all(store.get(tx_id) == bytes([i]) * (i + 1)
+                   for i, tx_id in enumerate(tx_ids))
+
+
+def test_txstore_import_json(tmp_path):
+    json_filename = str(tmp_path / 'tx.cache')
+    with open(json_filename, 'w') as writer:
+        writer.write(json.dumps({TX_ID1: RAW_TX1.hex()}))
+    with target.TxStore(str(tmp_path / 'tx.dat')) as store:
+        store.import_json(json_filename)
+        assert store.get(TX_ID1) == RAW_TX1
@@ -0,0 +1,179 @@
+import pytest
+import src.utxo as target
+from src.script import Script, p2pkh_script
+from src.secp256k1 import PrivateKey
+from src.tx import Tx, TxIn, TxOut
+
+PRIVATE_KEY = PrivateKey(secret=8675309)
+SCRIPT_PUBKEY = p2pkh_script(PRIVATE_KEY.public_point.hash160())
+
+
+def make_coinbase(amount: int, height: int) -> Tx:
+    tx_in = TxIn(b'\x00' * 32, 0xffffffff, Script([bytes([height])]))
+    return Tx(1, [tx_in], [TxOut(amount, SCRIPT_PUBKEY)], 0)
+
+
+def test_outpoint_encode_decode():
+    outpoint = (b'\x12' * 32, 3)
+    key = target.encode_outpoint(outpoint)
+    assert len(key) == 36
+    assert target.decode_outpoint(key) == outpoint
+
+
+@pytest.mark.parametrize('use_disk, max_hot', [
+    (False, None),
+    (True, None),
+    (True, 1),
+])
+def test_utxo_set_apply_undo(tmp_path, use_disk: bool, max_hot):
+    filename = str(tmp_path / 'utxo') if use_disk else None
+    with target.UtxoSet(filename, max_hot=max_hot) as utxos:
+        coinbase1 = make_coinbase(5000, 1)
+        undo1 = utxos.apply_block([coinbase1])
+        assert undo1 == []
+        assert utxos[(coinbase1.hash(), 0)].amount == 5000
+
+        # spend the coinbase, and spend its output in the same block
+        coinbase2 = make_coinbase(5000, 2)
+        tx1 = Tx(1, [TxIn(coinbase1.hash(), 0)], [
+            TxOut(3000, SCRIPT_PUBKEY),
+            TxOut(1500, SCRIPT_PUBKEY),
+            TxOut(0, Script([0x6a, b'data'])),
+        ], 0)
+
+        # fee and verify run offline against the utxo set
+        tx1.resolve_prevouts(utxos)
+        assert tx1.sign_input(PRIVATE_KEY, 0)
+        assert tx1.verify(utxos)
+        assert tx1.fee(utxos) == 500
+        tx2 = Tx(1, [TxIn(tx1.hash(), 0)], [TxOut(2500, SCRIPT_PUBKEY)], 0)
+
+        block2 = [coinbase2, tx1, tx2]
+        undo2 = utxos.apply_block(block2)
+        assert (coinbase1.hash(), 0) not in utxos
+        assert (tx1.hash(), 0) not in utxos
+        assert (tx1.hash(), 2) not in utxos
+        assert sorted(utxos) == sorted([(coinbase2.hash(), 0),
+                                        (tx1.hash(), 1), (tx2.hash(), 0)])
+        assert len(utxos) == 3
+
+        utxos.undo_block(block2, undo2)
+        assert sorted(utxos) == [(coinbase1.hash(), 0)]
+        assert utxos[(coinbase1.hash(), 0)].serialize() \
+            == coinbase1.tx_outs[0].serialize()
+
+
+def test_utxo_set_reopen(tmp_path):
+    filename = str(tmp_path / 'utxo')
+    coinbase = make_coinbase(5000, 1)
+    with target.UtxoSet(filename) as utxos:
+        utxos.apply_block([coinbase])
+    with target.UtxoSet(filename) as utxos:
+        assert len(utxos.hot) == 0
+        assert utxos[(coinbase.hash(), 0)].amount == 5000
+
+
+def test_utxo_set_evicts_oldest(tmp_path):
+    with target.UtxoSet(str(tmp_path / 'utxo'), max_hot=2) as utxos:
+        tx_out = TxOut(1000, SCRIPT_PUBKEY)
+        for i in range(4):
+            utxos.add((bytes([i]) * 32, 0), tx_out)
+        # the newest outputs stay in memory
+        assert list(utxos.hot) == [(b'\x02' * 32, 0), (b'\x03' * 32, 0)]
+        assert len(utxos.db) == 2
+        assert utxos[(b'\x00' * 32, 0)].amount == 1000
+
+
+def test_utxo_set_undecodable_script_pubkey():
+    utxos = target.UtxoSet()
+    coinbase = make_coinbase(5000, 1)
+    coinbase.tx_outs.append(TxOut(0, Script(raw=b'\x4c')))
+    utxos.apply_tx(coinbase)
+    assert utxos[(coinbase.hash(), 1)].script_pub_key.raw_serialize() == b'\x4c'
+
+
+def test_utxo_set_missing_input():
+    utxos = target.UtxoSet()
+    coinbase = make_coinbase(5000, 1)
+    tx = Tx(1, [TxIn(coinbase.hash(), 0), TxIn(b'\x01' * 32, 0)],
+            [TxOut(3000, SCRIPT_PUBKEY)], 0)
+    with pytest.raises(KeyError):
+        utxos.apply_block([coinbase, tx])
+    # nothing is left applied
+    assert len(utxos) == 0
+    assert utxos.get((coinbase.hash(), 0)) is None
+    with pytest.raises(KeyError):
+        utxos[(coinbase.hash(), 0)]
+
+
+def test_compact_utxo_set():
+    items = [((bytes([i]) * 32, i % 3), 1000 * i, bytes([0x51 + i % 16]))
+             for i in range(50, 0, -1)]
+    utxos = target.CompactUtxoSet.from_items(items)
+    assert len(utxos) == 50
+    assert list(utxos) == sorted(outpoint for outpoint, _, _ in items)
+    assert utxos.amount((b'\x07' * 32, 1)) == 7000
+    assert utxos.raw_script_pubkey((b'\x07' * 32, 1)) == b'\x58'
+    tx_out = utxos[(b'\x07' * 32, 1)]
+    assert tx_out.amount == 7000
+    assert tx_out.script_pub_key.cmds == [0x58]
+    assert (b'\x07' * 32, 2) not in utxos
+    with pytest.raises(KeyError):
+        utxos[(b'\x07' * 32, 2)]
+    with pytest.raises(ValueError):
+        utxos.load([((b'\x07' * 32, 1), 1, b'')])
+
+    assert utxos.spend((b'\x07' * 32, 1)).amount == 7000
+    assert (b'\x07' * 32, 1) not in utxos
+    with pytest.raises(KeyError):
+        utxos.spend((b'\x07' * 32, 1))
+    assert len(utxos) == 49
+    size = utxos.memory_usage()
+    utxos.compact()
+    assert len(utxos) == 49
+    assert utxos.memory_usage() < size
+
+    utxos.load([((b'\x07' * 32, 1), 1, b'\x00')])
+    assert len(utxos) == 50
+    assert utxos.amount((b'\x07' * 32, 1)) == 1
+
+
+def test_compact_utxo_set_load_batches():
+    items = [((bytes([i * 7 % 256]) * 32, i % 3), 1000 * i, bytes([i]) * (i % 5))
+             for i in range(60)]
+    utxos = target.CompactUtxoSet()
+    for start in range(0, 60, 25):
+        utxos.load(items[start:start + 25])
+    whole = target.CompactUtxoSet.from_items(items)
+    assert list(utxos) == list(whole)
+    assert all(utxos.amount(outpoint) == amount
+               and utxos.raw_script_pubkey(outpoint) == script
+               for outpoint, amount, script in items)
+    # a failed load leaves the set unchanged
+    with pytest.raises(ValueError):
+        utxos.load([((b'\xff' * 32, 0), 1, b''), items[3]])
+    assert (b'\xff' * 32, 0) not in utxos
+    assert len(utxos) == 60
+
+    # a spent output is replaced without compacting first
+    outpoint = items[14][0]
+    utxos.spend(outpoint)
+    utxos.load([(outpoint, 5, b'\x51')])
+    assert len(utxos) == 60
+    assert utxos.amount(outpoint) == 5
+    size = utxos.memory_usage()
+    utxos.compact()
+    assert utxos.memory_usage() < size
+    assert utxos.raw_script_pubkey(outpoint) == b'\x51'
+    assert list(utxos) == list(whole)
+
+
+def test_compact_utxo_set_from_txs():
+    coinbase = make_coinbase(5000, 1)
+    utxos = target.CompactUtxoSet.from_txs([coinbase])
+    assert list(utxos) == [(coinbase.hash(), 0)]
+    assert utxos[(coinbase.hash(), 0)].serialize() \
+        == coinbase.tx_outs[0].serialize()
+
+    tx = Tx(1, [TxIn(coinbase.hash(), 0)], [TxOut(4000, SCRIPT_PUBKEY)], 0)
+    assert tx.fee(utxos) == 1000